@@ -7,6 +7,7 @@
   hatchling,
   sqlalchemy,
   alembic,
+  cryptography,
 }:
 
 buildPythonPackage {
@@ -24,6 +25,7 @@ buildPythonPackage {
     sqlalchemy
     jinja2
     alembic
+    cryptography
   ];
 
   meta = with lib; {
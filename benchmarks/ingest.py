@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+"""
+Benchmark of attestation ingest
+
+Submits single-output attestations from many concurrent clients to a
+scratch SQLite database, once with a transaction per submission (the
+default) and once through the group committer, and reports the
+sustained throughput of each.
+
+Usage: python benchmarks/ingest.py [--clients N] [--submissions N]
+"""
+import argparse
+import pathlib
+import random
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, str(pathlib.Path(__file__).parent.parent))
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from report_queries import migrate
+from web import crud, ingest, models, nix, schemas
+
+
+def submission(rnd):
+    digest = nix.base32_encode(rnd.randbytes(20))
+    return f"{digest}-package", [schemas.OutputHashPair(
+        output_digest=digest,
+        output_name="package",
+        output_hash="sha256:" + nix.base32_encode(rnd.randbytes(32)),
+        output_sig="cache.nixos.org-1:" + "A" * 86 + "==",
+    )]
+
+
+def direct(session_factory, user_id):
+    def submit(drv_hash, output_hash_map):
+        db = session_factory()
+        try:
+            crud.create_attestation(db, drv_hash, output_hash_map, user_id)
+        finally:
+            db.close()
+    return submit, lambda: None
+
+
+def grouped(session_factory, user_id):
+    committer = ingest.GroupCommitter(session_factory, queue_size=100000)
+
+    def submit(drv_hash, output_hash_map):
+        committer.submit(crud.attestation_records(drv_hash, output_hash_map), user_id).result()
+    return submit, committer.stop
+
+
+def run(label, mode, n_clients, n_submissions):
+    with tempfile.TemporaryDirectory() as tmp:
+        engine = create_engine(f"sqlite:///{tmp}/bench.db", connect_args={"check_same_thread": False})
+        migrate(engine)
+        session_factory = sessionmaker(bind=engine)
+        db = session_factory()
+        user_id = models.User.create(db, name="builder").id
+        db.close()
+        submit, stop = mode(session_factory, user_id)
+        errors = []
+
+        def client(seed):
+            rnd = random.Random(seed)
+            for _ in range(n_submissions):
+                try:
+                    submit(*submission(rnd))
+                except Exception as e:
+                    errors.append(e)
+
+        threads = [threading.Thread(target=client, args=(i,)) for i in range(n_clients)]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - start
+        stop()
+        total = n_clients * n_submissions
+        print(f"{label:<16} {total / elapsed:8.0f} submissions/s   {len(errors)} failed")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--clients", type=int, default=32)
+    parser.add_argument("--submissions", type=int, default=50)
+    args = parser.parse_args()
+
+    run("per request", direct, args.clients, args.submissions)
+    run("group commit", grouped, args.clients, args.submissions)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,302 @@
+#!/usr/bin/env python3
+"""
+Load test of a running server with a production-like traffic mix
+
+Simulates, concurrently and each at its own rate:
+- post-build hooks submitting attestations,
+- rebuilders polling a report for suggested rebuilds,
+- substituters fetching narinfo files,
+- people viewing a report (HTML, text, tree fragments and rollups) and
+  the closures of its paths,
+and reports the request rate, error rate and latency percentiles of each
+endpoint.
+
+By default it starts uvicorn on localhost against a scratch SQLite
+database, filled with a report whose paths are attested by a cache and,
+in part, by a rebuilder. Pass --url, --token and --report to run it
+against a server of your own instead.
+
+Requests follow Poisson arrivals and latencies are measured from when a
+request was due rather than when it was sent, so a server that falls
+behind shows up in the percentiles instead of slowing the load down.
+
+Usage: python benchmarks/load.py [--duration S] [--hooks N] [--hook-rate R] ...
+"""
+import argparse
+import asyncio
+import base64
+import collections
+import os
+import pathlib
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+
+sys.path.insert(0, str(pathlib.Path(__file__).parent.parent))
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from report_queries import migrate
+from web import crud, models, nix
+
+REPORT = "load-test"
+CACHE_USER = "cache.nixos.org"
+SIG_KEY = "cache.nixos.org-1"
+
+
+def random_hash(rnd):
+    return "sha256:" + nix.base32_encode(rnd.randbytes(32))
+
+
+def random_sig(rnd):
+    return f"{SIG_KEY}:" + base64.b64encode(rnd.randbytes(64)).decode()
+
+
+def populate(url: str, n_paths: int, rnd) -> str:
+    """Fill a migrated database with users and a report, returning the
+    token of the hooks and rebuilders"""
+    engine = create_engine(url)
+    db = sessionmaker(bind=engine)()
+    token = "load-test-token"
+    users = {}
+    for name in (CACHE_USER, "builder"):
+        user = models.User.create(db, name=name)
+        users[name] = user.id
+    models.Token.create(db, user=db.get(models.User, users["builder"]), value=token)
+
+    paths = [nix.store_path(nix.base32_encode(rnd.randbytes(20)), f"package-{i}-1.0") for i in range(n_paths)]
+    # Each package depends on a few later ones, so the report is a DAG
+    # with shared dependencies like a real closure
+    dependencies = {
+        path: sorted({paths[rnd.randrange(i + 1, n_paths)] for _ in range(3)})
+        for i, path in enumerate(paths[:-1])
+    }
+    crud.define_report(db, REPORT, {
+        "metadata": {"component": {"bom-ref": paths[0]}},
+        "components": [
+            {"bom-ref": path, "properties": [{"name": "nix:out_path", "value": path}]}
+            for path in paths[1:]
+        ],
+        "dependencies": [{"ref": path, "dependsOn": refs} for path, refs in dependencies.items()],
+    })
+    cache, rebuilt = [], []
+    for path in paths[1:]:
+        digest, name = nix.split_store_path(path)
+        nar_hash = random_hash(rnd)
+        # Sizes and build times spread over orders of magnitude, as in nixpkgs
+        nar_size = int(10 ** rnd.uniform(3, 9))
+        references = dependencies.get(path, [])
+        cache.append((f"{digest}-{name}", path, nar_hash, random_sig(rnd), nar_size, None, references))
+        if rnd.random() < 0.3:
+            rebuilt.append((f"{digest}-{name}", path, nar_hash if rnd.random() < 0.9 else random_hash(rnd), random_sig(rnd),
+                            nar_size, 10 ** rnd.uniform(0, 4), references))
+    crud.create_attestations(db, cache, users[CACHE_USER])
+    crud.create_attestations(db, rebuilt, users["builder"])
+    db.close()
+    return token
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_server(tmp: str, url: str, workers: int, env: dict) -> tuple[subprocess.Popen, str]:
+    port = free_port()
+    root = pathlib.Path(__file__).parent.parent
+    log = open(pathlib.Path(tmp) / "server.log", "w")
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "--factory", "web:create_app",
+         "--host", "127.0.0.1", "--port", str(port), "--workers", str(workers), "--no-access-log"],
+        env=dict(os.environ, SQLALCHEMY_DATABASE_URL=url, PYTHONPATH=str(root), **env),
+        cwd=tmp, stdout=log, stderr=subprocess.STDOUT,
+    )
+    base_url = f"http://127.0.0.1:{port}"
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        if server.poll() is not None:
+            sys.exit(f"Server exited, see {log.name}")
+        try:
+            if httpx.get(base_url + "/ready", trust_env=False).status_code == 200:
+                return server, base_url
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    server.terminate()
+    sys.exit(f"Server didn't become ready, see {log.name}")
+
+
+class Traffic:
+    """The requests each kind of client sends, as (label, method, url,
+    request arguments, expected status codes)"""
+
+    def __init__(self, report: str, token: str, paths: list[str], narinfo_user: str):
+        self.report = report
+        self.auth = {"Authorization": f"Bearer {token}"}
+        self.paths = paths
+        self.narinfo_user = narinfo_user
+
+    def hook(self, rnd):
+        # Mostly new builds, some rebuilds of paths in the report
+        if rnd.random() < 0.2:
+            digest, name = nix.split_store_path(rnd.choice(self.paths))
+        else:
+            digest, name = nix.base32_encode(rnd.randbytes(20)), "package-1.0"
+        output = {"output_digest": digest, "output_name": name, "output_hash": random_hash(rnd), "output_sig": random_sig(rnd)}
+        return "POST /attestation/{drv}", "POST", f"/attestation/{digest}-{name}", {"json": [output], "headers": self.auth}, {200}
+
+    def rebuilder(self, rnd):
+        return "GET /reports/{name}/suggest", "GET", f"/reports/{self.report}/suggest", {"headers": self.auth}, {200}
+
+    def substituter(self, rnd):
+        # Substituters also ask for paths nobody attested
+        if rnd.random() < 0.9:
+            digest, _ = nix.split_store_path(rnd.choice(self.paths))
+        else:
+            digest = nix.base32_encode(rnd.randbytes(20))
+        return "GET /signatures/{user}/{digest}.narinfo", "GET", f"/signatures/{self.narinfo_user}/{digest}.narinfo", {}, {200, 404}
+
+    def viewer(self, rnd):
+        choice = rnd.random()
+        if choice < 0.4:
+            return "GET /reports/{name} (html)", "GET", f"/reports/{self.report}", {"headers": {"Accept": "text/html"}}, {200}
+        if choice < 0.6:
+            return "GET /reports/{name} (text)", "GET", f"/reports/{self.report}", {"headers": {"Accept": "text/plain"}}, {200}
+        if choice < 0.8:
+            return "GET /reports/{name}/tree", "GET", f"/reports/{self.report}/tree", {"params": {"node": rnd.choice(self.paths)}}, {200}
+        if choice < 0.9:
+            path = rnd.choice(self.paths).removeprefix(nix.STORE_DIR)
+            return "GET /closure/{path}/summary", "GET", f"/closure/{path}/summary", {}, {200, 404}
+        return "GET /reports/{name}/rollup", "GET", f"/reports/{self.report}/rollup", {}, {200}
+
+
+class Stats:
+    def __init__(self):
+        self.latencies = []
+        self.unexpected = collections.Counter()
+
+    def record(self, latency: float, status):
+        self.latencies.append(latency)
+        if status is not None:
+            self.unexpected[status] += 1
+
+
+async def simulate(client: httpx.AsyncClient, request, rate: float, deadline: float, stats: dict, seed: int):
+    """One client sending requests at rate per second on average until
+    deadline"""
+    rnd = random.Random(seed)
+    due = time.perf_counter() + rnd.expovariate(rate)
+    while due < deadline:
+        delay = due - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        label, method, url, kwargs, expected = request(rnd)
+        try:
+            status = (await client.request(method, url, **kwargs)).status_code
+        except httpx.HTTPError as e:
+            status = type(e).__name__
+        stats[label].record(time.perf_counter() - due, None if status in expected else status)
+        due += rnd.expovariate(rate)
+
+
+def percentile(ordered: list[float], p: float) -> float:
+    return ordered[min(len(ordered) - 1, int(p / 100 * len(ordered)))]
+
+
+def print_stats(stats: dict, duration: float):
+    print(f"{'endpoint':<40} {'requests':>8} {'per s':>7} {'errors':>7} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}")
+    for label, s in sorted(stats.items()):
+        ordered = sorted(s.latencies)
+        errors = sum(s.unexpected.values())
+        print(
+            f"{label:<40} {len(ordered):>8} {len(ordered) / duration:>7.1f} {100 * errors / len(ordered):>6.1f}%"
+            + "".join(f" {percentile(ordered, p) * 1000:>8.1f}" for p in (50, 95, 99))
+        )
+        if errors:
+            print(" " * 4 + "unexpected: " + ", ".join(f"{status} x{n}" for status, n in s.unexpected.most_common()))
+
+
+async def run(args, base_url: str, token: str):
+    async with httpx.AsyncClient(
+        base_url=base_url,
+        # Only ever talk to the server under test
+        trust_env=False,
+        timeout=60,
+        limits=httpx.Limits(max_connections=args.hooks + args.rebuilders + args.substituters + args.viewers),
+    ) as client:
+        response = await client.get(f"/reports/{args.report}", headers={"Accept": "application/vnd.cyclonedx+json"})
+        response.raise_for_status()
+        report = response.json()
+        paths = [
+            prop["value"]
+            for component in report["components"]
+            for prop in component.get("properties", [])
+            if prop["name"] == "nix:out_path"
+        ]
+        traffic = Traffic(args.report, token, paths, args.narinfo_user)
+
+        stats = collections.defaultdict(Stats)
+        start = time.perf_counter()
+        deadline = start + args.duration
+        clients = [
+            simulate(client, request, rate, deadline, stats, seed=f"{kind}-{i}")
+            for kind, request, n, rate in [
+                ("hook", traffic.hook, args.hooks, args.hook_rate),
+                ("rebuilder", traffic.rebuilder, args.rebuilders, args.rebuilder_rate),
+                ("substituter", traffic.substituter, args.substituters, args.substituter_rate),
+                ("viewer", traffic.viewer, args.viewers, args.viewer_rate),
+            ]
+            for i in range(n)
+        ]
+        await asyncio.gather(*clients)
+        print_stats(stats, time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--duration", type=float, default=30, help="seconds")
+    parser.add_argument("--hooks", type=int, default=32)
+    parser.add_argument("--hook-rate", type=float, default=2, help="submissions per second per hook")
+    parser.add_argument("--rebuilders", type=int, default=4)
+    parser.add_argument("--rebuilder-rate", type=float, default=0.5, help="polls per second per rebuilder")
+    parser.add_argument("--substituters", type=int, default=16)
+    parser.add_argument("--substituter-rate", type=float, default=5, help="narinfo requests per second per substituter")
+    parser.add_argument("--viewers", type=int, default=4)
+    parser.add_argument("--viewer-rate", type=float, default=0.5, help="page loads per second per viewer")
+    parser.add_argument("--workers", type=int, default=2, help="uvicorn workers of the started server")
+    parser.add_argument("--report-paths", type=int, default=2000, help="size of the report of the started server")
+    parser.add_argument("--group-commit", action="store_true", help="start the server with LILA_GROUP_COMMIT=1")
+    parser.add_argument("--url", help="server to test instead of starting one")
+    parser.add_argument("--token", help="token to submit and poll with, with --url")
+    parser.add_argument("--report", default=REPORT, help="report to view and poll, with --url")
+    parser.add_argument("--narinfo-user", default=CACHE_USER, help="user whose narinfo files are fetched")
+    args = parser.parse_args()
+
+    if args.url is not None:
+        if args.token is None:
+            parser.error("--url needs --token")
+        asyncio.run(run(args, args.url, args.token))
+        return
+
+    with tempfile.TemporaryDirectory() as tmp:
+        url = f"sqlite:///{tmp}/load.db"
+        migrate(create_engine(url))
+        token = populate(url, args.report_paths, random.Random(0))
+        env = {"LILA_GROUP_COMMIT": "1"} if args.group_commit else {}
+        server, base_url = start_server(tmp, url, args.workers, env)
+        try:
+            asyncio.run(run(args, base_url, token))
+        finally:
+            server.terminate()
+            server.wait()
+
+
+if __name__ == "__main__":
+    main()
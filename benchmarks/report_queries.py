@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+"""
+Benchmark of the report queries (path_summaries and suggest)
+
+Creates a scratch SQLite database with the Alembic migrations, fills it
+with attestations from a couple of users and times the queries behind
+the report views.
+
+Usage: python benchmarks/report_queries.py [--paths N] [--repeat N]
+"""
+import argparse
+import pathlib
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, str(pathlib.Path(__file__).parent.parent))
+
+from alembic import command
+from alembic.config import Config
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from web import crud, models, nix, schemas
+
+
+def migrate(engine):
+    web_dir = pathlib.Path(__file__).parent.parent / "web"
+    config = Config(str(web_dir / "alembic.ini"))
+    config.set_main_option("script_location", str(web_dir / "alembic"))
+    with engine.begin() as connection:
+        config.attributes['connection'] = connection
+        command.upgrade(config, "head")
+
+
+def populate(db, n_paths, rnd):
+    users = []
+    for name in ("cache", "rebuilder"):
+        user = models.User(name=name)
+        db.add(user)
+        db.commit()
+        users.append(user.id)
+
+    paths = []
+    for i in range(n_paths):
+        digest = nix.base32_encode(rnd.randbytes(20))
+        name = f"package-{i}-1.0"
+        paths.append(nix.store_path(digest, name))
+        nar_hash = "sha256:" + nix.base32_encode(rnd.randbytes(32))
+        for user_id in users:
+            # About one in ten paths doesn't reproduce
+            if user_id != users[0] and rnd.random() < 0.1:
+                nar_hash = "sha256:" + nix.base32_encode(rnd.randbytes(32))
+            # Only part of the report has been rebuilt
+            if user_id != users[0] and rnd.random() < 0.3:
+                continue
+            crud.create_attestation(db, f"{digest}-{name}", [schemas.OutputHashPair(
+                output_digest=digest,
+                output_name=name,
+                output_hash=nar_hash,
+                output_sig="cache.nixos.org-1:" + "A" * 86 + "==",
+            )], user_id)
+    return paths, users
+
+
+def timed(label, repeat, fn):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - start)
+    timings.sort()
+    print(f"{label:<20} median {timings[len(timings) // 2] * 1000:8.1f} ms   min {timings[0] * 1000:8.1f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--paths", type=int, default=20000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        engine = create_engine(f"sqlite:///{tmp}/bench.db")
+        migrate(engine)
+        db = sessionmaker(bind=engine)()
+        start = time.perf_counter()
+        paths, users = populate(db, args.paths, random.Random(42))
+        print(f"populated {args.paths} paths in {time.perf_counter() - start:.1f} s")
+
+        elements = {path: {"out_path": path} for path in paths}
+        timed("path_summaries", args.repeat, lambda: crud.path_summaries(db, paths))
+        timed("suggest", args.repeat, lambda: crud.suggest(db, elements, users[1]))
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
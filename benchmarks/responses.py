@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+"""
+Benchmark of the JSON list endpoints
+
+Creates a scratch SQLite database with one derivation of many outputs,
+one output path attested many times and many derivations, and times
+fetching and serializing each listing in-process.
+
+Usage: python benchmarks/responses.py [--attestations N] [--repeat N]
+"""
+import argparse
+import base64
+import pathlib
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, str(pathlib.Path(__file__).parent.parent))
+
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from report_queries import migrate
+from web import common, create_app, crud, models, nix
+
+
+def random_hash(rnd):
+    return "sha256:" + nix.base32_encode(rnd.randbytes(32))
+
+
+def random_sig(rnd):
+    return "cache.nixos.org-1:" + base64.b64encode(rnd.randbytes(64)).decode()
+
+
+def populate(db, n, rnd) -> tuple[str, str]:
+    """Attestations of n outputs of one derivation, n attestations of one
+    output path and n derivations of one output each"""
+    user_id = models.User.create(db, name="builder").id
+    drv_hash = nix.base32_encode(rnd.randbytes(20)) + "-big.drv"
+    crud.create_attestations(db, [
+        (drv_hash, nix.store_path(nix.base32_encode(rnd.randbytes(20)), f"out-{i}"), random_hash(rnd), random_sig(rnd), None, None, None)
+        for i in range(n)
+    ], user_id)
+    # Distinct derivations building the same path, as a rebuilder trying
+    # many variations would
+    path = nix.store_path(nix.base32_encode(rnd.randbytes(20)), "popular")
+    crud.create_attestations(db, [
+        (f"{nix.base32_encode(rnd.randbytes(20))}-popular.drv", path, random_hash(rnd), random_sig(rnd), None, None, None)
+        for _ in range(n)
+    ], user_id)
+    for i in range(10):
+        crud.add_link_pattern(db, f"package-{i}.*", f"https://example.org/issues/{i}")
+    return drv_hash, path
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--attestations", type=int, default=100000)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        engine = create_engine(f"sqlite:///{tmp}/bench.db", connect_args={"check_same_thread": False})
+        migrate(engine)
+        session_factory = sessionmaker(bind=engine)
+        db = session_factory()
+        drv_hash, path = populate(db, args.attestations, random.Random(0))
+        db.close()
+
+        def get_db():
+            db = session_factory()
+            try:
+                yield db
+            finally:
+                db.close()
+
+        app = create_app()
+        app.dependency_overrides[common.get_db] = get_db
+        client = TestClient(app)
+        for label, url in [
+            ("GET /derivations/{drv}?full=true", f"/derivations/{drv_hash}?full=true"),
+            ("GET /derivations/{drv}", f"/derivations/{drv_hash}"),
+            ("GET /attestations/by-output/{path}", f"/attestations/by-output/{path.removeprefix('/nix/store/')}"),
+            ("GET /derivations/", "/derivations/"),
+            ("GET /link_patterns", "/link_patterns"),
+        ]:
+            best = float("inf")
+            for _ in range(args.repeat):
+                start = time.perf_counter()
+                response = client.get(url)
+                best = min(best, time.perf_counter() - start)
+                response.raise_for_status()
+            print(f"{label:<36} {best * 1000:>8.0f} ms  {len(response.content) / 1e6:>6.1f} MB")
+
+
+if __name__ == "__main__":
+    main()
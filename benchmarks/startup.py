@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+"""
+Benchmark of worker start-up
+
+Starts fresh interpreters against a migrated scratch SQLite database and
+times importing the package, creating the app and serving the first
+request, which is what every server worker goes through on boot.
+
+Usage: python benchmarks/startup.py [--repeat N]
+"""
+import argparse
+import json
+import os
+import pathlib
+import subprocess
+import sys
+import tempfile
+
+from sqlalchemy import create_engine
+
+sys.path.insert(0, str(pathlib.Path(__file__).parent.parent))
+
+from report_queries import migrate
+
+# Runs in the child interpreter, printing its timings as JSON
+WORKER = """
+import json, time
+start = time.perf_counter()
+import web
+imported = time.perf_counter()
+app = web.create_app()
+created = time.perf_counter()
+from fastapi.testclient import TestClient
+with TestClient(app) as client:
+    started = time.perf_counter()
+    assert client.get("/ready").status_code == 200
+    ready = time.perf_counter()
+print(json.dumps({
+    "import": imported - start,
+    "create_app": created - imported,
+    "first request": ready - started,
+}))
+"""
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--repeat", type=int, default=10)
+    args = parser.parse_args()
+
+    root = pathlib.Path(__file__).parent.parent
+    with tempfile.TemporaryDirectory() as tmp:
+        url = f"sqlite:///{tmp}/bench.db"
+        migrate(create_engine(url))
+        env = dict(os.environ, SQLALCHEMY_DATABASE_URL=url, PYTHONPATH=str(root))
+        runs = [
+            json.loads(subprocess.run(
+                [sys.executable, "-c", WORKER], env=env, cwd=tmp,
+                check=True, capture_output=True, text=True,
+            ).stdout.splitlines()[-1])
+            for _ in range(args.repeat)
+        ]
+
+    for label in runs[0]:
+        timings = sorted(run[label] for run in runs)
+        print(f"{label:<20} median {timings[len(timings) // 2] * 1000:8.1f} ms   min {timings[0] * 1000:8.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -52,6 +52,7 @@
                 ps.pytest
                 ps.httpx
                 ps.alembic
+                ps.cryptography
 
                 ps.uvicorn
               ]))
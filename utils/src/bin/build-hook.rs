@@ -29,7 +29,9 @@ async fn main() -> Result<()> {
                 output_digest: &digest,
                 output_name: &name,
                 output_hash: hash,
-                output_sig: signature
+                output_sig: signature,
+                nar_size: Some(size),
+                references: Some(query_references(ctx, path)),
             }
         })
         .collect();
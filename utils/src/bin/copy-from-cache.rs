@@ -32,12 +32,24 @@ async fn fetch<'a>(client: &'a Client, cache_url: &'a str, out_path: &'a str) ->
         .captures(&response)
         .expect(format!("Sig not found in metadata for [{0}]", out_path).as_str())
         .get(1).unwrap().as_str().to_owned();
+    // Sent along so the cache signature can be verified
+    let nar_size = Regex::new(r"(?m)^NarSize: (\d+)").unwrap()
+        .captures(&response)
+        .map(|c| c.get(1).unwrap().as_str().parse::<u64>().unwrap());
+    let references = Regex::new(r"(?m)^References:(.*)").unwrap()
+        .captures(&response)
+        .map(|c| c.get(1).unwrap().as_str()
+            .split_whitespace()
+            .map(|r| format!("/nix/store/{r}"))
+            .collect());
 
     OutputAttestation {
         output_digest: &out_digest,
         output_name: &out_name,
         output_hash: nar_hash,
         output_sig: sig,
+        nar_size: nar_size,
+        references: references,
     }
 }
 
@@ -30,7 +30,9 @@ async fn main() -> Result<()> {
             output_digest: &out_digest,
             output_name: &out_name,
             output_hash: hash,
-            output_sig: signature
+            output_sig: signature,
+            nar_size: None,
+            references: None,
         }
     ];
 
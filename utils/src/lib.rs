@@ -87,7 +87,7 @@ pub fn nar_size(ctx: Ctx, path: String) -> u64 {
     }
 }
 
-fn query_references(ctx: Ctx, path: &str) -> Vec<String> {
+pub fn query_references(ctx: Ctx, path: &str) -> Vec<String> {
     unsafe {
         let cpath = CString::new(path).unwrap();
         let path = nix_store_parse_path(ctx.context, ctx.store, cpath.as_ptr());
@@ -140,6 +140,11 @@ pub struct OutputAttestation<'a> {
     pub output_name: &'a str,
     pub output_hash: String,
     pub output_sig: String,
+    // The rest of the signed fingerprint, so the server can verify output_sig
+    #[serde(skip_serializing_if = "Option::is_none")]
+    pub nar_size: Option<u64>,
+    #[serde(skip_serializing_if = "Option::is_none")]
+    pub references: Option<Vec<String>>,
 }
 
 pub fn read_env_var_or_panic(variable: &str) -> String {
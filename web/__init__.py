@@ -2,77 +2,159 @@
 Lila - Reproducibility tracker for Nix builds
 Main FastAPI application
 """
+import contextlib
 import pathlib
-from fastapi import Depends, FastAPI, Response
+from fastapi import FastAPI
 from fastapi.staticfiles import StaticFiles
 from fastapi.middleware.cors import CORSMiddleware
-from sqlalchemy.orm import Session
 
 # Import routers
-from .api import attestations, derivations, link_patterns, signatures
+from .api import admin, attestations, closure, derivations, export, feed, health, jobs, link_patterns, nondeterministic, paths, signatures, users
 from .views import reports
+from .profiling import ProfilerMiddleware
+from . import publisher
+from .db import SessionLocal
 
 # Import common utilities
 from .common import get_db, get_token
 
-# Import models for database initialization
-from . import models, crud
-from .db import engine
-
-# Create tables (will be replaced with Alembic migrations in future)
-models.Base.metadata.create_all(bind=engine)
-
-# Create FastAPI app
-app = FastAPI(
-    title="Lila",
-    description="Reproducibility tracker for Nix builds",
-    version="0.1.0"
-)
-
-# Static files
-thispath = pathlib.Path(__file__).parent.resolve()
-app.mount("/static", StaticFiles(directory=str(thispath / "static")), name="static")
-
-# CORS middleware
-origins = [
-    "http://localhost:8000",
-]
-
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=origins,
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
-
-# Include API routers (JSON endpoints)
-app.include_router(
-    attestations.router,
-    tags=["attestations"]
-)
-
-app.include_router(
-    derivations.router,
-    prefix="/derivations",
-    tags=["derivations"]
-)
-
-# Include view routers (HTML endpoints)
-app.include_router(
-    reports.router,
-    prefix="/reports",
-    tags=["reports"]
-)
-
-app.include_router(
-    link_patterns.router,
-    prefix="/link_patterns",
-    tags=["link_patterns"]
-)
-
-app.include_router(
-    signatures.router,
-    prefix="/signatures",
-    tags=["signatures"]
-)
+
+def create_app() -> FastAPI:
+    """Create the FastAPI app
+
+    Nothing here touches the database: the schema is managed by Alembic
+    (`alembic upgrade head`), and each worker process connects on its
+    first request. Servers can call this once per worker, e.g. with
+    `uvicorn --factory lila:create_app`.
+    """
+    @contextlib.asynccontextmanager
+    async def lifespan(app):
+        if publisher.DIRECTORY is None:
+            yield
+            return
+        # Publishes all reports once, then again as they change
+        report_publisher = publisher.Publisher(SessionLocal, publisher.DIRECTORY)
+        report_publisher.start()
+        try:
+            yield
+        finally:
+            report_publisher.stop()
+
+    app = FastAPI(
+        title="Lila",
+        description="Reproducibility tracker for Nix builds",
+        version="0.1.0",
+        lifespan=lifespan,
+    )
+
+    # Static files
+    thispath = pathlib.Path(__file__).parent.resolve()
+    app.mount("/static", StaticFiles(directory=str(thispath / "static")), name="static")
+    if publisher.DIRECTORY is not None:
+        pathlib.Path(publisher.DIRECTORY).mkdir(parents=True, exist_ok=True)
+        app.mount("/published", publisher.PrecompressedStaticFiles(directory=publisher.DIRECTORY), name="published")
+
+    # CORS middleware
+    origins = [
+        "http://localhost:8000",
+    ]
+
+    app.add_middleware(
+        CORSMiddleware,
+        allow_origins=origins,
+        allow_credentials=True,
+        allow_methods=["*"],
+        allow_headers=["*"],
+    )
+
+    # Outermost, so profiles cover all of the request
+    app.add_middleware(ProfilerMiddleware)
+
+    # Include API routers (JSON endpoints)
+    app.include_router(
+        attestations.router,
+        tags=["attestations"]
+    )
+
+    app.include_router(
+        derivations.router,
+        prefix="/derivations",
+        tags=["derivations"]
+    )
+
+    # Include view routers (HTML endpoints)
+    app.include_router(
+        reports.router,
+        prefix="/reports",
+        tags=["reports"]
+    )
+
+    app.include_router(
+        link_patterns.router,
+        prefix="/link_patterns",
+        tags=["link_patterns"]
+    )
+
+    app.include_router(
+        signatures.router,
+        prefix="/signatures",
+        tags=["signatures"]
+    )
+
+    app.include_router(
+        jobs.router,
+        prefix="/jobs",
+        tags=["jobs"]
+    )
+
+    app.include_router(
+        users.router,
+        prefix="/users",
+        tags=["users"]
+    )
+
+    app.include_router(
+        export.router,
+        prefix="/export",
+        tags=["export"]
+    )
+
+    app.include_router(
+        feed.router,
+        prefix="/feed",
+        tags=["feed"]
+    )
+
+    app.include_router(
+        closure.router,
+        prefix="/closure",
+        tags=["closure"]
+    )
+
+    app.include_router(
+        paths.router,
+        prefix="/paths",
+        tags=["paths"]
+    )
+
+    app.include_router(
+        nondeterministic.router,
+        prefix="/nondeterministic",
+        tags=["nondeterministic"]
+    )
+
+    app.include_router(
+        admin.router,
+        prefix="/admin",
+        tags=["admin"]
+    )
+
+    app.include_router(
+        health.router,
+        tags=["health"]
+    )
+
+    return app
+
+
+app = create_app()
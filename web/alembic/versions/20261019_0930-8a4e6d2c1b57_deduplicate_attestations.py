@@ -0,0 +1,36 @@
+"""Deduplicate attestations
+
+Revision ID: 8a4e6d2c1b57
+Revises: 3f1c2a7b9d10
+Create Date: 2026-10-19 09:30:00.000000+00:00
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '8a4e6d2c1b57'
+down_revision: Union[str, Sequence[str], None] = '3f1c2a7b9d10'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+IDENTITY = ['drv_id', 'output_digest', 'output_name', 'user_id', 'output_hash']
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # Keep the first of each group of identical attestations
+    op.execute(
+        "DELETE FROM attestations WHERE id NOT IN ("
+        "SELECT MIN(id) FROM attestations GROUP BY " + ", ".join(IDENTITY) +
+        ")"
+    )
+    op.create_index('uq_attestations_identity', 'attestations', IDENTITY, unique=True)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('uq_attestations_identity', table_name='attestations')
@@ -0,0 +1,152 @@
+"""Compact attestation storage
+
+Store path digests and NAR hashes are stored in binary, and signatures
+are split into an interned key name and the raw signature.
+
+Revision ID: c52d7e91a3f4
+Revises: 8a4e6d2c1b57
+Create Date: 2026-10-19 10:00:00.000000+00:00
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+try:
+    from lila import nix
+except ImportError:
+    from web import nix
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c52d7e91a3f4'
+down_revision: Union[str, Sequence[str], None] = '8a4e6d2c1b57'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+BATCH_SIZE = 10000
+
+IDENTITY = ['drv_id', 'output_digest', 'output_name', 'user_id', 'output_hash']
+
+signing_keys = sa.table('signing_keys', sa.column('id'), sa.column('name'))
+
+
+def text_table(name):
+    return sa.table(name,
+        sa.column('id'), sa.column('output_digest'), sa.column('output_name'),
+        sa.column('user_id'), sa.column('drv_id'), sa.column('output_hash'),
+        sa.column('output_sig'),
+    )
+
+
+def compact_table(name):
+    return sa.table(name,
+        sa.column('id'), sa.column('output_digest'), sa.column('output_name'),
+        sa.column('user_id'), sa.column('drv_id'), sa.column('output_hash'),
+        sa.column('sig_key_id'), sa.column('sig'),
+    )
+
+
+def copy_rows(source, target, convert):
+    """Copy all rows from source to target in batches, keeping their ids"""
+    conn = op.get_bind()
+    last_id = 0
+    while True:
+        rows = conn.execute(
+            sa.select(source).where(source.c.id > last_id).order_by(source.c.id).limit(BATCH_SIZE)
+        ).fetchall()
+        if not rows:
+            break
+        conn.execute(target.insert(), [convert(row) for row in rows])
+        last_id = rows[-1].id
+
+
+def replace_attestations(new_name):
+    op.drop_index('uq_attestations_identity', table_name='attestations')
+    op.drop_table('attestations')
+    op.rename_table(new_name, 'attestations')
+    op.create_index('uq_attestations_identity', 'attestations', IDENTITY, unique=True)
+    if op.get_bind().dialect.name == 'postgresql':
+        # Rows were copied with their ids, move the sequence past them
+        op.execute("SELECT setval(pg_get_serial_sequence('attestations', 'id'), COALESCE(MAX(id), 1)) FROM attestations")
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('signing_keys',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('name', sa.String(), nullable=False),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('name')
+    )
+    op.create_table('attestations_compact',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('output_digest', sa.LargeBinary(), nullable=False),
+    sa.Column('output_name', sa.String(), nullable=False),
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('drv_id', sa.Integer(), nullable=False),
+    sa.Column('output_hash', sa.LargeBinary(), nullable=False),
+    sa.Column('sig_key_id', sa.Integer(), nullable=True),
+    sa.Column('sig', sa.LargeBinary(), nullable=False),
+    sa.ForeignKeyConstraint(['drv_id'], ['derivations.id'], ),
+    sa.ForeignKeyConstraint(['user_id'], ['users.id'], ),
+    sa.ForeignKeyConstraint(['sig_key_id'], ['signing_keys.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+
+    conn = op.get_bind()
+    key_ids = {}
+
+    def convert(row):
+        key_name, sig = nix.split_signature(row.output_sig)
+        if key_name is not None and key_name not in key_ids:
+            key_ids[key_name] = conn.execute(
+                signing_keys.insert().values(name=key_name).returning(signing_keys.c.id)
+            ).scalar_one()
+        return {
+            'id': row.id,
+            'output_digest': nix.digest_to_bytes(row.output_digest),
+            'output_name': row.output_name,
+            'user_id': row.user_id,
+            'drv_id': row.drv_id,
+            'output_hash': nix.hash_to_bytes(row.output_hash),
+            'sig_key_id': key_ids.get(key_name),
+            'sig': sig,
+        }
+
+    copy_rows(text_table('attestations'), compact_table('attestations_compact'), convert)
+    replace_attestations('attestations_compact')
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.create_table('attestations_text',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('output_digest', sa.String(), nullable=False),
+    sa.Column('output_name', sa.String(), nullable=False),
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('drv_id', sa.Integer(), nullable=False),
+    sa.Column('output_hash', sa.String(), nullable=False),
+    sa.Column('output_sig', sa.String(), nullable=False),
+    sa.ForeignKeyConstraint(['drv_id'], ['derivations.id'], ),
+    sa.ForeignKeyConstraint(['user_id'], ['users.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+
+    key_names = {row.id: row.name for row in op.get_bind().execute(sa.select(signing_keys))}
+
+    def convert(row):
+        return {
+            'id': row.id,
+            'output_digest': nix.digest_from_bytes(row.output_digest),
+            'output_name': row.output_name,
+            'user_id': row.user_id,
+            'drv_id': row.drv_id,
+            'output_hash': nix.hash_from_bytes(row.output_hash),
+            'output_sig': nix.join_signature(key_names.get(row.sig_key_id), row.sig),
+        }
+
+    copy_rows(compact_table('attestations'), text_table('attestations_text'), convert)
+    replace_attestations('attestations_text')
+    op.drop_table('signing_keys')
@@ -0,0 +1,93 @@
+"""Store paths table
+
+Attestations reference their output path by integer id instead of
+repeating its digest and name.
+
+Revision ID: 5b0e3c8f2d6a
+Revises: c52d7e91a3f4
+Create Date: 2026-10-19 11:00:00.000000+00:00
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '5b0e3c8f2d6a'
+down_revision: Union[str, Sequence[str], None] = 'c52d7e91a3f4'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def replace_attestations(new_name, identity):
+    op.drop_index('uq_attestations_identity', table_name='attestations')
+    op.drop_table('attestations')
+    op.rename_table(new_name, 'attestations')
+    op.create_index('uq_attestations_identity', 'attestations', identity, unique=True)
+    if op.get_bind().dialect.name == 'postgresql':
+        # Rows were copied with their ids, move the sequence past them
+        op.execute("SELECT setval(pg_get_serial_sequence('attestations', 'id'), COALESCE(MAX(id), 1)) FROM attestations")
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('store_paths',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('digest', sa.LargeBinary(), nullable=False),
+    sa.Column('name', sa.String(), nullable=False),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('uq_store_paths_digest_name', 'store_paths', ['digest', 'name'], unique=True)
+    op.execute(
+        "INSERT INTO store_paths (digest, name) "
+        "SELECT DISTINCT output_digest, output_name FROM attestations"
+    )
+
+    op.create_table('attestations_by_path',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('path_id', sa.Integer(), nullable=False),
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('drv_id', sa.Integer(), nullable=False),
+    sa.Column('output_hash', sa.LargeBinary(), nullable=False),
+    sa.Column('sig_key_id', sa.Integer(), nullable=True),
+    sa.Column('sig', sa.LargeBinary(), nullable=False),
+    sa.ForeignKeyConstraint(['path_id'], ['store_paths.id'], ),
+    sa.ForeignKeyConstraint(['drv_id'], ['derivations.id'], ),
+    sa.ForeignKeyConstraint(['user_id'], ['users.id'], ),
+    sa.ForeignKeyConstraint(['sig_key_id'], ['signing_keys.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.execute(
+        "INSERT INTO attestations_by_path (id, path_id, user_id, drv_id, output_hash, sig_key_id, sig) "
+        "SELECT a.id, p.id, a.user_id, a.drv_id, a.output_hash, a.sig_key_id, a.sig "
+        "FROM attestations a JOIN store_paths p ON p.digest = a.output_digest AND p.name = a.output_name"
+    )
+    replace_attestations('attestations_by_path', ['path_id', 'user_id', 'drv_id', 'output_hash'])
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.create_table('attestations_by_digest',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('output_digest', sa.LargeBinary(), nullable=False),
+    sa.Column('output_name', sa.String(), nullable=False),
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('drv_id', sa.Integer(), nullable=False),
+    sa.Column('output_hash', sa.LargeBinary(), nullable=False),
+    sa.Column('sig_key_id', sa.Integer(), nullable=True),
+    sa.Column('sig', sa.LargeBinary(), nullable=False),
+    sa.ForeignKeyConstraint(['drv_id'], ['derivations.id'], ),
+    sa.ForeignKeyConstraint(['user_id'], ['users.id'], ),
+    sa.ForeignKeyConstraint(['sig_key_id'], ['signing_keys.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.execute(
+        "INSERT INTO attestations_by_digest (id, output_digest, output_name, user_id, drv_id, output_hash, sig_key_id, sig) "
+        "SELECT a.id, p.digest, p.name, a.user_id, a.drv_id, a.output_hash, a.sig_key_id, a.sig "
+        "FROM attestations a JOIN store_paths p ON p.id = a.path_id"
+    )
+    replace_attestations('attestations_by_digest', ['drv_id', 'output_digest', 'output_name', 'user_id', 'output_hash'])
+    op.drop_index('uq_store_paths_digest_name', table_name='store_paths')
+    op.drop_table('store_paths')
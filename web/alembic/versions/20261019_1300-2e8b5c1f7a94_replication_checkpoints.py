@@ -0,0 +1,32 @@
+"""Add replication checkpoints table
+
+Revision ID: 2e8b5c1f7a94
+Revises: 9d4f7a2e6c13
+Create Date: 2026-10-19 13:00:00.000000+00:00
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '2e8b5c1f7a94'
+down_revision: Union[str, Sequence[str], None] = '9d4f7a2e6c13'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('replication_checkpoints',
+    sa.Column('peer', sa.String(), nullable=False),
+    sa.Column('last_id', sa.Integer(), nullable=False),
+    sa.PrimaryKeyConstraint('peer')
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_table('replication_checkpoints')
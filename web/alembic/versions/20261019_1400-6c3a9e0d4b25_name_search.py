@@ -0,0 +1,64 @@
+"""Index derivation and store path names for search
+
+Revision ID: 6c3a9e0d4b25
+Revises: 2e8b5c1f7a94
+Create Date: 2026-10-19 14:00:00.000000+00:00
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '6c3a9e0d4b25'
+down_revision: Union[str, Sequence[str], None] = '2e8b5c1f7a94'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# The name part of a drv_hash (<digest>-<name>)
+SQLITE_DRV_NAME = "substr({0}.drv_hash, instr({0}.drv_hash, '-') + 1)"
+POSTGRES_DRV_NAME = "substr(drv_hash, strpos(drv_hash, '-') + 1)"
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    if op.get_bind().dialect.name == "postgresql":
+        op.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+        op.execute(f"CREATE INDEX ix_derivations_name_trgm ON derivations USING gin (({POSTGRES_DRV_NAME}) gin_trgm_ops)")
+        op.execute("CREATE INDEX ix_store_paths_name_trgm ON store_paths USING gin (name gin_trgm_ops)")
+        return
+
+    # Contentless trigram indexes keyed by the rows' ids, kept up to date
+    # by triggers
+    op.execute("CREATE VIRTUAL TABLE derivation_names USING fts5(name, content='', tokenize='trigram')")
+    op.execute(f"INSERT INTO derivation_names(rowid, name) SELECT id, {SQLITE_DRV_NAME.format('derivations')} FROM derivations")
+    op.execute(f"""CREATE TRIGGER derivation_names_insert AFTER INSERT ON derivations BEGIN
+        INSERT INTO derivation_names(rowid, name) VALUES (new.id, {SQLITE_DRV_NAME.format('new')});
+    END""")
+    op.execute(f"""CREATE TRIGGER derivation_names_delete AFTER DELETE ON derivations BEGIN
+        INSERT INTO derivation_names(derivation_names, rowid, name) VALUES ('delete', old.id, {SQLITE_DRV_NAME.format('old')});
+    END""")
+
+    op.execute("CREATE VIRTUAL TABLE store_path_names USING fts5(name, content='', tokenize='trigram')")
+    op.execute("INSERT INTO store_path_names(rowid, name) SELECT id, name FROM store_paths")
+    op.execute("""CREATE TRIGGER store_path_names_insert AFTER INSERT ON store_paths BEGIN
+        INSERT INTO store_path_names(rowid, name) VALUES (new.id, new.name);
+    END""")
+    op.execute("""CREATE TRIGGER store_path_names_delete AFTER DELETE ON store_paths BEGIN
+        INSERT INTO store_path_names(store_path_names, rowid, name) VALUES ('delete', old.id, old.name);
+    END""")
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    if op.get_bind().dialect.name == "postgresql":
+        op.execute("DROP INDEX ix_store_paths_name_trgm")
+        op.execute("DROP INDEX ix_derivations_name_trgm")
+        return
+
+    for name in ("store_path_names", "derivation_names"):
+        op.execute(f"DROP TRIGGER {name}_delete")
+        op.execute(f"DROP TRIGGER {name}_insert")
+        op.execute(f"DROP TABLE {name}")
@@ -0,0 +1,57 @@
+"""Add index of nondeterministic output paths
+
+Revision ID: a71d4c9e3b68
+Revises: 6c3a9e0d4b25
+Create Date: 2026-10-19 15:00:00.000000+00:00
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'a71d4c9e3b68'
+down_revision: Union[str, Sequence[str], None] = '6c3a9e0d4b25'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('nondeterministic_paths',
+    sa.Column('path_id', sa.Integer(), nullable=False),
+    sa.Column('first_seen', sa.DateTime(), server_default=sa.text('(CURRENT_TIMESTAMP)'), nullable=False),
+    sa.Column('distinct_hashes', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['path_id'], ['store_paths.id'], ),
+    sa.PrimaryKeyConstraint('path_id')
+    )
+    op.create_index('ix_nondeterministic_paths_first_seen', 'nondeterministic_paths', ['first_seen', 'path_id'])
+    op.create_table('nondeterministic_path_users',
+    sa.Column('path_id', sa.Integer(), nullable=False),
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['path_id'], ['nondeterministic_paths.path_id'], ),
+    sa.ForeignKeyConstraint(['user_id'], ['users.id'], ),
+    sa.PrimaryKeyConstraint('path_id', 'user_id')
+    )
+
+    # Paths that are already nondeterministic. We don't know since when,
+    # so they count as first seen now.
+    op.execute("""
+        INSERT INTO nondeterministic_paths (path_id, distinct_hashes)
+        SELECT path_id, count(DISTINCT output_hash) FROM attestations
+        GROUP BY path_id HAVING count(DISTINCT output_hash) > 1
+    """)
+    op.execute("""
+        INSERT INTO nondeterministic_path_users (path_id, user_id)
+        SELECT DISTINCT attestations.path_id, attestations.user_id
+        FROM attestations JOIN nondeterministic_paths ON nondeterministic_paths.path_id = attestations.path_id
+    """)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_table('nondeterministic_path_users')
+    op.drop_index('ix_nondeterministic_paths_first_seen', table_name='nondeterministic_paths')
+    op.drop_table('nondeterministic_paths')
@@ -0,0 +1,44 @@
+"""Add agreement between users
+
+Revision ID: d28f6b1a9c47
+Revises: a71d4c9e3b68
+Create Date: 2026-10-19 16:00:00.000000+00:00
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'd28f6b1a9c47'
+down_revision: Union[str, Sequence[str], None] = 'a71d4c9e3b68'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('user_agreement',
+    sa.Column('user_a', sa.Integer(), nullable=False),
+    sa.Column('user_b', sa.Integer(), nullable=False),
+    sa.Column('agree_count', sa.Integer(), nullable=False),
+    sa.Column('disagree_count', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['user_a'], ['users.id'], ),
+    sa.ForeignKeyConstraint(['user_b'], ['users.id'], ),
+    sa.PrimaryKeyConstraint('user_a', 'user_b')
+    )
+    op.execute("""
+        INSERT INTO user_agreement (user_a, user_b, agree_count, disagree_count)
+        SELECT a.user_id, b.user_id,
+               sum(CASE WHEN a.output_hash = b.output_hash THEN 1 ELSE 0 END),
+               sum(CASE WHEN a.output_hash = b.output_hash THEN 0 ELSE 1 END)
+        FROM attestations a JOIN attestations b ON b.path_id = a.path_id AND b.user_id > a.user_id
+        GROUP BY a.user_id, b.user_id
+    """)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_table('user_agreement')
@@ -0,0 +1,34 @@
+"""Make report names unique and track report revisions
+
+Revision ID: 4b9e2d7c5a13
+Revises: d28f6b1a9c47
+Create Date: 2026-10-19 17:00:00.000000+00:00
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '4b9e2d7c5a13'
+down_revision: Union[str, Sequence[str], None] = 'd28f6b1a9c47'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # Redefining a report used to add another row, of which only the
+    # latest is kept
+    op.execute("DELETE FROM reports WHERE id NOT IN (SELECT max(id) FROM reports GROUP BY name)")
+    op.add_column('reports', sa.Column('revision', sa.Integer(), server_default='1', nullable=False))
+    op.create_index('uq_reports_name', 'reports', ['name'], unique=True)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('uq_reports_name', table_name='reports')
+    with op.batch_alter_table('reports') as batch_op:
+        batch_op.drop_column('revision')
@@ -0,0 +1,31 @@
+"""Record when attestations were created
+
+Revision ID: 7e1f4b8c2d95
+Revises: 4b9e2d7c5a13
+Create Date: 2026-10-19 18:00:00.000000+00:00
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '7e1f4b8c2d95'
+down_revision: Union[str, Sequence[str], None] = '4b9e2d7c5a13'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # Without a default, so adding it doesn't rewrite the table: existing
+    # attestations have no creation time, new ones get it on insert
+    op.add_column('attestations', sa.Column('created_at', sa.DateTime(), nullable=True))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    with op.batch_alter_table('attestations') as batch_op:
+        batch_op.drop_column('created_at')
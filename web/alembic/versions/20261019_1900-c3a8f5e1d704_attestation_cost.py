@@ -0,0 +1,33 @@
+"""Record the NAR size and build duration of attestations
+
+Revision ID: c3a8f5e1d704
+Revises: 7e1f4b8c2d95
+Create Date: 2026-10-19 19:00:00.000000+00:00
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c3a8f5e1d704'
+down_revision: Union[str, Sequence[str], None] = '7e1f4b8c2d95'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('attestations', sa.Column('nar_size', sa.BigInteger(), nullable=True))
+    op.add_column('attestations', sa.Column('build_duration', sa.Float(), nullable=True))
+    op.create_index('ix_attestations_cost', 'attestations', ['path_id', 'build_duration', 'nar_size'])
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_attestations_cost', table_name='attestations')
+    with op.batch_alter_table('attestations') as batch_op:
+        batch_op.drop_column('build_duration')
+        batch_op.drop_column('nar_size')
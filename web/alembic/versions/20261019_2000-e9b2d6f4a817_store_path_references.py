@@ -0,0 +1,37 @@
+"""Add references between store paths
+
+Revision ID: e9b2d6f4a817
+Revises: c3a8f5e1d704
+Create Date: 2026-10-19 20:00:00.000000+00:00
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e9b2d6f4a817'
+down_revision: Union[str, Sequence[str], None] = 'c3a8f5e1d704'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('store_path_references',
+    sa.Column('path_id', sa.Integer(), nullable=False),
+    sa.Column('reference_id', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['path_id'], ['store_paths.id'], ),
+    sa.ForeignKeyConstraint(['reference_id'], ['store_paths.id'], ),
+    sa.PrimaryKeyConstraint('path_id', 'reference_id'),
+    sqlite_with_rowid=False
+    )
+    op.create_index('ix_store_path_references_reference', 'store_path_references', ['reference_id', 'path_id'])
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_store_path_references_reference', table_name='store_path_references')
+    op.drop_table('store_path_references')
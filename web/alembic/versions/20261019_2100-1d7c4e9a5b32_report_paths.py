@@ -0,0 +1,92 @@
+"""Index the output paths of reports
+
+Revision ID: 1d7c4e9a5b32
+Revises: e9b2d6f4a817
+Create Date: 2026-10-19 21:00:00.000000+00:00
+
+"""
+import json
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+try:
+    from lila import nix
+except ImportError:
+    from web import nix
+
+
+# revision identifiers, used by Alembic.
+revision: str = '1d7c4e9a5b32'
+down_revision: Union[str, Sequence[str], None] = 'e9b2d6f4a817'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+BATCH_SIZE = 500
+
+reports = sa.table('reports', sa.column('id'), sa.column('definition'))
+store_paths = sa.table('store_paths', sa.column('id'), sa.column('digest'), sa.column('name'))
+report_paths = sa.table('report_paths', sa.column('path_id'), sa.column('report_id'), sa.column('component'))
+
+
+def path_ids(conn, keys) -> dict[tuple, int]:
+    """Ids of the store paths with the given (digest, name) keys, adding
+    the missing ones"""
+    ids = {}
+
+    def lookup(keys):
+        for i in range(0, len(keys), BATCH_SIZE):
+            batch = keys[i:i + BATCH_SIZE]
+            stmt = sa.select(store_paths).where(store_paths.c.digest.in_({digest for digest, _ in batch}))
+            for row in conn.execute(stmt):
+                ids[row.digest, row.name] = row.id
+
+    keys = list(set(keys))
+    lookup(keys)
+    missing = [key for key in keys if key not in ids]
+    if missing:
+        conn.execute(store_paths.insert(), [{'digest': digest, 'name': name} for digest, name in missing])
+        lookup(missing)
+    return ids
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('report_paths',
+    sa.Column('path_id', sa.Integer(), nullable=False),
+    sa.Column('report_id', sa.Integer(), nullable=False),
+    sa.Column('component', sa.String(), nullable=False),
+    sa.ForeignKeyConstraint(['path_id'], ['store_paths.id'], ),
+    sa.ForeignKeyConstraint(['report_id'], ['reports.id'], ),
+    sa.PrimaryKeyConstraint('path_id', 'report_id', 'component'),
+    sqlite_with_rowid=False
+    )
+    op.create_index('ix_report_paths_report', 'report_paths', ['report_id'])
+    op.add_column('reports', sa.Column('stale', sa.Boolean(), server_default=sa.false(), nullable=False))
+
+    conn = op.get_bind()
+    for report_id, definition in conn.execute(sa.select(reports.c.id, reports.c.definition)).all():
+        components = {
+            (component.get('bom-ref', ''), prop['value'])
+            for component in json.loads(definition).get('components', [])
+            for prop in component.get('properties', [])
+            if prop['name'] == 'nix:out_path'
+        }
+        keys = {path: nix.split_store_path(path) for _, path in components}
+        keys = {path: (nix.digest_to_bytes(digest), name) for path, (digest, name) in keys.items()}
+        ids = path_ids(conn, list(keys.values()))
+        rows = {(ids[keys[path]], component) for component, path in components}
+        if rows:
+            conn.execute(report_paths.insert(), [
+                {'path_id': path_id, 'report_id': report_id, 'component': component}
+                for path_id, component in rows
+            ])
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    with op.batch_alter_table('reports') as batch_op:
+        batch_op.drop_column('stale')
+    op.drop_index('ix_report_paths_report', table_name='report_paths')
+    op.drop_table('report_paths')
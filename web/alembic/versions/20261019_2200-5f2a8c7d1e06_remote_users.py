@@ -0,0 +1,42 @@
+"""Mark the users standing in for users of peer instances
+
+Revision ID: 5f2a8c7d1e06
+Revises: 1d7c4e9a5b32
+Create Date: 2026-10-19 22:00:00.000000+00:00
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '5f2a8c7d1e06'
+down_revision: Union[str, Sequence[str], None] = '1d7c4e9a5b32'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('users', sa.Column('peer', sa.String(), nullable=True))
+    # The replicator named its users <user>@<peer> and never gave them
+    # tokens, which tells them apart from local users
+    users = sa.table('users', sa.column('id', sa.Integer()), sa.column('name', sa.String()), sa.column('peer', sa.String()))
+    tokens = sa.table('tokens', sa.column('user_id', sa.Integer()))
+    connection = op.get_bind()
+    remote = connection.execute(
+        sa.select(users.c.id, users.c.name)
+        .where(users.c.name.contains('@'), ~sa.exists().where(tokens.c.user_id == users.c.id))
+    ).all()
+    if remote:
+        connection.execute(
+            users.update().where(users.c.id == sa.bindparam('b_id')).values(peer=sa.bindparam('b_peer')),
+            [{'b_id': id, 'b_peer': name.rpartition('@')[2]} for id, name in remote])
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    with op.batch_alter_table('users') as batch_op:
+        batch_op.drop_column('peer')
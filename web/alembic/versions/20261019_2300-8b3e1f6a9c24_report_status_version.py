@@ -0,0 +1,29 @@
+"""Count the changes of the statuses of each report's paths
+
+Revision ID: 8b3e1f6a9c24
+Revises: 5f2a8c7d1e06
+Create Date: 2026-10-19 23:00:00.000000+00:00
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '8b3e1f6a9c24'
+down_revision: Union[str, Sequence[str], None] = '5f2a8c7d1e06'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('reports', sa.Column('status_version', sa.Integer(), server_default='0', nullable=False))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    with op.batch_alter_table('reports') as batch_op:
+        batch_op.drop_column('status_version')
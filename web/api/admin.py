@@ -0,0 +1,38 @@
+"""
+Admin API routes
+"""
+from fastapi import APIRouter, Depends, HTTPException, Response
+
+from .. import profiling
+from ..common import get_admin
+
+router = APIRouter(dependencies=[Depends(get_admin)])
+
+
+@router.get("/profiles")
+def get_profiles():
+    """List the recorded request profiles, most recent first"""
+    return [profile.summary() for profile in reversed(profiles())]
+
+
+@router.get("/profiles/collapsed")
+def get_profiles_collapsed():
+    """Get all recorded profiles as one set of collapsed stacks, each
+    under a frame naming its request"""
+    return Response(
+        content="".join(profile.collapsed((f"{profile.method} {profile.path}".replace(";", ":").replace(" ", "_"),)) for profile in profiles()),
+        media_type="text/plain")
+
+
+@router.get("/profiles/{profile_id}")
+def get_profile(profile_id: int):
+    """Get a recorded profile as collapsed stacks"""
+    for profile in profiles():
+        if profile.id == profile_id:
+            return Response(content=profile.collapsed(), media_type="text/plain")
+    raise HTTPException(status_code=404, detail="Profile not found")
+
+
+def profiles():
+    # A copy, as profiles are added concurrently
+    return list(profiling.profiles)
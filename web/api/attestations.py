@@ -2,33 +2,43 @@
 Attestation API routes
 """
 from fastapi import APIRouter, Depends, HTTPException
+from fastapi.concurrency import run_in_threadpool
 from sqlalchemy.orm import Session
 
-from .. import crud, models, schemas
-from ..common import get_db, get_token
+from .. import crud, ingest, schemas, verification
+from ..common import get_db, get_session_factory, get_token
 
 router = APIRouter()
 
 
 @router.post("/attestation/{drv_hash}")
-def record_attestation(
+async def record_attestation(
     drv_hash: str,
     output_sha256_map: list[schemas.OutputHashPair],
     token: str = Depends(get_token),
     db: Session = Depends(get_db),
+    session_factory = Depends(get_session_factory),
 ):
     """Record a build attestation for a derivation"""
-    user = crud.get_user_with_token(db, token)
+    user = await run_in_threadpool(crud.get_user_with_token, db, token)
     if user == None:
         raise HTTPException(status_code=401, detail="User not found")
 
-    crud.create_attestation(db, drv_hash, output_sha256_map, user)
+    if ingest.ENABLED and output_sha256_map:
+        # Acknowledged once the group holding it is committed
+        try:
+            rows = await ingest.create_attestation(session_factory, drv_hash, output_sha256_map, user)
+        except ingest.QueueFull:
+            raise HTTPException(status_code=503, detail="Ingest queue full", headers={"Retry-After": "1"})
+    else:
+        rows = await run_in_threadpool(crud.create_attestation, db, drv_hash, output_sha256_map, user)
+    verification.submit(session_factory, rows, output_sha256_map)
     return {
         "Attestation accepted"
     }
 
 
 @router.get("/attestations/by-output/{output_path}")
-def attestations_by_out(output_path: str, db: Session = Depends(get_db)):
+def attestations_by_out(output_path: str, db: Session = Depends(get_db)) -> list[schemas.Attestation]:
     """Get all attestations for a specific output path"""
-    return db.query(models.Attestation).filter_by(output_path="/nix/store/"+output_path).all()
+    return [schemas.Attestation.from_row(row) for row in crud.attestations_by_output(db, output_path)]
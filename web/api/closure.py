@@ -0,0 +1,28 @@
+"""
+Closure API routes
+"""
+import collections
+
+from fastapi import APIRouter, Depends, HTTPException
+from sqlalchemy.orm import Session
+
+from .. import crud, nix, schemas
+from ..common import get_db
+
+router = APIRouter()
+
+
+@router.get("/{output_path}/summary")
+def closure_summary(output_path: str, db: Session = Depends(get_db)) -> schemas.ClosureSummary:
+    """Get the reproducibility of the runtime closure of an output path,
+    following the references submitted with attestations"""
+    results = crud.closure_summaries(db, output_path)
+    if results is None:
+        raise HTTPException(status_code=404, detail="Output path not found")
+    path = nix.store_path(*nix.split_store_path(output_path))
+    return {
+        "output_path": path,
+        "status": results[path],
+        "paths": len(results),
+        "statuses": collections.Counter(results.values()),
+    }
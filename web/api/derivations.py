@@ -1,46 +1,50 @@
 """
 Derivation API routes
 """
-from collections import defaultdict
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Query
 from sqlalchemy.orm import Session
 
-from .. import models, schemas
+from .. import crud, schemas
 from ..common import get_db
 
 router = APIRouter()
 
 
-def get_drv_recap_or_404(session, drv_hash, full) -> schemas.DerivationAttestation:
+def get_drv_recap_or_404(session, drv_hash, full) -> schemas.DerivationAttestation | list[schemas.Attestation]:
     """Get derivation attestation summary or full details"""
-    drv = session.query(models.Derivation).filter_by(drv_hash=drv_hash).one_or_none()
-    if drv is None:
+    drv_id = crud.derivation_ids(session, [drv_hash]).get(drv_hash)
+    if drv_id is None:
         raise HTTPException(status_code=404, detail="Not found")
 
-    attestations = drv.attestations
     if (full):
-        return attestations
-
-    attestation_outputs = defaultdict(dict)
-    for attestation in attestations:
-        if attestation.output_hash not in attestation_outputs[attestation.output_path].keys():
-            attestation_outputs[attestation.output_path][attestation.output_hash] = 1
-        else:
-            attestation_outputs[attestation.output_path][attestation.output_hash] += 1
-
-    return attestation_outputs
+        return [schemas.Attestation.from_row(row) for row in crud.derivation_attestations(session, drv_id)]
+    return crud.derivation_hash_counts(session, drv_id)
 
 
 @router.get("/")
 def get_derivations(db: Session = Depends(get_db)) -> schemas.DerivationList:
     """List all derivations"""
-    return db.query(models.Derivation).all()
+    return [schemas.Derivation(id=row.id, drv_hash=row.drv_hash) for row in crud.derivations(db)]
+
+
+@router.get("/search")
+def search_derivations(
+    q: str = Query(min_length=3),
+    limit: int = Query(default=50, ge=1, le=500),
+    offset: int = Query(default=0, ge=0),
+    db: Session = Depends(get_db),
+) -> list[schemas.Derivation]:
+    """Search derivations by their name or the names of their outputs"""
+    return [
+        schemas.Derivation(id=row.id, drv_hash=row.drv_hash)
+        for row in crud.search_derivations(db, q, limit, offset)
+    ]
 
 
 @router.get("/{drv_hash}")
 def get_drv(drv_hash: str,
             full: bool = False,
             db: Session = Depends(get_db),
-):
+) -> schemas.DerivationAttestation | list[schemas.Attestation]:
     """Get a specific derivation with its attestation summary"""
     return get_drv_recap_or_404(db, drv_hash, full)
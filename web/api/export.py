@@ -0,0 +1,107 @@
+"""
+Bulk export API routes
+"""
+import importlib.util
+import io
+import json
+import typing as t
+
+from fastapi import APIRouter, Depends, HTTPException
+from fastapi.responses import StreamingResponse
+
+from .. import crud, nix
+from ..common import get_session_factory
+
+router = APIRouter()
+
+EXPORT_BATCH_SIZE = 5000
+
+FORMATS = {
+    "ndjson": "application/x-ndjson",
+    "arrow": "application/vnd.apache.arrow.stream",
+}
+
+
+def export_columns(rows) -> dict[str, list]:
+    """Columns of the exported fields for a batch of attestation rows"""
+    return {
+        "id": [row.id for row in rows],
+        "output_path": [nix.store_path(row.output_digest, row.output_name) for row in rows],
+        "user_id": [row.user_id for row in rows],
+        "user_name": [row.user_name for row in rows],
+        "user_peer": [row.user_peer for row in rows],
+        "drv_id": [row.drv_id for row in rows],
+        "drv_hash": [row.drv_hash for row in rows],
+        "output_hash": [row.output_hash for row in rows],
+        "output_sig": [nix.join_signature(row.sig_key, row.sig) for row in rows],
+        "sig_verified": [row.sig_verified for row in rows],
+        "nar_size": [row.nar_size for row in rows],
+        "build_duration": [row.build_duration for row in rows],
+    }
+
+
+def ndjson(batches) -> t.Iterator[str]:
+    for rows in batches:
+        columns = export_columns(rows)
+        names = list(columns)
+        yield "".join(
+            json.dumps(dict(zip(names, values)), separators=(",", ":")) + "\n"
+            for values in zip(*columns.values())
+        )
+
+
+def arrow(batches) -> t.Iterator[bytes]:
+    # Optional, and slow to import, so only loaded when asked for
+    import pyarrow
+    import pyarrow.ipc
+
+    schema = pyarrow.schema([
+        ("id", pyarrow.int64()),
+        ("output_path", pyarrow.string()),
+        ("user_id", pyarrow.int64()),
+        ("user_name", pyarrow.string()),
+        ("user_peer", pyarrow.string()),
+        ("drv_id", pyarrow.int64()),
+        ("drv_hash", pyarrow.string()),
+        ("output_hash", pyarrow.string()),
+        ("output_sig", pyarrow.string()),
+        ("sig_verified", pyarrow.bool_()),
+        ("nar_size", pyarrow.int64()),
+        ("build_duration", pyarrow.float64()),
+    ])
+    # Each batch is written out as an IPC record batch message and sent
+    # right away, so only one batch is held at a time
+    sink = io.BytesIO()
+    with pyarrow.ipc.new_stream(sink, schema) as writer:
+        for rows in batches:
+            writer.write_batch(pyarrow.RecordBatch.from_pydict(export_columns(rows), schema=schema))
+            yield sink.getvalue()
+            sink.seek(0)
+            sink.truncate()
+    yield sink.getvalue()
+
+
+@router.get("/attestations")
+def export_attestations(
+    since: int = 0,
+    format: str = "ndjson",
+    session_factory = Depends(get_session_factory),
+):
+    """Stream all attestations with an id above since, in id order
+
+    Resume an interrupted export by passing the last id received as since.
+    """
+    if format not in FORMATS:
+        raise HTTPException(status_code=400, detail="Unknown format")
+    if format == "arrow" and importlib.util.find_spec("pyarrow") is None:
+        raise HTTPException(status_code=501, detail="Arrow export needs pyarrow")
+    encode = ndjson if format == "ndjson" else arrow
+
+    def stream():
+        db = session_factory()
+        try:
+            yield from encode(crud.attestation_batches(db, since, EXPORT_BATCH_SIZE))
+        finally:
+            db.close()
+
+    return StreamingResponse(stream(), media_type=FORMATS[format])
@@ -0,0 +1,27 @@
+"""
+Change feed API routes
+"""
+from fastapi import APIRouter, Depends, Query
+from sqlalchemy.orm import Session
+
+from .. import crud, schemas
+from ..common import get_db
+from .export import export_columns
+
+router = APIRouter()
+
+
+@router.get("")
+def get_feed(
+    after: int = 0,
+    limit: int = Query(default=1000, ge=1, le=10000),
+    db: Session = Depends(get_db),
+) -> schemas.Feed:
+    """Get the attestations recorded after the one with id after, oldest
+    first, along with the id to continue from"""
+    rows = crud.attestations_after(db, after, limit)
+    columns = export_columns(rows)
+    return {
+        "attestations": [dict(zip(columns, values)) for values in zip(*columns.values())],
+        "last_id": rows[-1].id if rows else after,
+    }
@@ -0,0 +1,38 @@
+"""
+Health check API routes
+"""
+import functools
+import pathlib
+
+from fastapi import APIRouter, Depends
+from fastapi.responses import JSONResponse
+from sqlalchemy import text
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.orm import Session
+
+from ..common import get_db
+
+router = APIRouter()
+
+
+@functools.cache
+def schema_heads() -> set[str]:
+    """The revisions the database schema should be at"""
+    # Alembic takes a while to import, so only load it once asked
+    from alembic.config import Config
+    from alembic.script import ScriptDirectory
+    config = Config(str(pathlib.Path(__file__).parent.parent / "alembic.ini"))
+    return set(ScriptDirectory.from_config(config).get_heads())
+
+
+@router.get("/ready")
+def ready(db: Session = Depends(get_db)):
+    """Whether this worker can serve requests: the database is reachable
+    and its schema is migrated to the current revision"""
+    try:
+        current = set(db.scalars(text("SELECT version_num FROM alembic_version")))
+    except SQLAlchemyError:
+        return JSONResponse({"status": "database unavailable"}, status_code=503)
+    if current != schema_heads():
+        return JSONResponse({"status": "schema not migrated"}, status_code=503)
+    return {"status": "ready"}
@@ -0,0 +1,28 @@
+"""
+Background job API routes
+"""
+import json
+from fastapi import APIRouter, Depends, HTTPException
+from sqlalchemy.orm import Session
+
+from .. import crud, schemas
+from ..common import get_db
+
+router = APIRouter()
+
+
+@router.get("/{job_id}")
+def get_job(job_id: int, db: Session = Depends(get_db)) -> schemas.Job:
+    """Get the status (and result, once done) of a background job"""
+    job = crud.get_job(db, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return schemas.Job(
+        id=job.id,
+        kind=job.kind,
+        status=job.status,
+        created_at=job.created_at,
+        finished_at=job.finished_at,
+        result=json.loads(job.result) if job.result is not None else None,
+        error=job.error,
+    )
@@ -4,16 +4,16 @@ Link pattern API routes
 from fastapi import APIRouter, Depends, HTTPException
 from sqlalchemy.orm import Session
 
-from .. import crud, models
+from .. import crud, schemas
 from ..common import get_db, get_token
 
 router = APIRouter()
 
 
 @router.get("")
-def get_link_patterns(db: Session = Depends(get_db)):
+def get_link_patterns(db: Session = Depends(get_db)) -> list[schemas.LinkPattern]:
     """Get all link patterns"""
-    return db.query(models.LinkPattern).all()
+    return [schemas.LinkPattern(pattern=row.pattern, link=row.link) for row in crud.link_patterns(db)]
 
 
 @router.post("")
@@ -0,0 +1,31 @@
+"""
+Nondeterministic path API routes
+"""
+import re
+
+from fastapi import APIRouter, Depends, HTTPException, Query
+from sqlalchemy.orm import Session
+
+from .. import crud, models, schemas
+from ..common import get_db
+
+router = APIRouter()
+
+
+@router.get("")
+def get_nondeterministic_paths(
+    name: str | None = None,
+    link_pattern: str | None = None,
+    limit: int = Query(default=100, ge=1, le=1000),
+    offset: int = Query(default=0, ge=0),
+    db: Session = Depends(get_db),
+) -> list[schemas.NondeterministicPath]:
+    """Get output paths attested with more than one distinct hash, most
+    recently found first, optionally only those whose name contains name
+    or that fall under one of the link patterns"""
+    if link_pattern is not None and db.get(models.LinkPattern, link_pattern) is None:
+        raise HTTPException(status_code=404, detail="Link pattern not found")
+    try:
+        return crud.nondeterministic_paths(db, limit, offset, name=name, pattern=link_pattern)
+    except re.error:
+        raise HTTPException(status_code=400, detail="Invalid link pattern")
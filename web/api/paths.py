@@ -0,0 +1,20 @@
+"""
+Store path API routes
+"""
+from fastapi import APIRouter, Depends, HTTPException
+from sqlalchemy.orm import Session
+
+from .. import crud, schemas
+from ..common import get_db
+
+router = APIRouter()
+
+
+@router.get("/{output_path}/reports")
+def path_reports(output_path: str, db: Session = Depends(get_db)) -> list[schemas.ReportPath]:
+    """Get the reports an output path is part of, with the component of
+    each that lists it"""
+    rows = crud.path_reports(db, output_path)
+    if rows is None:
+        raise HTTPException(status_code=404, detail="Output path not found")
+    return [schemas.ReportPath(report=row.report, component=row.component) for row in rows]
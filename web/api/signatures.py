@@ -4,7 +4,7 @@ Signature/NAR info API routes
 from fastapi import APIRouter, Depends, HTTPException, Response
 from sqlalchemy.orm import Session
 
-from .. import models
+from .. import crud, models
 from ..common import get_db
 
 router = APIRouter()
@@ -17,13 +17,13 @@ def nix_cache_info(
     db: Session = Depends(get_db),
 ):
     """Nix cache info endpoint"""
-    user = db.query(models.User).filter_by(name=user_name).one_or_none()
+    user = crud.local_user(db, user_name)
     if user is None:
         raise HTTPException(status_code=401, detail="User not found")
 
-    attestations = db.query(models.Attestation).filter_by(
-        output_digest=output_digest,
-        user_id=user.id
+    attestations = db.query(models.Attestation).join(models.Attestation.path).filter(
+        models.StorePath.digest == output_digest,
+        models.Attestation.user_id == user.id
     ).all()
 
     if len(attestations) == 0:
@@ -36,12 +36,15 @@ def nix_cache_info(
         deriver = ""
     else:
         deriver = f"Deriver: {derivation.drv_hash}.drv\n"
+    # Nix wants a size, though it can't check the signature against a
+    # made up one
+    nar_size = attestation.nar_size if attestation.nar_size is not None else 1
 
     return Response(
         content=f"""StorePath: /nix/store/{attestation.output_digest}-{attestation.output_name}
 URL: no
 NarHash: {attestation.output_hash}
-NarSize: 1
+NarSize: {nar_size}
 {deriver}Sig: {attestation.output_sig}
 """,
         media_type="text/x-nix-narinfo"
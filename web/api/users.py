@@ -0,0 +1,50 @@
+"""
+User API routes
+"""
+import base64
+
+from fastapi import APIRouter, Depends, HTTPException
+from sqlalchemy.orm import Session
+
+from .. import crud, models, nix, schemas, verification
+from ..common import get_db, get_session_factory, get_user
+
+router = APIRouter()
+
+
+@router.post("/keys")
+def post_user_key(
+    key: str,
+    user: int = Depends(get_user),
+    db: Session = Depends(get_db),
+    session_factory = Depends(get_session_factory),
+):
+    """Register a <key name>:<base64> ed25519 public key to verify the
+    user's signatures with
+
+    The user's attestations that were stored unverified are checked again
+    in the background.
+    """
+    parts = nix.split_public_key(key)
+    if parts is None:
+        raise HTTPException(status_code=400, detail="Invalid public key")
+    crud.add_user_key(db, user, *parts)
+    verification.recheck(session_factory, user)
+    return "OK"
+
+
+@router.get("/{user_name}/keys")
+def get_user_keys(user_name: str, db: Session = Depends(get_db)) -> list[str]:
+    """Get the public keys registered by a user"""
+    user = crud.local_user(db, user_name)
+    if user is None:
+        raise HTTPException(status_code=404, detail="User not found")
+    keys = db.query(models.UserKey).filter_by(user_id=user.id).order_by(models.UserKey.name)
+    return [f"{key.name}:{base64.b64encode(key.public_key).decode()}" for key in keys]
+
+
+@router.get("/agreement")
+def get_user_agreement(db: Session = Depends(get_db)) -> list[schemas.UserAgreement]:
+    """Get, for every pair of users who attested the same paths, how
+    often they got the same hash and how often not"""
+    return [schemas.UserAgreement.model_validate(row, from_attributes=True) for row in crud.user_agreement(db)]
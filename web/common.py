@@ -2,6 +2,8 @@
 Common utilities for the application
 Provides: database sessions, authentication, templates
 """
+import hmac
+import os
 import pathlib
 import typing as t
 from fastapi import Depends, HTTPException
@@ -21,6 +23,10 @@ def get_db():
     finally:
         db.close()
 
+def get_session_factory():
+    """Get the session factory used by background jobs"""
+    return SessionLocal
+
 # Authentication
 get_bearer_token = HTTPBearer(auto_error=False)
 
@@ -43,6 +49,18 @@ async def get_user(
         raise HTTPException(status_code=401, detail="User not found")
     return user_id
 
+# Token of the administrator, who may profile the server. Without one,
+# nobody can.
+ADMIN_TOKEN = os.environ.get("LILA_ADMIN_TOKEN", "")
+
+def is_admin(token: str) -> bool:
+    return bool(ADMIN_TOKEN) and hmac.compare_digest(token.encode(), ADMIN_TOKEN.encode())
+
+async def get_admin(token: str = Depends(get_token)):
+    """Raise 403 unless the request carries the admin token"""
+    if not is_admin(token):
+        raise HTTPException(status_code=403, detail="Admin token required")
+
 # Templates
 thispath = pathlib.Path(__file__).parent.resolve()
 templates = Jinja2Templates(directory=str(thispath / "templates"))
@@ -1,40 +1,338 @@
+import collections
+import datetime
+import itertools
 import json
-import os
+import re
 
-from sqlalchemy import distinct, func, select, values
-if 'SQLALCHEMY_DATABASE_URL' in os.environ and 'postgres' in os.environ['SQLALCHEMY_DATABASE_URL']:
-    print("Using postgres dialect")
-    from sqlalchemy.dialects.postgresql import insert
-else:
-    print("Using sqlite dialect")
-    from sqlalchemy.dialects.sqlite import insert
+from sqlalchemy import Integer, LargeBinary, any_, bindparam, delete, distinct, func, literal, select, text, type_coerce, update, values
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.dialects.postgresql import ARRAY
+from sqlalchemy.orm import Session, aliased
 
-from sqlalchemy.orm import Session
-from sqlalchemy.sql.functions import user
+from . import events, models, nix, schemas
 
-from . import models, schemas
 
+# Columns of the unique index identifying an attestation: submitting the
+# same attestation again is a no-op
+ATTESTATION_IDENTITY = ["path_id", "user_id", "drv_id", "output_hash"]
 
-def create_attestation(db: Session, drv_hash: str, output_hash_map: list[schemas.OutputHashPair], user_id):
-    derivation = db.query(models.Derivation).filter_by(drv_hash=drv_hash).first()
-    if not derivation:
-        derivation = models.Derivation(drv_hash=drv_hash)
-        db.add(derivation)
+def insert(db: Session, table):
+    """INSERT statement with the ON CONFLICT support of the database db
+    is bound to"""
+    if db.get_bind().dialect.name == "postgresql":
+        return postgresql.insert(table)
+    return sqlite.insert(table)
+
+def create_attestation(db: Session, drv_hash: str, output_hash_map: list[schemas.OutputHashPair], user_id) -> list[dict]:
+    """Record attestations for the outputs of a derivation, returning the
+    rows submitted, in the order of output_hash_map"""
+    records = attestation_records(drv_hash, output_hash_map)
+    if records:
+        rows = create_attestations(db, records, user_id)
+    else:
+        derivation_ids(db, [drv_hash], create=True)
         db.commit()
-    for item in output_hash_map:
+        rows = []
+    events.publish([path for _, path, *_ in records])
+    return rows
+
+def attestation_records(drv_hash: str, output_hash_map: list[schemas.OutputHashPair]) -> list[tuple]:
+    """The outputs of a derivation as create_attestations takes them"""
+    return [
+        (drv_hash, nix.store_path(item.output_digest, item.output_name), item.output_hash, item.output_sig,
+         item.nar_size, item.build_duration, item.references)
+        for item in output_hash_map
+    ]
+
+def utcnow() -> datetime.datetime:
+    """The current time in UTC, as stored in timestamp columns"""
+    return datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
+
+def create_attestations(db: Session, records: list[tuple], user_id, commit: bool = True) -> list[dict]:
+    """Record attestations given as (drv_hash, output path, output hash,
+    output signature, NAR size, build duration, references) tuples in a
+    single transaction, returning the rows submitted, in the order of
+    records. The NAR size, build duration and store paths the output
+    refers to are None when unknown."""
+    drv_ids = derivation_ids(db, [record[0] for record in records], create=True)
+    references = {(record[1], ref) for record in records if record[6] for ref in record[6] if ref != record[1]}
+    path_ids = store_path_ids(db, [record[1] for record in records] + [ref for _, ref in references], create=True)
+    signatures = [nix.split_signature(record[3]) for record in records]
+    key_ids = signing_key_ids(db, [key_name for key_name, _ in signatures if key_name is not None])
+    rows = [
+        {
+            "path_id": path_ids[path],
+            "user_id": user_id,
+            "drv_id": drv_ids[drv_hash],
+            "output_hash": output_hash,
+            "sig_key_id": key_ids.get(key_name),
+            "sig": sig,
+            "nar_size": nar_size,
+            "build_duration": build_duration,
+        }
+        for (drv_hash, path, output_hash, _, nar_size, build_duration, _), (key_name, sig) in zip(records, signatures)
+    ]
+    if references:
         db.execute(
-                insert(models.Attestation)
-                .values(
-                    {
-                        "output_digest": item.output_digest,
-                        "output_name": item.output_name,
-                        "user_id": user_id,
-                        "drv_id": derivation.id,
-                        "output_hash": item.output_hash,
-                        "output_sig": item.output_sig,
-                        }
-        ))
+            insert(db, models.StorePathReference).on_conflict_do_nothing(index_elements=["path_id", "reference_id"]),
+            [{"path_id": path_ids[path], "reference_id": path_ids[ref]} for path, ref in references])
+    if rows:
+        _order_attestation_ids(db)
+        # Only the attestations actually added change the indexes below
+        added = db.execute(
+            insert(db, models.Attestation)
+            .values(created_at=utcnow())
+            .on_conflict_do_nothing(index_elements=ATTESTATION_IDENTITY)
+            .returning(models.Attestation.id, models.Attestation.path_id),
+            rows).all()
+        if added:
+            update_path_indexes(db, dict(added))
+    if commit:
         db.commit()
+    return rows
+
+# Key of the advisory lock PostgreSQL ingest holds from taking attestation
+# ids until it commits
+ATTESTATION_IDS_LOCK = 0x6c696c61
+
+def _order_attestation_ids(db: Session):
+    """Have transactions take attestation ids in the order they commit
+
+    Readers of the change feed page by id, so a transaction committing
+    rows with lower ids than one already seen would have them skipped.
+    On PostgreSQL ids come from a sequence, so transactions take turns
+    from their first id to their commit. On SQLite the write lock ingest
+    holds already does this.
+    """
+    if db.get_bind().dialect.name == "postgresql":
+        db.execute(select(func.pg_advisory_xact_lock(ATTESTATION_IDS_LOCK)))
+
+def update_path_indexes(db: Session, added: dict[int, int]):
+    """Bring the indexes maintained on ingest up to date after the
+    attestations with the ids in added, mapped to their path ids, came in:
+    the nondeterministic paths, the agreement between users and which
+    reports are stale"""
+    _lock_paths(db, added.values())
+    by_path = _path_attestations(db, added.values())
+    _update_nondeterministic(db, by_path)
+    _update_agreement(db, by_path, added)
+    _mark_reports_stale(db, list(by_path))
+
+def _mark_reports_stale(db: Session, path_ids: list[int]):
+    # Only the reports with one of the paths, found through the index;
+    # most paths are in none
+    report_ids = set()
+    for clause in in_clauses(db, models.ReportPath.path_id, path_ids):
+        report_ids.update(db.scalars(select(models.ReportPath.report_id).where(clause).distinct()))
+    if report_ids:
+        db.execute(
+            update(models.Report)
+            .where(models.Report.id.in_(report_ids))
+            .values(stale=True, status_version=models.Report.status_version + 1)
+            .execution_options(synchronize_session=False))
+
+def _lock_paths(db: Session, path_ids):
+    """Have transactions updating the indexes of the same paths take turns
+
+    The indexes are computed from all attestations of a path, so two
+    transactions adding attestations to a path each have to see the
+    other's. On PostgreSQL the second one waits on the row lock until the
+    first commits, then reads its attestations. On SQLite the write lock
+    ingest holds already does this.
+    """
+    if db.get_bind().dialect.name != "postgresql":
+        return
+    for clause in in_clauses(db, models.StorePath.id, list(set(path_ids))):
+        # NO KEY UPDATE doesn't wait for the KEY SHARE locks the foreign
+        # keys of the attestations just inserted hold, and locking in id
+        # order keeps transactions from waiting on each other
+        db.execute(select(models.StorePath.id).where(clause).order_by(models.StorePath.id).with_for_update(key_share=True))
+
+def _path_attestations(db: Session, path_ids) -> dict[int, list]:
+    """All attestations of the given paths, by path"""
+    by_path = {}
+    output_hash = type_coerce(models.Attestation.output_hash, LargeBinary).label("output_hash")
+    for clause in in_clauses(db, models.Attestation.path_id, list(set(path_ids))):
+        stmt = select(models.Attestation.id, models.Attestation.path_id, models.Attestation.user_id, output_hash).where(clause)
+        for row in db.execute(stmt):
+            by_path.setdefault(row.path_id, []).append(row)
+    return by_path
+
+def _update_nondeterministic(db: Session, by_path: dict):
+    counts = []
+    users = []
+    for path_id, attestations in by_path.items():
+        distinct_hashes = len({a.output_hash for a in attestations})
+        if distinct_hashes > 1:
+            counts.append({"path_id": path_id, "distinct_hashes": distinct_hashes})
+            users.extend({"path_id": path_id, "user_id": user_id} for user_id in {a.user_id for a in attestations})
+    if not counts:
+        return
+    stmt = insert(db, models.NondeterministicPath)
+    db.execute(
+        stmt.on_conflict_do_update(index_elements=["path_id"], set_={"distinct_hashes": stmt.excluded.distinct_hashes}),
+        counts)
+    db.execute(
+        insert(db, models.NondeterministicPathUser).on_conflict_do_nothing(index_elements=["path_id", "user_id"]),
+        users)
+
+def _pair_counts(attestations) -> dict[tuple[int, int], list[int]]:
+    """Agreeing and disagreeing pairs of attestations by different users,
+    by pair of users, counted from the number of attestations of each
+    user and hash rather than pair by pair"""
+    tally = {}
+    for a in attestations:
+        by_hash = tally.setdefault(a.user_id, collections.Counter())
+        by_hash[a.output_hash] += 1
+    counts = {}
+    for user_a, user_b in itertools.combinations(sorted(tally), 2):
+        a, b = tally[user_a], tally[user_b]
+        agree = sum(n * b[h] for h, n in a.items() if h in b)
+        counts[user_a, user_b] = [agree, a.total() * b.total() - agree]
+    return counts
+
+def _update_agreement(db: Session, by_path: dict, added: dict[int, int]):
+    # Every pair of attestations of a path by different users counts once,
+    # so the added pairs are those among all attestations of the path less
+    # those among the ones that were already there. This relies on
+    # _lock_paths: without it, a pair of attestations added concurrently
+    # would be in neither transaction's view and never count.
+    counts = {}
+    for attestations in by_path.values():
+        before = _pair_counts([a for a in attestations if a.id not in added])
+        for pair, (agree, disagree) in _pair_counts(attestations).items():
+            agree_before, disagree_before = before.get(pair, (0, 0))
+            if agree > agree_before or disagree > disagree_before:
+                total = counts.setdefault(pair, [0, 0])
+                total[0] += agree - agree_before
+                total[1] += disagree - disagree_before
+    if not counts:
+        return
+    stmt = insert(db, models.UserAgreement)
+    db.execute(
+        stmt.on_conflict_do_update(index_elements=["user_a", "user_b"], set_={
+            "agree_count": models.UserAgreement.agree_count + stmt.excluded.agree_count,
+            "disagree_count": models.UserAgreement.disagree_count + stmt.excluded.disagree_count,
+        }),
+        [
+            {"user_a": user_a, "user_b": user_b, "agree_count": agree, "disagree_count": disagree}
+            for (user_a, user_b), (agree, disagree) in counts.items()
+        ])
+
+def remove_attestations(db: Session, removed: dict[int, int]):
+    """Delete the attestations with the ids in removed, mapped to their
+    path ids, along with the store paths and derivations left without
+    attestations, and bring the indexes maintained on ingest up to date"""
+    # Otherwise attestations ingested meanwhile would pair with removed
+    # ones, and those pairs would never be taken off the counts
+    _lock_paths(db, removed.values())
+    by_path = _path_attestations(db, removed.values())
+    remaining = {
+        path_id: [a for a in attestations if a.id not in removed]
+        for path_id, attestations in by_path.items()
+    }
+    drv_ids = set()
+    for clause in in_clauses(db, models.Attestation.id, list(removed)):
+        drv_ids.update(db.scalars(select(models.Attestation.drv_id).where(clause)))
+        db.execute(delete(models.Attestation).where(clause))
+
+    # The pairs the removed attestations were part of no longer count
+    counts = {}
+    for path_id, attestations in by_path.items():
+        after = _pair_counts(remaining[path_id])
+        for pair, (agree, disagree) in _pair_counts(attestations).items():
+            agree_after, disagree_after = after.get(pair, (0, 0))
+            total = counts.setdefault(pair, [0, 0])
+            total[0] += agree - agree_after
+            total[1] += disagree - disagree_after
+    for (user_a, user_b), (agree, disagree) in counts.items():
+        if agree or disagree:
+            db.execute(
+                update(models.UserAgreement)
+                .where(models.UserAgreement.user_a == user_a, models.UserAgreement.user_b == user_b)
+                .values(
+                    agree_count=models.UserAgreement.agree_count - agree,
+                    disagree_count=models.UserAgreement.disagree_count - disagree,
+                ))
+    db.execute(delete(models.UserAgreement).where(models.UserAgreement.agree_count == 0, models.UserAgreement.disagree_count == 0))
+
+    # Index the paths again from what is left of them, keeping when they
+    # were first found nondeterministic
+    for clause in in_clauses(db, models.NondeterministicPathUser.path_id, list(by_path)):
+        db.execute(delete(models.NondeterministicPathUser).where(clause))
+    deterministic = [path_id for path_id, attestations in remaining.items() if len({a.output_hash for a in attestations}) < 2]
+    for clause in in_clauses(db, models.NondeterministicPath.path_id, deterministic):
+        db.execute(delete(models.NondeterministicPath).where(clause))
+    _update_nondeterministic(db, remaining)
+    _mark_reports_stale(db, list(by_path))
+
+    # Paths left without attestations lose the references submitted with
+    # them, and go unless another path or a report still refers to them,
+    # as do the paths only they referred to
+    orphans = [path_id for path_id, attestations in remaining.items() if not attestations]
+    referenced = set()
+    for clause in in_clauses(db, models.StorePathReference.path_id, orphans):
+        referenced.update(db.scalars(select(models.StorePathReference.reference_id).where(clause)))
+        db.execute(delete(models.StorePathReference).where(clause))
+    unused = set(orphans) | referenced
+    for clause in in_clauses(db, models.Attestation.path_id, list(referenced)):
+        unused.difference_update(db.scalars(select(models.Attestation.path_id).where(clause).distinct()))
+    for clause in in_clauses(db, models.StorePathReference.reference_id, list(unused)):
+        unused.difference_update(db.scalars(select(models.StorePathReference.reference_id).where(clause).distinct()))
+    for clause in in_clauses(db, models.ReportPath.path_id, list(unused)):
+        unused.difference_update(db.scalars(select(models.ReportPath.path_id).where(clause).distinct()))
+    for clause in in_clauses(db, models.StorePath.id, list(unused)):
+        db.execute(delete(models.StorePath).where(clause))
+    for clause in in_clauses(db, models.Attestation.drv_id, list(drv_ids)):
+        drv_ids.difference_update(db.scalars(select(models.Attestation.drv_id).where(clause).distinct()))
+    for clause in in_clauses(db, models.Derivation.id, list(drv_ids)):
+        db.execute(delete(models.Derivation).where(clause))
+
+def derivation_ids(db: Session, drv_hashes, create: bool = False) -> dict[str, int]:
+    """Ids of the given derivations, adding the missing ones if create is set"""
+    ids = {}
+
+    def lookup(hashes):
+        for clause in in_clauses(db, models.Derivation.drv_hash, hashes):
+            stmt = select(models.Derivation.id, models.Derivation.drv_hash).where(clause).order_by(models.Derivation.id)
+            for row in db.execute(stmt):
+                ids.setdefault(row.drv_hash, row.id)
+
+    drv_hashes = list(set(drv_hashes))
+    lookup(drv_hashes)
+    missing = [drv_hash for drv_hash in drv_hashes if drv_hash not in ids]
+    if create and missing:
+        db.execute(insert(db, models.Derivation), [{"drv_hash": drv_hash} for drv_hash in missing])
+        lookup(missing)
+    return ids
+
+def store_path_ids(db: Session, paths, create: bool = False) -> dict[str, int]:
+    """Ids of the given store paths, adding the missing ones if create is set"""
+    parts = {path: nix.split_store_path(path) for path in paths}
+    if create and parts:
+        db.execute(
+            insert(db, models.StorePath).on_conflict_do_nothing(index_elements=["digest", "name"]),
+            [{"digest": digest, "name": name} for digest, name in set(parts.values())])
+    # Match on the stored bytes, so digests are only converted once
+    digest = type_coerce(models.StorePath.digest, LargeBinary)
+    keys = {path: (nix.digest_to_bytes(d), name) for path, (d, name) in parts.items()}
+    ids = {}
+    for clause in in_clauses(db, digest, [key[0] for key in keys.values()]):
+        stmt = select(models.StorePath.id, digest.label("digest"), models.StorePath.name).where(clause)
+        for row in db.execute(stmt):
+            ids[(row.digest, row.name)] = row.id
+    return {path: ids[key] for path, key in keys.items() if key in ids}
+
+def signing_key_ids(db: Session, names) -> dict[str, int]:
+    """Ids of the interned signing key names, interning new ones"""
+    names = set(names)
+    if not names:
+        return {}
+    db.execute(
+        insert(db, models.SigningKey).on_conflict_do_nothing(index_elements=["name"]),
+        [{"name": name} for name in names])
+    stmt = select(models.SigningKey.id, models.SigningKey.name).where(models.SigningKey.name.in_(names))
+    return {row.name: row.id for row in db.execute(stmt)}
 
 def report(db: Session, name: str):
     r = db.query(models.Report).filter_by(name=name).one_or_none()
@@ -42,26 +340,65 @@ def report(db: Session, name: str):
         return None
     return json.loads(r.definition)
 
+# Report queries filter on every path in the report. Instead of one huge
+# IN (...) list, which runs into SQLite's bound-parameter limit and gives
+# every report size its own query plan, we bind a single array on
+# PostgreSQL and use fixed-size chunks elsewhere. Chunks are padded to a
+# power of two so only a handful of distinct statements are ever prepared.
+IN_CHUNK_SIZE = 512
+MIN_IN_CHUNK_SIZE = 8
+
+def _padded(chunk: list) -> list:
+    size = MIN_IN_CHUNK_SIZE
+    while size < len(chunk):
+        size *= 2
+    return chunk + [chunk[-1]] * (size - len(chunk))
+
+def in_clauses(db: Session, column, values):
+    """Yield WHERE clauses that together match column against all values"""
+    values = list(dict.fromkeys(values))
+    if not values:
+        return
+    if db.get_bind().dialect.name == "postgresql":
+        yield column == any_(bindparam(None, values, type_=ARRAY(column.type)))
+        return
+    for i in range(0, len(values), IN_CHUNK_SIZE):
+        yield column.in_(_padded(values[i:i+IN_CHUNK_SIZE]))
+
 def suggest(db: Session, elements, user_id):
     # Derivations in the database might not match derivations on the rebuilder system.
     # TODO: can this happen only for FODs or also for other derivations?
     # TODO: Add enough metadata to the report so you know what to nix-instantiate to get all relevant drvs
-    # TODO: don't suggest nodes that have already been rebuilt by the current user
-    #stmt = select(models.Derivation.drv_hash, models.Attestation.output_path).join(models.Attestation).where(models.Attestation.output_path.in_(paths)).group_by(models.Attestation.output_path).having(func.count(models.Attestation.id) < 2)
-    #suggestions = []
-    #for row in db.execute(stmt):
-    #    suggestions.append(row._mapping['drv_hash'])
-    candidates = list(elements.keys())
-    if user:
-        for attestation in db.query(models.Attestation).filter(models.Attestation.output_path.in_(candidates)).filter_by(user_id=user_id).all():
-            if attestation.output_path in candidates:
-                candidates.remove(attestation.output_path)
+    candidates = dict(elements)
+    paths_by_id = {path_id: path for path, path_id in store_path_ids(db, candidates).items()}
+    if user_id is not None:
+        for clause in in_clauses(db, models.Attestation.path_id, list(paths_by_id)):
+            stmt = select(models.Attestation.path_id).where(clause).where(models.Attestation.user_id == user_id).distinct()
+            for row in db.execute(stmt):
+                candidates.pop(paths_by_id.pop(row.path_id), None)
     # TODO don't consider attestations that have been built twice by the same user
     # as 'rebuilt'
-    stmt = select(models.Attestation.output_path).where(models.Attestation.output_path.in_(candidates)).group_by(models.Attestation.output_path).having(func.count(models.Attestation.id) > 1)
-    for row in db.execute(stmt):
-        candidates.remove(row._mapping['output_path'])
-    return { candidate: elements[candidate] for candidate in candidates }
+    for clause in in_clauses(db, models.Attestation.path_id, list(paths_by_id)):
+        stmt = select(models.Attestation.path_id).where(clause).group_by(models.Attestation.path_id).having(func.count(models.Attestation.id) > 1)
+        for row in db.execute(stmt):
+            candidates.pop(paths_by_id[row.path_id], None)
+    return candidates
+
+def path_costs(db: Session, paths) -> dict[str, tuple[int | None, float | None]]:
+    """The NAR size and average build duration reported for each of the
+    given output paths that has either"""
+    paths_by_id = {path_id: path for path, path_id in store_path_ids(db, paths).items()}
+    costs = {}
+    for clause in in_clauses(db, models.Attestation.path_id, list(paths_by_id)):
+        stmt = (
+            select(models.Attestation.path_id, func.max(models.Attestation.nar_size), func.avg(models.Attestation.build_duration))
+            .where(clause)
+            .group_by(models.Attestation.path_id)
+        )
+        for path_id, nar_size, build_duration in db.execute(stmt):
+            if nar_size is not None or build_duration is not None:
+                costs[paths_by_id[path_id]] = (nar_size, build_duration)
+    return costs
 
 # TODO ideally this should take into account derivation paths as well as
 # output paths, as for example for a fixed-output derivation we'd want
@@ -71,43 +408,433 @@ def suggest(db: Session, elements, user_id):
 def path_summaries(db: Session, paths):
     # TODO make sure multiple identical results from the same submitter
     # don't get counted as 'successfully reproduced'
-    stmt = select(models.Attestation.output_path, func.count(models.Attestation.id), func.count(distinct(models.Attestation.output_hash))).where(models.Attestation.output_path.in_(paths)).group_by(models.Attestation.output_path)
     results = {}
     for output_path in paths:
         results[output_path] = "No builds"
-    for result in db.execute(stmt):
-        output_path = result._mapping['output_path']
-        n_results = result._mapping['count']
-        distinct_results = result._mapping['count_1']
-        if n_results == 1:
-            results[output_path] = "One build"
-        elif distinct_results == 1:
-            results[output_path] = "Successfully reproduced"
-        elif distinct_results < n_results:
-            results[output_path] = "Partially reproduced"
-        elif distinct_results == n_results:
-            results[output_path] = "Consistently nondeterministic"
+    paths_by_id = {path_id: path for path, path_id in store_path_ids(db, paths).items()}
+    for clause in in_clauses(db, models.Attestation.path_id, list(paths_by_id)):
+        stmt = select(models.Attestation.path_id, func.count(models.Attestation.id).label('n_results'), func.count(distinct(models.Attestation.output_hash)).label('distinct_results')).where(clause).group_by(models.Attestation.path_id)
+        for result in db.execute(stmt):
+            results[paths_by_id[result.path_id]] = path_status(result.n_results, result.distinct_results)
     return results
 
-def define_report(db: Session, name: str, definition: dict):
+def path_status(n_results: int, distinct_results: int) -> str:
+    """Status of a path with n_results attestations of distinct_results
+    distinct hashes"""
+    if n_results == 0:
+        return "No builds"
+    if n_results == 1:
+        return "One build"
+    if distinct_results == 1:
+        return "Successfully reproduced"
+    if distinct_results < n_results:
+        return "Partially reproduced"
+    return "Consistently nondeterministic"
+
+def closure_summaries(db: Session, output_path: str) -> dict[str, str] | None:
+    """The status of every path in the runtime closure of output_path, as
+    far as references were submitted, or None if the path is unknown"""
+    path_id = store_path_ids(db, [output_path]).get(output_path)
+    if path_id is None:
+        return None
+    # UNION rather than UNION ALL visits every path once, however many
+    # paths refer to it
+    closure = select(literal(path_id, Integer).label("path_id")).cte("closure", recursive=True)
+    closure = closure.union(
+        select(models.StorePathReference.reference_id)
+        .join(closure, models.StorePathReference.path_id == closure.c.path_id))
+    stmt = (
+        select(
+            models.StorePath.digest,
+            models.StorePath.name,
+            func.count(models.Attestation.id),
+            func.count(distinct(models.Attestation.output_hash)),
+        )
+        .select_from(closure)
+        .join(models.StorePath, models.StorePath.id == closure.c.path_id)
+        .outerjoin(models.Attestation, models.Attestation.path_id == closure.c.path_id)
+        .group_by(closure.c.path_id, models.StorePath.digest, models.StorePath.name)
+    )
+    return {
+        nix.store_path(digest, name): path_status(n_results, distinct_results)
+        for digest, name, n_results, distinct_results in db.execute(stmt)
+    }
+
+def _attestation_rows(since: int):
+    """Select attestations with an id above since in id order, with what
+    is needed to resubmit them elsewhere"""
+    return (
+        select(
+            models.Attestation.id,
+            models.StorePath.digest.label("output_digest"),
+            models.StorePath.name.label("output_name"),
+            models.Attestation.user_id,
+            models.User.name.label("user_name"),
+            models.User.peer.label("user_peer"),
+            models.Attestation.drv_id,
+            models.Derivation.drv_hash,
+            models.Attestation.output_hash,
+            models.SigningKey.name.label("sig_key"),
+            models.Attestation.sig,
+            models.Attestation.sig_verified,
+            models.Attestation.nar_size,
+            models.Attestation.build_duration,
+        )
+        .join(models.StorePath, models.StorePath.id == models.Attestation.path_id)
+        .join(models.User, models.User.id == models.Attestation.user_id)
+        .outerjoin(models.Derivation, models.Derivation.id == models.Attestation.drv_id)
+        .outerjoin(models.SigningKey, models.SigningKey.id == models.Attestation.sig_key_id)
+        .where(models.Attestation.id > since)
+        .order_by(models.Attestation.id)
+    )
+
+def attestation_batches(db: Session, since: int = 0, batch_size: int = 1000):
+    """Yield all attestations with an id above since, in id order, as
+    batches of rows
+
+    Rows are fetched batch_size at a time through a server-side cursor
+    where the database supports one, so the full result set never sits
+    in memory.
+    """
+    stmt = _attestation_rows(since).execution_options(yield_per=batch_size)
+    yield from db.execute(stmt).partitions()
+
+def attestations_after(db: Session, after: int, limit: int):
+    """The first limit attestations with an id above after"""
+    return db.execute(_attestation_rows(after).limit(limit)).all()
+
+def _attestation_listing():
+    """Select attestations with the columns of schemas.Attestation"""
+    return (
+        select(
+            models.Attestation.id,
+            models.StorePath.digest.label("output_digest"),
+            models.StorePath.name.label("output_name"),
+            models.Attestation.user_id,
+            models.Attestation.drv_id,
+            models.Attestation.output_hash,
+            models.SigningKey.name.label("sig_key"),
+            models.Attestation.sig,
+            models.Attestation.sig_verified,
+            models.Attestation.nar_size,
+            models.Attestation.build_duration,
+        )
+        .join(models.StorePath, models.StorePath.id == models.Attestation.path_id)
+        .outerjoin(models.SigningKey, models.SigningKey.id == models.Attestation.sig_key_id)
+        .order_by(models.Attestation.id)
+    )
+
+def attestations_by_output(db: Session, output_path: str):
+    """Attestations of an output path, as rows"""
+    digest, name = nix.split_store_path(output_path)
+    stmt = _attestation_listing().where(models.StorePath.digest == digest, models.StorePath.name == name)
+    return db.execute(stmt).all()
+
+def derivation_attestations(db: Session, drv_id: int):
+    """Attestations of a derivation, as rows"""
+    return db.execute(_attestation_listing().where(models.Attestation.drv_id == drv_id)).all()
+
+def derivation_hash_counts(db: Session, drv_id: int) -> dict[str, dict[str, int]]:
+    """Number of attestations of each hash of each output of a derivation"""
+    output_hash = type_coerce(models.Attestation.output_hash, LargeBinary)
+    stmt = (
+        select(models.StorePath.digest, models.StorePath.name, output_hash, func.count())
+        .join(models.StorePath, models.StorePath.id == models.Attestation.path_id)
+        .where(models.Attestation.drv_id == drv_id)
+        .group_by(models.StorePath.digest, models.StorePath.name, output_hash)
+    )
+    counts = collections.defaultdict(dict)
+    for digest, name, raw_hash, n in db.execute(stmt):
+        counts[nix.store_path(digest, name)][nix.hash_from_bytes(raw_hash)] = n
+    return counts
+
+def derivations(db: Session):
+    return db.execute(select(models.Derivation.id, models.Derivation.drv_hash).order_by(models.Derivation.id)).all()
+
+def link_patterns(db: Session):
+    return db.execute(select(models.LinkPattern.pattern, models.LinkPattern.link)).all()
+
+def attestations_with_ids(db: Session, ids):
+    """Attestations with the given ids, as attestation_batches yields them"""
+    rows = []
+    for clause in in_clauses(db, models.Attestation.id, list(ids)):
+        rows.extend(db.execute(_attestation_rows(0).where(clause)).all())
+    return sorted(rows, key=lambda row: row.id)
+
+def local_user(db: Session, name: str):
+    """The user of this instance with the given name, if any. Stand-ins for
+    users of other instances don't count, so they can't shadow a local
+    user named like them."""
+    return db.query(models.User).filter_by(name=name, peer=None).one_or_none()
+
+def remote_user_id(db: Session, peer: str, name: str) -> int:
+    """Id of the local stand-in for the user name of the instance peer,
+    named <name>@<peer> and creating it if needed. Remote users have no
+    tokens, so they can't submit."""
+    user = db.query(models.User).filter_by(name=f"{name}@{peer}", peer=peer).one_or_none()
+    if user is None:
+        user = models.User.create(db, name=f"{name}@{peer}", peer=peer)
+    return user.id
+
+def replication_checkpoint(db: Session, peer: str) -> int:
+    checkpoint = db.get(models.ReplicationCheckpoint, peer)
+    return checkpoint.last_id if checkpoint is not None else 0
+
+def set_replication_checkpoint(db: Session, peer: str, last_id: int):
     db.execute(
-        insert(models.Report).values({
+        insert(db, models.ReplicationCheckpoint).values({
+            "peer": peer,
+            "last_id": last_id,
+            }).on_conflict_do_update(index_elements=['peer'], set_={'last_id': last_id})
+        )
+    db.commit()
+
+# Derivations whose name, or the name of one of their outputs, contains
+# the query. Names starting with it come first, then the better matches
+# by the index's own measure: bm25 of the FTS5 trigram indexes on SQLite,
+# pg_trgm similarity on PostgreSQL.
+_SEARCH_SQLITE = text("""
+    SELECT d.id, d.drv_hash FROM (
+        SELECT derivations.id AS drv_id,
+               substr(drv_hash, instr(drv_hash, '-') + 1) LIKE :prefix ESCAPE '\\' AS prefix,
+               bm25(derivation_names) AS score
+        FROM derivation_names JOIN derivations ON derivations.id = derivation_names.rowid
+        WHERE derivation_names MATCH :phrase
+        UNION ALL
+        SELECT attestations.drv_id, store_paths.name LIKE :prefix ESCAPE '\\', bm25(store_path_names)
+        FROM store_path_names
+        JOIN store_paths ON store_paths.id = store_path_names.rowid
+        JOIN attestations ON attestations.path_id = store_paths.id
+        WHERE store_path_names MATCH :phrase
+    ) AS matches JOIN derivations d ON d.id = matches.drv_id
+    GROUP BY d.id, d.drv_hash
+    ORDER BY max(prefix) DESC, min(score), d.id
+    LIMIT :limit OFFSET :offset
+""")
+_SEARCH_POSTGRES = text("""
+    SELECT d.id, d.drv_hash FROM (
+        SELECT id AS drv_id,
+               substr(drv_hash, strpos(drv_hash, '-') + 1) ILIKE :prefix AS prefix,
+               similarity(substr(drv_hash, strpos(drv_hash, '-') + 1), :q) AS score
+        FROM derivations
+        WHERE substr(drv_hash, strpos(drv_hash, '-') + 1) ILIKE :pattern
+        UNION ALL
+        SELECT attestations.drv_id, store_paths.name ILIKE :prefix, similarity(store_paths.name, :q)
+        FROM store_paths JOIN attestations ON attestations.path_id = store_paths.id
+        WHERE store_paths.name ILIKE :pattern
+    ) AS matches JOIN derivations d ON d.id = matches.drv_id
+    GROUP BY d.id, d.drv_hash
+    ORDER BY bool_or(prefix) DESC, max(score) DESC, d.id
+    LIMIT :limit OFFSET :offset
+""")
+
+def _escape_like(text: str) -> str:
+    """text with the LIKE wildcards escaped, for use with ESCAPE '\\'"""
+    return text.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+def search_derivations(db: Session, q: str, limit: int, offset: int = 0):
+    """Derivations matching q, best matches first"""
+    escaped = _escape_like(q)
+    params = {"q": q, "prefix": escaped + "%", "pattern": "%" + escaped + "%", "limit": limit, "offset": offset}
+    if db.get_bind().dialect.name == "postgresql":
+        return db.execute(_SEARCH_POSTGRES, params).all()
+    # The whole query as a single FTS5 string, so its syntax doesn't apply
+    params["phrase"] = '"' + q.replace('"', '""') + '"'
+    return db.execute(_SEARCH_SQLITE, params).all()
+
+def nondeterministic_paths(db: Session, limit: int, offset: int = 0, name: str | None = None, pattern: str | None = None) -> list[dict]:
+    """Paths from the index of nondeterministic paths, most recently
+    found first. Only those whose name contains name, or that match the
+    regular expression pattern the way link patterns are matched, if given."""
+    stmt = (
+        select(
+            models.NondeterministicPath.path_id,
+            models.NondeterministicPath.first_seen,
+            models.NondeterministicPath.distinct_hashes,
+            models.StorePath.digest,
+            models.StorePath.name,
+        )
+        .join(models.StorePath, models.StorePath.id == models.NondeterministicPath.path_id)
+        .order_by(models.NondeterministicPath.first_seen.desc(), models.NondeterministicPath.path_id.desc())
+    )
+    if name:
+        stmt = stmt.where(models.StorePath.name.ilike("%" + _escape_like(name) + "%", escape="\\"))
+    if pattern is None:
+        rows = db.execute(stmt.limit(limit).offset(offset)).all()
+    else:
+        # Regular expressions don't translate to SQL portably, so these
+        # are matched here, on the index rather than the attestations
+        regex = re.compile(pattern)
+        result = db.execute(stmt.execution_options(yield_per=1000))
+        try:
+            rows = list(itertools.islice((row for row in result if regex.match(row.name)), offset, offset + limit))
+        finally:
+            result.close()
+
+    users = {row.path_id: [] for row in rows}
+    for clause in in_clauses(db, models.NondeterministicPathUser.path_id, list(users)):
+        stmt = (
+            select(models.NondeterministicPathUser.path_id, models.User.name)
+            .join(models.User, models.User.id == models.NondeterministicPathUser.user_id)
+            .where(clause)
+            .order_by(models.User.name)
+        )
+        for path_id, user_name in db.execute(stmt):
+            users[path_id].append(user_name)
+    return [
+        {
+            "output_path": nix.store_path(row.digest, row.name),
+            "first_seen": row.first_seen,
+            "distinct_hashes": row.distinct_hashes,
+            "users": users[row.path_id],
+        }
+        for row in rows
+    ]
+
+def user_agreement(db: Session):
+    """Agreement between every pair of users who attested the same paths"""
+    user_a = aliased(models.User)
+    user_b = aliased(models.User)
+    stmt = (
+        select(
+            user_a.name.label("user_a"),
+            user_b.name.label("user_b"),
+            models.UserAgreement.agree_count,
+            models.UserAgreement.disagree_count,
+        )
+        .join(user_a, user_a.id == models.UserAgreement.user_a)
+        .join(user_b, user_b.id == models.UserAgreement.user_b)
+        .order_by(user_a.name, user_b.name)
+    )
+    return db.execute(stmt).all()
+
+def report_revision(db: Session, name: str) -> int | None:
+    """Revision of a report, incremented every time it is redefined"""
+    return db.scalar(select(models.Report.revision).where(models.Report.name == name))
+
+def report_status_version(db: Session, name: str) -> int | None:
+    """Version of the statuses of the paths of a report, incremented every
+    time attestations of one of them are added or removed"""
+    return db.scalar(select(models.Report.status_version).where(models.Report.name == name))
+
+def report_components(definition: dict) -> list[tuple[str, str]]:
+    """The (bom-ref, output path) pairs of the components of a report
+    definition, which isn't validated"""
+    return [
+        (component.get('bom-ref', ''), prop['value'])
+        for component in definition.get('components', [])
+        for prop in component.get('properties', [])
+        if prop['name'] == "nix:out_path"
+    ]
+
+def define_report(db: Session, name: str, definition: dict):
+    components = report_components(definition)
+    definition = json.dumps(definition)
+    report_id = db.execute(
+        insert(db, models.Report).values({
             "name": name,
-            "definition": json.dumps(definition),
-        }))
+            "definition": definition,
+            }).on_conflict_do_update(index_elements=['name'], set_={
+                'definition': definition,
+                'revision': models.Report.revision + 1,
+            }).returning(models.Report.id)
+        ).scalar_one()
+    _index_report_paths(db, report_id, components)
+    db.commit()
+
+def _index_report_paths(db: Session, report_id: int, components: list[tuple[str, str]]):
+    """Bring the report_paths of a report in line with its components,
+    only writing the rows that changed"""
+    path_ids = store_path_ids(db, [path for _, path in components], create=True)
+    rows = {(path_ids[path], component) for component, path in components}
+    existing = {
+        (row.path_id, row.component)
+        for row in db.execute(select(models.ReportPath.path_id, models.ReportPath.component).where(models.ReportPath.report_id == report_id))
+    }
+    # Paths that left the report or whose components changed are
+    # replaced as a whole
+    replaced = {path_id for path_id, _ in existing - rows}
+    for clause in in_clauses(db, models.ReportPath.path_id, list(replaced)):
+        db.execute(delete(models.ReportPath).where(models.ReportPath.report_id == report_id).where(clause))
+    added = [(path_id, component) for path_id, component in rows if path_id in replaced or (path_id, component) not in existing]
+    if added:
+        db.execute(insert(db, models.ReportPath), [
+            {"path_id": path_id, "report_id": report_id, "component": component}
+            for path_id, component in added
+        ])
+
+def path_reports(db: Session, output_path: str) -> list | None:
+    """The (report name, component) rows of the reports with an output
+    path, or None if the path is unknown"""
+    path_id = store_path_ids(db, [output_path]).get(output_path)
+    if path_id is None:
+        return None
+    return db.execute(
+        select(models.Report.name.label("report"), models.ReportPath.component)
+        .join(models.Report, models.Report.id == models.ReportPath.report_id)
+        .where(models.ReportPath.path_id == path_id)
+        .order_by(models.Report.name, models.ReportPath.component)
+    ).all()
+
+def report_states(db: Session) -> list:
+    """The name, revision and staleness of every report"""
+    return db.execute(select(models.Report.name, models.Report.revision, models.Report.stale)).all()
+
+def set_report_stale(db: Session, name: str, stale: bool):
+    db.execute(update(models.Report).where(models.Report.name == name).values(stale=stale))
     db.commit()
 
 def add_link_pattern(db: Session, pattern: str, link: str):
     db.execute(
-        insert(models.LinkPattern).values({
+        insert(db, models.LinkPattern).values({
             "pattern": pattern,
             "link": link,
             }).on_conflict_do_update(index_elements=['pattern'], set_={'link': link})
         )
     db.commit()
 
+def add_user_key(db: Session, user_id: int, name: str, public_key: bytes):
+    db.execute(
+        insert(db, models.UserKey).values({
+            "user_id": user_id,
+            "name": name,
+            "public_key": public_key,
+            }).on_conflict_do_update(index_elements=['user_id', 'name'], set_={'public_key': public_key})
+        )
+    db.commit()
+
 def get_user_with_token(db: Session, token_val: str):
-    token = db.query(models.Token).filter_by(value=token_val).one_or_none()
+    token = db.query(models.Token).filter_by(value=token_val, valid=True).one_or_none()
     if token is None:
         return None
     return token.user_id
+
+def create_job(db: Session, kind: str) -> int:
+    job = models.Job(kind=kind, status="pending")
+    db.add(job)
+    db.commit()
+    return job.id
+
+def get_job(db: Session, job_id: int):
+    return db.query(models.Job).filter_by(id=job_id).one_or_none()
+
+def update_job(db: Session, job_id: int, status: str, result=None, error=None):
+    job = db.query(models.Job).filter_by(id=job_id).one()
+    job.status = status
+    if status in ("done", "failed"):
+        job.finished_at = utcnow()
+    if result is not None:
+        job.result = json.dumps(result)
+    job.error = error
+    db.commit()
+
+def fail_interrupted_jobs(db: Session) -> int:
+    """Mark the jobs left pending or running by a previous run of the
+    server as failed, returning how many there were"""
+    count = db.execute(
+        update(models.Job)
+        .where(models.Job.status.in_(("pending", "running")))
+        .values(status="failed", finished_at=utcnow(), error="Interrupted by a server restart")
+    ).rowcount
+    db.commit()
+    return count
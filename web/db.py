@@ -16,11 +16,30 @@ connect_args = {}
 if "sqlite" in SQLALCHEMY_DATABASE_URL:
     connect_args["check_same_thread"] = False
 
+# The engine is created on first use rather than at import, and again in
+# any process forked after that, so every server worker gets a
+# connection pool of its own instead of sharing the parent's sockets.
+_engine = None
+_engine_pid = None
 
 
-engine = create_engine(
-    SQLALCHEMY_DATABASE_URL, connect_args=connect_args
-)
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+def get_engine():
+    """The engine of the current process"""
+    global _engine, _engine_pid
+    if _engine is None or _engine_pid != os.getpid():
+        _engine = create_engine(
+            SQLALCHEMY_DATABASE_URL, connect_args=connect_args
+        )
+        _engine_pid = os.getpid()
+    return _engine
+
+
+_sessionmaker = sessionmaker(autocommit=False, autoflush=False)
+
+
+def SessionLocal():
+    """Open a session on the current process's engine"""
+    return _sessionmaker(bind=get_engine())
+
 
 Base = declarative_base()
@@ -0,0 +1,58 @@
+"""
+In-process publish/subscribe of attestation events
+Subscribers register the output paths they are interested in, and are
+notified only when attestations for one of those paths come in.
+"""
+import asyncio
+import threading
+from collections import defaultdict
+
+
+class Subscription:
+    def __init__(self, paths, loop: asyncio.AbstractEventLoop):
+        self.paths = set(paths)
+        self.loop = loop
+        # Receives sets of output paths that got new attestations
+        self.queue: asyncio.Queue = asyncio.Queue()
+
+
+_lock = threading.Lock()
+_subscribers: dict[str, set[Subscription]] = defaultdict(set)
+
+
+def subscribe(paths) -> Subscription:
+    """Subscribe to a set of output paths, from within the event loop"""
+    subscription = Subscription(paths, asyncio.get_running_loop())
+    with _lock:
+        for path in subscription.paths:
+            _subscribers[path].add(subscription)
+    return subscription
+
+
+def unsubscribe(subscription: Subscription):
+    with _lock:
+        for path in subscription.paths:
+            subscribers = _subscribers.get(path)
+            if subscribers is None:
+                continue
+            subscribers.discard(subscription)
+            if not subscribers:
+                del _subscribers[path]
+
+
+def publish(paths):
+    """Notify the subscribers of the given output paths
+
+    Safe to call from any thread, ingest runs in the threadpool.
+    """
+    changed = defaultdict(set)
+    with _lock:
+        for path in paths:
+            for subscription in _subscribers.get(path, ()):
+                changed[subscription].add(path)
+    for subscription, subscription_paths in changed.items():
+        try:
+            subscription.loop.call_soon_threadsafe(subscription.queue.put_nowait, subscription_paths)
+        except RuntimeError:
+            # The subscriber's event loop is gone
+            unsubscribe(subscription)
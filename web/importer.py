@@ -0,0 +1,142 @@
+"""
+Bulk narinfo importer
+Records a directory of .narinfo files, such as a local mirror of a binary
+cache's metadata, as attestations of a user
+
+Usage: python -m web.importer <user name> <directory> [--jobs N] [--batch-size N]
+"""
+import argparse
+import collections
+import os
+import sys
+import time
+from concurrent.futures import Executor, ProcessPoolExecutor
+
+from sqlalchemy.orm import Session
+
+from . import crud, models, nix, verification
+from .db import SessionLocal
+
+# Files handed to a worker process at a time
+CHUNK_SIZE = 1000
+# Attestations inserted per transaction
+BATCH_SIZE = 20000
+
+
+def narinfo_files(directory: str):
+    """Yield the paths of the .narinfo files under directory"""
+    for entry in os.scandir(directory):
+        if entry.is_dir():
+            yield from narinfo_files(entry.path)
+        elif entry.name.endswith(".narinfo"):
+            yield entry.path
+
+
+def chunks(iterable, size: int):
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def parse_files(paths: list[str]) -> list[tuple]:
+    """Parse narinfo files into (record, fingerprint) pairs, with records
+    as crud.create_attestations takes them, or None for files that can't
+    be read or don't describe an attestation
+
+    Runs in the worker processes.
+    """
+    results = []
+    for path in paths:
+        try:
+            with open(path, encoding="utf-8") as f:
+                fields = nix.parse_narinfo(f.read())
+        except (OSError, UnicodeDecodeError):
+            results.append(None)
+            continue
+        store_path = fields.get("StorePath")
+        nar_hash = fields.get("NarHash")
+        deriver = fields.get("Deriver")
+        # Attestations are filed under a derivation, which narinfos of
+        # some paths (such as sources) don't name
+        if not store_path or not nar_hash or not deriver or deriver == "unknown-deriver":
+            results.append(None)
+            continue
+        nar_size = int(fields["NarSize"]) if fields.get("NarSize", "").isdigit() else None
+        references = [nix.STORE_DIR + ref for ref in fields["References"].split()] if "References" in fields else None
+        fingerprint = None
+        if nar_size is not None and references is not None:
+            fingerprint = nix.fingerprint(store_path, nar_hash, nar_size, references)
+        record = (deriver.removesuffix(".drv"), store_path, nar_hash, fields.get("Sig", ""), nar_size, None, references)
+        results.append((record, fingerprint))
+    return results
+
+
+def store(db: Session, user_id: int, parsed: list[tuple]):
+    rows = crud.create_attestations(db, [record for record, _ in parsed], user_id)
+    if verification.Ed25519PublicKey is not None:
+        verification.verify_batch(db, verification.signed(rows, [fingerprint for _, fingerprint in parsed]))
+
+
+def import_narinfos(db: Session, user_id: int, directory: str, executor: Executor, batch_size: int = BATCH_SIZE, jobs: int = 1) -> tuple[int, int]:
+    """Record the narinfo files under directory as attestations of
+    user_id, returning how many were imported and skipped
+
+    Files are parsed on executor while the previous batch is inserted,
+    with at most two chunks per job in flight.
+    """
+    imported = skipped = 0
+    batch = []
+    in_flight = collections.deque()
+
+    def collect():
+        nonlocal imported, skipped, batch
+        for result in in_flight.popleft().result():
+            if result is None:
+                skipped += 1
+            else:
+                batch.append(result)
+        if len(batch) >= batch_size:
+            store(db, user_id, batch)
+            imported += len(batch)
+            batch = []
+
+    for chunk in chunks(narinfo_files(directory), CHUNK_SIZE):
+        in_flight.append(executor.submit(parse_files, chunk))
+        if len(in_flight) >= 2 * jobs:
+            collect()
+    while in_flight:
+        collect()
+    if batch:
+        store(db, user_id, batch)
+        imported += len(batch)
+    return imported, skipped
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("user", help="name of the user to file the attestations under")
+    parser.add_argument("directory", help="directory containing .narinfo files")
+    parser.add_argument("--jobs", type=int, default=os.cpu_count(), help="parser processes")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE, help="attestations per transaction")
+    args = parser.parse_args(argv)
+
+    db = SessionLocal()
+    try:
+        user = crud.local_user(db, args.user)
+        if user is None:
+            sys.exit(f"User {args.user} not found")
+        start = time.monotonic()
+        with ProcessPoolExecutor(max_workers=args.jobs) as executor:
+            imported, skipped = import_narinfos(db, user.id, args.directory, executor, args.batch_size, args.jobs)
+        print(f"Imported {imported} narinfos, skipped {skipped}, in {time.monotonic() - start:.1f}s")
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
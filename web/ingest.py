@@ -0,0 +1,134 @@
+"""
+Group commit of attestations
+When enabled, attestations of concurrent requests are queued and written
+by a single writer thread in shared transactions, so a burst of
+submissions costs a handful of commits instead of one each
+"""
+import asyncio
+import os
+import queue
+import threading
+import time
+import traceback
+from concurrent.futures import Future
+
+from . import crud, events, schemas
+
+ENABLED = os.environ.get("LILA_GROUP_COMMIT", "") not in ("", "0")
+# A group is committed once its oldest submission waited this long, or
+# once it holds this many attestations, whichever comes first. Groups
+# mostly form while the previous one is being committed, so the wait
+# only needs to be short.
+MAX_DELAY = float(os.environ.get("LILA_GROUP_COMMIT_MS", "2")) / 1000
+MAX_ROWS = int(os.environ.get("LILA_GROUP_COMMIT_ROWS", "2000"))
+# Submissions waiting for the writer before new ones are turned away
+QUEUE_SIZE = int(os.environ.get("LILA_INGEST_QUEUE", "1000"))
+
+
+class QueueFull(Exception):
+    """The writer is behind; the submission should be retried later"""
+
+
+class GroupCommitter:
+    """Writer thread committing queued submissions in groups"""
+
+    def __init__(self, session_factory, max_delay: float = MAX_DELAY, max_rows: int = MAX_ROWS, queue_size: int = QUEUE_SIZE):
+        self.session_factory = session_factory
+        self.max_delay = max_delay
+        self.max_rows = max_rows
+        self.queue = queue.Queue(queue_size)
+        self.thread = threading.Thread(target=self._run, name="lila-group-commit", daemon=True)
+        self.thread.start()
+
+    def submit(self, records: list[tuple], user_id: int) -> Future:
+        """Queue records, as crud.create_attestations takes them, for the
+        next group commit. The future resolves to their rows once they
+        are committed.
+
+        Raises QueueFull rather than waiting when the queue is full.
+        """
+        future = Future()
+        try:
+            self.queue.put_nowait((records, user_id, future))
+        except queue.Full:
+            raise QueueFull() from None
+        return future
+
+    def stop(self):
+        """Commit what is queued and stop the writer"""
+        self.queue.put(None)
+        self.thread.join()
+
+    def _run(self):
+        stopping = False
+        while not stopping:
+            group = []
+            n_rows = 0
+            deadline = None
+            while n_rows < self.max_rows:
+                timeout = None if deadline is None else max(0, deadline - time.monotonic())
+                try:
+                    item = self.queue.get(timeout=timeout)
+                except queue.Empty:
+                    break
+                if item is None:
+                    stopping = True
+                    break
+                # Dropped if the request went away before we got to it,
+                # past this point it can no longer be cancelled
+                if not item[2].set_running_or_notify_cancel():
+                    continue
+                if deadline is None:
+                    deadline = time.monotonic() + self.max_delay
+                group.append(item)
+                n_rows += len(item[0])
+            if group:
+                self._commit(group)
+
+    def _commit(self, group: list[tuple]):
+        db = self.session_factory()
+        try:
+            # One insert per user, split back into the submissions' rows
+            by_user = {}
+            for records, user_id, _ in group:
+                by_user.setdefault(user_id, []).extend(records)
+            rows = {
+                user_id: iter(crud.create_attestations(db, records, user_id, commit=False))
+                for user_id, records in by_user.items()
+            }
+            db.commit()
+        except Exception as e:
+            db.rollback()
+            db.close()
+            if len(group) == 1:
+                traceback.print_exc()
+                group[0][2].set_exception(e)
+            else:
+                # Don't let one bad submission fail the others
+                for item in group:
+                    self._commit([item])
+            return
+        db.close()
+        for records, user_id, future in group:
+            future.set_result([next(rows[user_id]) for _ in records])
+        events.publish([path for records, _, _ in group for _, path, *_ in records])
+
+
+_committer = None
+_lock = threading.Lock()
+
+
+def committer(session_factory) -> GroupCommitter:
+    """The group committer of this process, started on first use"""
+    global _committer
+    with _lock:
+        if _committer is None:
+            _committer = GroupCommitter(session_factory)
+        return _committer
+
+
+async def create_attestation(session_factory, drv_hash: str, output_hash_map: list[schemas.OutputHashPair], user_id) -> list[dict]:
+    """Like crud.create_attestation, returning once the group holding
+    the attestations is committed"""
+    records = crud.attestation_records(drv_hash, output_hash_map)
+    return await asyncio.wrap_future(committer(session_factory).submit(records, user_id))
@@ -1,14 +1,42 @@
 import datetime
 import random
 import string
-from typing import List
+from typing import List, Optional
 
-from sqlalchemy import (Column, DateTime, ForeignKey, Integer, Table,
-                        UniqueConstraint, func)
+from sqlalchemy import (BigInteger, Column, DateTime, ForeignKey, Index, Integer,
+                        LargeBinary, Table, UniqueConstraint, false, func)
+from sqlalchemy.ext.associationproxy import association_proxy
 from sqlalchemy.orm import Mapped, column_property, mapped_column, relationship
+from sqlalchemy.types import TypeDecorator
 
+from . import nix
 from .db import Base
 
+
+class Digest(TypeDecorator):
+    """Store path digest, stored as its 20 bytes"""
+    impl = LargeBinary
+    cache_ok = True
+
+    def process_bind_param(self, value, dialect):
+        return None if value is None else nix.digest_to_bytes(value)
+
+    def process_result_value(self, value, dialect):
+        return None if value is None else nix.digest_from_bytes(value)
+
+
+class NarHash(TypeDecorator):
+    """NAR hash, stored as its 32 bytes plus a byte for the notation"""
+    impl = LargeBinary
+    cache_ok = True
+
+    def process_bind_param(self, value, dialect):
+        return None if value is None else nix.hash_to_bytes(value)
+
+    def process_result_value(self, value, dialect):
+        return None if value is None else nix.hash_from_bytes(value)
+
+
 class Derivation(Base):
     __tablename__ = "derivations"
     
@@ -23,10 +51,14 @@ class User(Base):
 
     id: Mapped[int] = mapped_column(primary_key=True)
     name: Mapped[str] = mapped_column()
+    # For the stand-ins of users of another instance, the name the
+    # replicator knows that instance by. None for local users.
+    peer: Mapped[Optional[str]] = mapped_column()
     tokens: Mapped[List["Token"]] = relationship(back_populates="user")
 
-    def __init__(self, name):
+    def __init__(self, name, peer=None):
         self.name = name
+        self.peer = peer
         self.tokens = []
 
     @classmethod
@@ -63,21 +95,144 @@ class Token(Base):
         return obj
 
 
+class StorePath(Base):
+    __tablename__ = "store_paths"
+
+    id: Mapped[int] = mapped_column(primary_key=True)
+    digest: Mapped[str] = mapped_column(Digest)
+    name: Mapped[str] = mapped_column()
+
+    __table_args__ = (
+        Index("uq_store_paths_digest_name", "digest", "name", unique=True),
+    )
+
+    @property
+    def path(self) -> str:
+        return nix.store_path(self.digest, self.name)
+
+
 class Attestation(Base):
     __tablename__ = "attestations"
 
     id: Mapped[int] = mapped_column(primary_key=True)
     # identification
-    output_digest: Mapped[str] = mapped_column()
-    output_name: Mapped[str] = mapped_column()
-    output_path = column_property("/nix/store/" + output_digest + "-" + output_name)
+    path_id: Mapped[int] = mapped_column(ForeignKey("store_paths.id"))
+    path: Mapped["StorePath"] = relationship(lazy="joined")
+    output_digest = association_proxy("path", "digest", creator=lambda digest: StorePath(digest=digest))
+    output_name = association_proxy("path", "name", creator=lambda name: StorePath(name=name))
     # metadata
     user_id: Mapped[int] = mapped_column(ForeignKey("users.id"))
     drv_id: Mapped[str] = mapped_column(ForeignKey("derivations.id"))
     derivation: Mapped["Derivation"] = relationship(back_populates="attestations")
     # data
-    output_hash: Mapped[str] = mapped_column()
-    output_sig: Mapped[str] = mapped_column()
+    output_hash: Mapped[str] = mapped_column(NarHash)
+    # The signature is split into the interned name of the key and the raw
+    # signature. Signatures not in <key name>:<base64> form are kept as
+    # text in sig, without a key.
+    sig_key_id: Mapped[Optional[int]] = mapped_column(ForeignKey("signing_keys.id"))
+    sig_key: Mapped[Optional["SigningKey"]] = relationship(lazy="selectin")
+    sig: Mapped[bytes] = mapped_column()
+    # Whether sig is a valid signature by one of the user's registered
+    # keys. None while unchecked, or when it can't be checked.
+    sig_verified: Mapped[Optional[bool]] = mapped_column()
+    # What the build cost, when the submitter reported it: the size of the
+    # output's NAR in bytes and the seconds the build took
+    nar_size: Mapped[Optional[int]] = mapped_column(BigInteger)
+    build_duration: Mapped[Optional[float]] = mapped_column()
+    # Set by crud.create_attestations, None for attestations recorded
+    # before this was tracked
+    created_at: Mapped[Optional[datetime.datetime]] = mapped_column()
+
+    @property
+    def output_path(self) -> str:
+        return self.path.path
+
+    @output_path.setter
+    def output_path(self, path: str):
+        digest, name = nix.split_store_path(path)
+        self.path = StorePath(digest=digest, name=name)
+
+    @property
+    def output_sig(self) -> str:
+        return nix.join_signature(self.sig_key.name if self.sig_key else None, self.sig)
+
+    @output_sig.setter
+    def output_sig(self, text: str):
+        # Key names are only interned on ingest, see crud.create_attestation
+        self.sig_key = None
+        self.sig = text.encode()
+
+    # Re-submitting the same result (e.g. when a post-build hook retries)
+    # must not count as another build
+    __table_args__ = (
+        # path_id first, so this also serves lookups by path
+        Index("uq_attestations_identity", "path_id", "user_id", "drv_id", "output_hash", unique=True),
+        # Covers the costs of paths crud.path_costs looks up
+        Index("ix_attestations_cost", "path_id", "build_duration", "nar_size"),
+    )
+
+class StorePathReference(Base):
+    """Store path another one refers to at runtime, as submitted along
+    with the attestations of the referrer"""
+    __tablename__ = "store_path_references"
+    path_id: Mapped[int] = mapped_column(ForeignKey("store_paths.id"), primary_key=True)
+    reference_id: Mapped[int] = mapped_column(ForeignKey("store_paths.id"), primary_key=True)
+
+    __table_args__ = (
+        # Whether anything still refers to a path
+        Index("ix_store_path_references_reference", "reference_id", "path_id"),
+        # Rows are stored in the primary key, which closure queries walk,
+        # rather than once more in a table of their own
+        {"sqlite_with_rowid": False},
+    )
+
+class NondeterministicPath(Base):
+    """Output path attested with more than one distinct hash, maintained
+    on ingest by crud.create_attestations"""
+    __tablename__ = "nondeterministic_paths"
+    path_id: Mapped[int] = mapped_column(ForeignKey("store_paths.id"), primary_key=True)
+    # When the second distinct hash came in
+    first_seen: Mapped[datetime.datetime] = mapped_column(server_default=func.now())
+    distinct_hashes: Mapped[int] = mapped_column()
+
+    __table_args__ = (
+        Index("ix_nondeterministic_paths_first_seen", "first_seen", "path_id"),
+    )
+
+class NondeterministicPathUser(Base):
+    """User who attested a nondeterministic path"""
+    __tablename__ = "nondeterministic_path_users"
+    path_id: Mapped[int] = mapped_column(ForeignKey("nondeterministic_paths.path_id"), primary_key=True)
+    user_id: Mapped[int] = mapped_column(ForeignKey("users.id"), primary_key=True)
+
+class UserAgreement(Base):
+    """How often two users got the same hash for a path, maintained on
+    ingest by crud.create_attestations"""
+    __tablename__ = "user_agreement"
+    # user_a < user_b
+    user_a: Mapped[int] = mapped_column(ForeignKey("users.id"), primary_key=True)
+    user_b: Mapped[int] = mapped_column(ForeignKey("users.id"), primary_key=True)
+    # Pairs of attestations of the same path, one by each user, with the
+    # same and with different hashes
+    agree_count: Mapped[int] = mapped_column()
+    disagree_count: Mapped[int] = mapped_column()
+
+class UserKey(Base):
+    """Public key a user signs their attestations with"""
+    __tablename__ = "user_keys"
+    id: Mapped[int] = mapped_column(primary_key=True)
+    user_id: Mapped[int] = mapped_column(ForeignKey("users.id"))
+    name: Mapped[str] = mapped_column()
+    public_key: Mapped[bytes] = mapped_column()
+
+    __table_args__ = (
+        UniqueConstraint("user_id", "name"),
+    )
+
+class SigningKey(Base):
+    __tablename__ = "signing_keys"
+    id: Mapped[int] = mapped_column(primary_key=True)
+    name: Mapped[str] = mapped_column(unique=True)
 
 class Report(Base):
     __tablename__ = "reports"
@@ -87,8 +242,53 @@ class Report(Base):
     # later we might want to normalize it into its own database
     # structure.
     definition: Mapped[str] = mapped_column()
+    # Incremented whenever the definition is replaced
+    revision: Mapped[int] = mapped_column(server_default="1")
+    # Set on ingest when one of its paths gets attestations, and cleared
+    # by the publisher when it publishes the report again
+    stale: Mapped[bool] = mapped_column(server_default=false())
+    # Incremented along with setting stale, so caches of the statuses of
+    # its paths can tell they changed
+    status_version: Mapped[int] = mapped_column(server_default="0")
+
+    __table_args__ = (
+        Index("uq_reports_name", "name", unique=True),
+    )
+
+class ReportPath(Base):
+    """Output path of a report, maintained by crud.define_report"""
+    __tablename__ = "report_paths"
+    path_id: Mapped[int] = mapped_column(ForeignKey("store_paths.id"), primary_key=True)
+    report_id: Mapped[int] = mapped_column(ForeignKey("reports.id"), primary_key=True)
+    # bom-ref of the component with the path
+    component: Mapped[str] = mapped_column(primary_key=True)
+
+    __table_args__ = (
+        Index("ix_report_paths_report", "report_id"),
+        # Looked up by path, so store the rows in the primary key
+        {"sqlite_with_rowid": False},
+    )
 
 class LinkPattern(Base):
     __tablename__ = "link_patterns"
     pattern: Mapped[str] = mapped_column(primary_key=True)
     link: Mapped[str] = mapped_column()
+
+class Job(Base):
+    __tablename__ = "jobs"
+    id: Mapped[int] = mapped_column(primary_key=True)
+    kind: Mapped[str] = mapped_column()
+    # One of "pending", "running", "done" or "failed"
+    status: Mapped[str] = mapped_column()
+    created_at: Mapped[datetime.datetime] = mapped_column(server_default=func.now())
+    finished_at: Mapped[Optional[datetime.datetime]] = mapped_column()
+    # JSON-encoded return value of the job, if any
+    result: Mapped[Optional[str]] = mapped_column()
+    error: Mapped[Optional[str]] = mapped_column()
+
+class ReplicationCheckpoint(Base):
+    """How far the replicator got in the change feed of a peer instance"""
+    __tablename__ = "replication_checkpoints"
+    peer: Mapped[str] = mapped_column(primary_key=True)
+    # Id of the last attestation ingested from the peer's feed
+    last_id: Mapped[int] = mapped_column()
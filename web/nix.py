@@ -0,0 +1,185 @@
+"""
+Helpers for Nix data formats
+Provides: nix-base32, store path, NAR hash, signature and key (de)serialization,
+narinfo parsing
+"""
+import base64
+import binascii
+import re
+import typing as t
+
+STORE_DIR = "/nix/store/"
+
+# Nix's base32 alphabet omits e, o, u and t
+BASE32_ALPHABET = "0123456789abcdfghijklmnpqrsvwxyz"
+
+# Store path digests are 160 bits, SHA-256 NAR hashes 256 bits
+DIGEST_SIZE = 20
+SHA256_SIZE = 32
+ED25519_SIGNATURE_SIZE = 64
+ED25519_PUBLIC_KEY_SIZE = 32
+
+
+def base32_len(size: int) -> int:
+    return (size * 8 - 1) // 5 + 1
+
+
+# Nix base32 is a little-endian number written most significant digit
+# first. Mapping its alphabet onto the digits int() accepts for base 32
+# lets decoding happen in C.
+_TO_INT_DIGITS = str.maketrans(BASE32_ALPHABET, "0123456789abcdefghijklmnopqrstuv")
+_BASE32_RE = re.compile(f"[{BASE32_ALPHABET}]*")
+
+
+# Encoding writes two digits at a time, from a table of all pairs
+_DIGIT_PAIRS = [a + b for a in BASE32_ALPHABET for b in BASE32_ALPHABET]
+
+
+def base32_encode(data: bytes) -> str:
+    """Encode bytes the way Nix does"""
+    length = base32_len(len(data))
+    n = int.from_bytes(data, "little")
+    # An odd number of digits gets a leading zero, dropped at the end
+    odd = length & 1
+    top = (length + odd) * 5 - 10
+    return "".join([_DIGIT_PAIRS[(n >> shift) & 0x3ff] for shift in range(top, -10, -10)])[odd:]
+
+
+def base32_decode(s: str, size: int) -> t.Optional[bytes]:
+    """Decode a nix-base32 string of size bytes, None if it isn't one"""
+    if len(s) != base32_len(size) or not _BASE32_RE.fullmatch(s):
+        return None
+    n = int(s.translate(_TO_INT_DIGITS), 32)
+    if n >> (size * 8):
+        return None
+    return n.to_bytes(size, "little")
+
+
+def split_store_path(path: str) -> tuple[str, str]:
+    """Split /nix/store/<digest>-<name> into digest and name"""
+    if path.startswith(STORE_DIR):
+        path = path[len(STORE_DIR):]
+    digest, _, name = path.partition("-")
+    return digest, name
+
+
+def store_path(digest: str, name: str) -> str:
+    return f"{STORE_DIR}{digest}-{name}"
+
+
+# Binary forms of values we store for every attestation. Values in the
+# canonical Nix format are stored compactly, anything else (such as test
+# data or hashes from future Nix versions) is kept verbatim behind a 0xff
+# marker, a byte that never occurs in UTF-8 text.
+_VERBATIM = b"\xff"
+
+
+def _verbatim(text: str) -> bytes:
+    return _VERBATIM + text.encode()
+
+
+def digest_to_bytes(digest: str) -> bytes:
+    data = base32_decode(digest, DIGEST_SIZE)
+    if data is not None:
+        return data
+    data = _verbatim(digest)
+    if len(data) == DIGEST_SIZE:
+        # Would be mistaken for a decoded digest
+        data = _VERBATIM + data
+    return data
+
+
+def digest_from_bytes(data: bytes) -> str:
+    if len(data) == DIGEST_SIZE:
+        return base32_encode(data)
+    return data.lstrip(_VERBATIM).decode()
+
+
+# First byte of a stored NAR hash: how the SHA-256 was written
+_HASH_NIX32 = 1   # sha256:<nix-base32>, as in narinfo files
+_HASH_HEX = 2     # sha256:<hex>
+_HASH_SRI = 3     # sha256-<base64>
+
+
+def hash_to_bytes(text: str) -> bytes:
+    if text.startswith("sha256:"):
+        value = text[len("sha256:"):]
+        data = base32_decode(value, SHA256_SIZE)
+        if data is not None:
+            return bytes([_HASH_NIX32]) + data
+        if len(value) == 2 * SHA256_SIZE:
+            try:
+                data = bytes.fromhex(value)
+            except ValueError:
+                data = None
+            if data is not None and data.hex() == value:
+                return bytes([_HASH_HEX]) + data
+    elif text.startswith("sha256-"):
+        try:
+            data = base64.b64decode(text[len("sha256-"):], validate=True)
+        except binascii.Error:
+            data = None
+        if data is not None and len(data) == SHA256_SIZE and "sha256-" + base64.b64encode(data).decode() == text:
+            return bytes([_HASH_SRI]) + data
+    return _verbatim(text)
+
+
+def hash_from_bytes(data: bytes) -> str:
+    kind, value = data[0], data[1:]
+    if kind == _HASH_NIX32:
+        return "sha256:" + base32_encode(value)
+    if kind == _HASH_HEX:
+        return "sha256:" + value.hex()
+    if kind == _HASH_SRI:
+        return "sha256-" + base64.b64encode(value).decode()
+    return data.lstrip(_VERBATIM).decode()
+
+
+def split_signature(text: str) -> tuple[t.Optional[str], bytes]:
+    """Split a <key name>:<base64> signature into the key name and the
+    raw signature, or return no key name and the verbatim text"""
+    key_name, sep, value = text.partition(":")
+    if sep and key_name:
+        try:
+            data = base64.b64decode(value, validate=True)
+        except binascii.Error:
+            data = None
+        if data is not None and len(data) == ED25519_SIGNATURE_SIZE and base64.b64encode(data).decode() == value:
+            return key_name, data
+    return None, text.encode()
+
+
+def join_signature(key_name: t.Optional[str], data: bytes) -> str:
+    if key_name is None:
+        return data.decode()
+    return f"{key_name}:{base64.b64encode(data).decode()}"
+
+
+def split_public_key(text: str) -> t.Optional[tuple[str, bytes]]:
+    """Split a <key name>:<base64> public key, None if it isn't one"""
+    key_name, sep, value = text.strip().partition(":")
+    if not sep or not key_name:
+        return None
+    try:
+        data = base64.b64decode(value, validate=True)
+    except binascii.Error:
+        return None
+    if len(data) != ED25519_PUBLIC_KEY_SIZE:
+        return None
+    return key_name, data
+
+
+def fingerprint(path: str, nar_hash: str, nar_size: int, references: list[str]) -> str:
+    """What Nix signs for a store path, see ValidPathInfo::fingerprint"""
+    return f"1;{path};{nar_hash};{nar_size};{','.join(sorted(references))}"
+
+
+def parse_narinfo(text: str) -> dict[str, str]:
+    """Fields of a .narinfo file. Of repeated fields, such as Sig, the
+    first one is kept."""
+    fields = {}
+    for line in text.splitlines():
+        key, sep, value = line.partition(":")
+        if sep:
+            fields.setdefault(key, value.strip())
+    return fields
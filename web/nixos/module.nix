@@ -161,6 +161,8 @@ in
       path = [ cfg.pythonEnv ];
       script = "uvicorn lila:app --host 127.0.0.1 --port ${builtins.toString cfg.port}";
       serviceConfig = {
+        # Background jobs of the previous run were lost with it
+        ExecStartPre = "${cfg.pythonEnv}/bin/python -m lila.worker --fail-interrupted";
         User = "lila";
         Restart = "on-failure";
       };
@@ -0,0 +1,217 @@
+"""
+Request profiling
+A sampling profiler that runs while profiled requests are in flight. An
+admin can profile a request on demand, and a small fraction of requests
+can be profiled continuously into a ring buffer. Profiles are collapsed
+stacks as flamegraph.pl takes them, which speedscope also reads.
+"""
+import collections
+import itertools
+import os
+import pathlib
+import random
+import sys
+import threading
+import time
+from urllib.parse import parse_qs
+
+from .common import is_admin
+
+# Fraction of requests profiled continuously
+SAMPLE_RATE = float(os.environ.get("LILA_PROFILE_SAMPLE_RATE", "0"))
+# Seconds between stack samples
+INTERVAL = float(os.environ.get("LILA_PROFILE_INTERVAL_MS", "2")) / 1000
+# Number of profiles kept
+BUFFER_SIZE = int(os.environ.get("LILA_PROFILE_BUFFER", "100"))
+# Long-running responses (event streams, exports) are only profiled for
+# their first seconds
+MAX_DURATION = 30
+
+# Innermost frames of threads waiting for work rather than doing any
+IDLE = {
+    ("threading.py", "wait"),
+    ("threading.py", "_wait_for_tstate_lock"),
+    ("queue.py", "get"),
+    ("selectors.py", "select"),
+}
+
+_ids = itertools.count(1)
+
+
+class Profile:
+    """Stack samples taken while a request was handled
+
+    Samples are of all busy threads of the process, so concurrent
+    requests show up in each other's profiles.
+    """
+
+    def __init__(self, method: str, path: str):
+        self.id = next(_ids)
+        self.method = method
+        self.path = path
+        self.started = time.time()
+        self.deadline = time.monotonic() + MAX_DURATION
+        self.duration = None
+        self.status = None
+        self.stacks = collections.Counter()
+
+    def collapsed(self, prefix: tuple = ()) -> str:
+        """The samples as collapsed stacks, one '<frame>;<frame>... <count>'
+        line per distinct stack"""
+        return "".join(
+            ";".join(prefix + stack) + f" {n}\n"
+            for stack, n in self.stacks.most_common()
+        )
+
+    def summary(self) -> dict:
+        return {
+            "id": self.id,
+            "method": self.method,
+            "path": self.path,
+            "status": self.status,
+            "started": self.started,
+            "duration": self.duration,
+            "samples": sum(self.stacks.values()),
+        }
+
+
+class Sampler:
+    """Thread sampling the stacks of all threads while any profile is
+    being recorded"""
+
+    def __init__(self):
+        self.profiles = set()
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.thread = None
+        self.labels = {}
+
+    def start(self, profile: Profile):
+        with self.lock:
+            self.profiles.add(profile)
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._run, name="lila-profiler", daemon=True)
+                self.thread.start()
+            self.wakeup.set()
+
+    def stop(self, profile: Profile):
+        with self.lock:
+            self.profiles.discard(profile)
+
+    def label(self, code) -> str:
+        label = self.labels.get(code)
+        if label is None:
+            # Files by their path within a library or this package
+            parts = pathlib.PurePath(code.co_filename).parts
+            if "site-packages" in parts:
+                parts = parts[parts.index("site-packages") + 1:]
+            elif "web" in parts:
+                parts = parts[parts.index("web"):]
+            else:
+                parts = parts[-1:]
+            label = f"{'/'.join(parts)}:{code.co_qualname}".replace(";", ":").replace(" ", "_")
+            self.labels[code] = label
+        return label
+
+    def sample(self) -> list[tuple]:
+        """The stacks of the busy threads, outermost frame first, under the
+        name of their thread"""
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        me = threading.get_ident()
+        stacks = []
+        for ident, frame in sys._current_frames().items():
+            code = frame.f_code
+            if ident == me or (pathlib.PurePath(code.co_filename).name, code.co_name) in IDLE:
+                continue
+            stack = []
+            while frame is not None:
+                stack.append(self.label(frame.f_code))
+                frame = frame.f_back
+            # Threads of a pool share a name up to their number
+            stack.append(names.get(ident, "thread").rstrip("0123456789_- "))
+            stacks.append(tuple(reversed(stack)))
+        return stacks
+
+    def _run(self):
+        while True:
+            self.wakeup.wait()
+            with self.lock:
+                profiles = list(self.profiles)
+                if not profiles:
+                    self.wakeup.clear()
+                    continue
+            stacks = self.sample()
+            now = time.monotonic()
+            # Under the lock, so stopped profiles no longer change
+            with self.lock:
+                for profile in self.profiles:
+                    if now < profile.deadline:
+                        profile.stacks.update(stacks)
+            time.sleep(INTERVAL)
+
+
+sampler = Sampler()
+# The most recent profiles, on demand and continuous
+profiles: collections.deque[Profile] = collections.deque(maxlen=BUFFER_SIZE)
+
+
+def requested(scope) -> bool | None:
+    """Whether a request asks to be profiled, by ?profile=1 with the admin
+    token as bearer token or by an X-Lila-Profile header holding it. True
+    if it may be, False if it lacks the admin token, None if it doesn't ask."""
+    headers = dict(scope["headers"])
+    token = headers.get(b"x-lila-profile")
+    if token is None:
+        if b"profile=" not in scope["query_string"] or parse_qs(scope["query_string"]).get(b"profile") != [b"1"]:
+            return None
+        authorization = headers.get(b"authorization", b"")
+        token = authorization[7:] if authorization[:7].lower() == b"bearer " else b""
+    return is_admin(token.decode("latin-1"))
+
+
+class ProfilerMiddleware:
+    """Profiles requests asking for it, answering with the profile instead
+    of the response, and SAMPLE_RATE of all others"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        on_demand = requested(scope)
+        if on_demand is None and not (SAMPLE_RATE and random.random() < SAMPLE_RATE):
+            return await self.app(scope, receive, send)
+        if on_demand is False:
+            return await respond(send, 403, b"Profiling needs the admin token", [])
+
+        profile = Profile(scope["method"], scope["path"])
+
+        async def record_status(message):
+            if message["type"] == "http.response.start":
+                profile.status = message["status"]
+            if not on_demand:
+                await send(message)
+
+        start = time.perf_counter()
+        sampler.start(profile)
+        try:
+            await self.app(scope, receive, record_status)
+        finally:
+            sampler.stop(profile)
+            profile.duration = time.perf_counter() - start
+            profiles.append(profile)
+        if on_demand:
+            await respond(send, 200, profile.collapsed().encode(), [
+                (b"x-lila-profile-id", str(profile.id).encode()),
+                (b"x-lila-profiled-status", str(profile.status).encode()),
+            ])
+
+
+async def respond(send, status: int, body: bytes, headers: list):
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [(b"content-type", b"text/plain; charset=utf-8"), (b"content-length", str(len(body)).encode())] + headers,
+    })
+    await send({"type": "http.response.body", "body": body})
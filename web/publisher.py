@@ -0,0 +1,234 @@
+"""
+Static report publishing
+Renders the HTML, text and CycloneDX views of reports into a directory,
+along with gzip-compressed variants, so they can be served as static
+files without touching the database. A background thread publishes them
+again once they are redefined or ingest marks them stale.
+
+Usage: python -m web.publisher [report name ...] [--directory DIR]
+"""
+import argparse
+import fcntl
+import gzip
+import json
+import mimetypes
+import os
+import pathlib
+import sys
+import threading
+import traceback
+from urllib.parse import quote
+
+from fastapi.staticfiles import StaticFiles
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+from starlette.datastructures import Headers
+from starlette.responses import FileResponse
+from starlette.staticfiles import NotModifiedResponse
+
+from . import crud, models
+from .common import templates
+from .db import SessionLocal
+from .report_graph import report_graph
+from .views.reports import htmlview, printtree, report_out_paths
+
+# Where reports are published, under reports/. Unset to not publish.
+DIRECTORY = os.environ.get("LILA_PUBLISH_DIR")
+# Seconds between checks for reports to publish again, which also
+# batches the changes of a burst of attestations into one
+DELAY = float(os.environ.get("LILA_PUBLISH_DELAY", "10"))
+
+# Held by the one publisher of a directory
+LOCK_FILE = ".publisher.lock"
+
+# Published files of a report, by suffix of its name
+SUFFIXES = [".html", ".txt", ".cdx.json"]
+
+
+def report_files(directory, name: str) -> list[pathlib.Path]:
+    return [pathlib.Path(directory) / "reports" / (name + suffix) for suffix in SUFFIXES]
+
+
+def render(db: Session, name: str) -> tuple[int, list[bytes]] | None:
+    """The revision and the contents of the published files of a report,
+    or None if there is no such report"""
+    revision = crud.report_revision(db, name)
+    graph = report_graph(db, name, report_out_paths)
+    if graph is None:
+        return None
+    results = crud.path_summaries(db, graph.paths())
+    status = graph.statuses(results)
+    context = htmlview(graph, results, crud.link_patterns(db))
+    context["report_url"] = f"/reports/{quote(name)}"
+    contents = [
+        templates.get_template("report.html").render(context),
+        printtree(graph, status, graph.rollups(status)),
+        json.dumps(crud.report(db, name)),
+    ]
+    return revision, [content.encode() for content in contents]
+
+
+def write_atomically(path: pathlib.Path, content: bytes):
+    """Replace path with content, so readers see either the old or the new file"""
+    partial = path.with_name(f".{path.name}.{os.getpid()}.{threading.get_ident()}")
+    partial.write_bytes(content)
+    os.replace(partial, path)
+
+
+def publish(db: Session, name: str, directory) -> int | None:
+    """Publish a report into directory, returning the revision it was
+    published with, or None if there is no such report"""
+    rendered = render(db, name)
+    if rendered is None:
+        return None
+    revision, contents = rendered
+    for path, content in zip(report_files(directory, name), contents):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # The compressed variant first, so it is never older than the file
+        # itself for long
+        write_atomically(path.with_name(path.name + ".gz"), gzip.compress(content, mtime=0))
+        write_atomically(path, content)
+    return revision
+
+
+class Publisher:
+    """Publishes reports again when they change
+
+    Reports are published once when the publisher starts, then whenever
+    their revision changes or they are marked stale, which ingest does in
+    any server process when one of their output paths gets attestations.
+
+    Every server process starts a publisher, but only the one holding the
+    lock file in the directory publishes. The others keep trying to take
+    it over, in case that process goes away.
+    """
+
+    def __init__(self, session_factory, directory, delay: float = DELAY):
+        self.session_factory = session_factory
+        self.directory = directory
+        self.delay = delay
+        # Revision of each report as last published
+        self.published: dict[str, int] = {}
+        self.stopped = threading.Event()
+        self.thread = None
+        self.lock_file = None
+
+    def lock(self) -> bool:
+        """Take the lock of the directory if no other publisher holds it,
+        returning whether this one does"""
+        if self.lock_file is not None:
+            return True
+        lock_file = open(pathlib.Path(self.directory) / LOCK_FILE, "a")
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            lock_file.close()
+            return False
+        self.lock_file = lock_file
+        return True
+
+    def unlock(self):
+        if self.lock_file is not None:
+            self.lock_file.close()
+            self.lock_file = None
+
+    def publish_stale(self, db: Session) -> list[str]:
+        """Publish the reports that changed since they were last
+        published, returning their names"""
+        names = []
+        for name, revision, stale in crud.report_states(db):
+            if self.published.get(name) == revision and not stale:
+                continue
+            if stale:
+                # Cleared first, so attestations coming in while it is
+                # rendered mark it stale again
+                crud.set_report_stale(db, name, False)
+            try:
+                result = publish(db, name, self.directory)
+            except Exception:
+                # One report that fails to render mustn't hold back the
+                # others. It is tried again next time.
+                traceback.print_exc()
+                db.rollback()
+                if stale:
+                    crud.set_report_stale(db, name, True)
+                continue
+            if result is not None:
+                self.published[name] = result
+                names.append(name)
+        return names
+
+    def _run(self):
+        try:
+            while True:
+                if self.lock():
+                    db = self.session_factory()
+                    try:
+                        self.publish_stale(db)
+                    except Exception:
+                        traceback.print_exc()
+                    finally:
+                        db.close()
+                if self.stopped.wait(self.delay):
+                    return
+        finally:
+            self.unlock()
+
+    def start(self):
+        self.thread = threading.Thread(target=self._run, name="lila-publisher", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+        self.thread.join()
+
+
+class PrecompressedStaticFiles(StaticFiles):
+    """Static files, served from their .gz variant where there is one to
+    clients that accept gzip"""
+
+    def file_response(self, full_path, stat_result, scope, status_code=200):
+        request_headers = Headers(scope=scope)
+        if "gzip" in request_headers.get("accept-encoding", ""):
+            try:
+                compressed = f"{full_path}.gz"
+                compressed_stat = os.stat(compressed)
+            except FileNotFoundError:
+                pass
+            else:
+                response = FileResponse(
+                    compressed,
+                    status_code=status_code,
+                    stat_result=compressed_stat,
+                    media_type=mimetypes.guess_type(str(full_path))[0] or "text/plain",
+                    headers={"Content-Encoding": "gzip", "Vary": "Accept-Encoding"},
+                )
+                if self.is_not_modified(response.headers, request_headers):
+                    return NotModifiedResponse(response.headers)
+                return response
+        response = super().file_response(full_path, stat_result, scope, status_code)
+        response.headers["Vary"] = "Accept-Encoding"
+        return response
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("names", nargs="*", help="reports to publish, all by default")
+    parser.add_argument("--directory", default=DIRECTORY, help="where to publish, LILA_PUBLISH_DIR by default")
+    args = parser.parse_args(argv)
+    if args.directory is None:
+        sys.exit("No directory to publish into, set LILA_PUBLISH_DIR or pass --directory")
+
+    db = SessionLocal()
+    try:
+        names = args.names or db.scalars(select(models.Report.name)).all()
+        for name in names:
+            if publish(db, name, args.directory) is None:
+                sys.exit(f"Report {name} not found")
+            print(f"Published {name}")
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+"""
+Replication from peer instances
+Pulls the change feed of another Lila instance and records its
+attestations locally, filed under stand-ins for the peer's users
+
+Usage: python -m web.replicator <peer url> [--name NAME] [--interval S] [--once]
+"""
+import argparse
+import json
+import time
+import urllib.parse
+import urllib.request
+
+from sqlalchemy.orm import Session
+
+from . import crud
+from .db import SessionLocal
+
+FEED_LIMIT = 5000
+
+
+def fetch_feed(url: str, after: int, limit: int = FEED_LIMIT) -> dict:
+    query = urllib.parse.urlencode({"after": after, "limit": limit})
+    with urllib.request.urlopen(f"{url.rstrip('/')}/feed?{query}") as response:
+        return json.load(response)
+
+
+def ingest(db: Session, peer: str, attestations: list[dict]) -> list[int]:
+    """Record attestations from the feed of peer, returning the peer's
+    ids of those submitted"""
+    by_user = {}
+    ids = []
+    for attestation in attestations:
+        # Attestations of derivations the peer no longer has
+        if attestation["drv_hash"] is None:
+            continue
+        # Only first-hand attestations are replicated: those the peer got
+        # from elsewhere would otherwise travel back and forth between
+        # instances replicating each other
+        if attestation.get("user_peer") is not None:
+            continue
+        by_user.setdefault(attestation["user_name"], []).append((
+            attestation["drv_hash"],
+            attestation["output_path"],
+            attestation["output_hash"],
+            attestation["output_sig"],
+            # Not in the feed of older instances
+            attestation.get("nar_size"),
+            attestation.get("build_duration"),
+            None,
+        ))
+        ids.append(attestation["id"])
+    for user_name, records in by_user.items():
+        user_id = crud.remote_user_id(db, peer, user_name)
+        crud.create_attestations(db, records, user_id)
+    return ids
+
+
+def replicate(db: Session, peer: str, fetch) -> int:
+    """Ingest the feed of peer from its checkpoint until caught up,
+    returning how many attestations it ingested
+
+    fetch(after) returns a page of the feed. The checkpoint is saved
+    after every page, so an interrupted run resumes where it stopped.
+    Attestation ids are taken in commit order, so no row can show up
+    later below the checkpoint.
+    """
+    after = crud.replication_checkpoint(db, peer)
+    new = 0
+    while True:
+        page = fetch(after)
+        if not page["attestations"]:
+            return new
+        new += len(ingest(db, peer, page["attestations"]))
+        after = page["last_id"]
+        crud.set_replication_checkpoint(db, peer, after)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("url", help="base URL of the peer instance")
+    parser.add_argument("--name", help="name of the peer, appended to its user names (default: the URL's host)")
+    parser.add_argument("--interval", type=float, default=10, help="seconds between polls")
+    parser.add_argument("--once", action="store_true", help="exit once caught up")
+    args = parser.parse_args(argv)
+    peer = args.name or urllib.parse.urlparse(args.url).netloc
+
+    while True:
+        db = SessionLocal()
+        try:
+            n = replicate(db, peer, lambda after: fetch_feed(args.url, after))
+        finally:
+            db.close()
+        if n:
+            print(f"Replicated {n} attestations from {peer}")
+        if args.once:
+            break
+        time.sleep(args.interval)
+
+
+if __name__ == "__main__":
+    main()
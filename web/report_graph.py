@@ -0,0 +1,243 @@
+"""
+Compact report graphs
+A report's dependency graph with its nodes interned to integer ids, the
+edges in CSR arrays and the status of every node in a byte array, so a
+large report takes a few bytes per node and edge rather than dicts of
+dicts. Graphs are built once per report revision and cached.
+"""
+import collections
+import os
+import threading
+from array import array
+
+from . import crud
+
+# Path statuses as crud.path_summaries names them, indexed by their code
+STATUSES = [
+    "No builds",
+    "One build",
+    "Partially reproduced",
+    "Successfully reproduced",
+    "Consistently nondeterministic",
+]
+STATUS_CODES = {status: code for code, status in enumerate(STATUSES)}
+# Status of the nodes that aren't output paths of the report, or that
+# weren't looked up
+NO_STATUS = 255
+
+
+class ReportGraph:
+    """Dependency graph of a report
+
+    The children of node i are targets[offsets[i]:offsets[i + 1]], in
+    the order the report lists them.
+    """
+
+    def __init__(self, root: str, paths, dependencies):
+        self.ids: dict[str, int] = {}
+        intern = lambda ref: self.ids.setdefault(ref, len(self.ids))
+        self.root = intern(root)
+        self.path_ids = array("I", (intern(path) for path in paths))
+
+        sources = array("I")
+        targets = array("I")
+        for dep in dependencies:
+            if 'dependsOn' in dep:
+                source = intern(dep['ref'])
+                for target in dep['dependsOn']:
+                    sources.append(source)
+                    targets.append(intern(target))
+        self.nodes = list(self.ids)
+
+        # Counting sort of the edges by source, keeping their order
+        n = len(self.nodes)
+        self.offsets = array("I", bytes(4 * (n + 1)))
+        for source in sources:
+            self.offsets[source + 1] += 1
+        for i in range(n):
+            self.offsets[i + 1] += self.offsets[i]
+        self.targets = array("I", bytes(4 * len(targets)))
+        fill = self.offsets[:-1]
+        for source, target in zip(sources, targets):
+            self.targets[fill[source]] = target
+            fill[source] += 1
+
+        self._rollups = None
+        self._dependents = None
+        # Statuses of all nodes and their rollups, with the status version
+        # of the report they were computed at
+        self._statuses = None
+
+    @classmethod
+    def from_report(cls, report: dict, paths) -> "ReportGraph":
+        return cls(report['metadata']['component']['bom-ref'], paths, report['dependencies'])
+
+    def __len__(self):
+        return len(self.nodes)
+
+    def children(self, node: int):
+        return self.targets[self.offsets[node]:self.offsets[node + 1]]
+
+    def has_children(self, node: int) -> bool:
+        return self.offsets[node + 1] > self.offsets[node]
+
+    def paths(self, nodes=None) -> list[str]:
+        """Output paths of the report, or those among nodes"""
+        if nodes is None:
+            return [self.nodes[i] for i in self.path_ids]
+        is_path = set(self.path_ids)
+        return [self.nodes[i] for i in nodes if i in is_path]
+
+    def statuses(self, results: dict[str, str]) -> bytearray:
+        """Status codes of all nodes, from crud.path_summaries results"""
+        status = bytearray([NO_STATUS]) * len(self.nodes)
+        for path, result in results.items():
+            node = self.ids.get(path)
+            if node is not None:
+                status[node] = STATUS_CODES[result]
+        return status
+
+    def post_order(self, root: int) -> list[int]:
+        """The nodes reachable from root, each after its children
+
+        Edges closing a cycle are skipped, so this is a topological
+        order of the subgraph even if the report has cycles.
+        """
+        offsets, targets = self.offsets, self.targets
+        visited = bytearray(len(self.nodes))
+        visited[root] = 1
+        order = []
+        stack = [[root, offsets[root]]]
+        while stack:
+            top = stack[-1]
+            node, edge = top
+            if edge < offsets[node + 1]:
+                top[1] += 1
+                child = targets[edge]
+                if not visited[child]:
+                    visited[child] = 1
+                    stack.append([child, offsets[child]])
+            else:
+                stack.pop()
+                order.append(node)
+        return order
+
+    def rollups(self, status: bytearray, root: int = None) -> array:
+        """Number of distinct nodes of each status below every node
+        reachable from root (by default the report's root)
+
+        The counts of node i are at [i * len(STATUSES):(i + 1) * len(STATUSES)],
+        zero for nodes that aren't reachable from root. Nodes shared by
+        several subtrees count once under each common ancestor.
+        """
+        root = self.root if root is None else root
+        key = (root, bytes(status))
+        if self._rollups is not None and self._rollups[0] == key:
+            return self._rollups[1]
+
+        # One pass in topological order, collecting the set of nodes below
+        # each node as a bitset over the positions in that order. A set is
+        # dropped once all parents have taken it in.
+        order = self.post_order(root)
+        position = {node: i for i, node in enumerate(order)}
+        parents_left = collections.Counter(child for node in order for child in self.children(node))
+        masks = [bytearray((len(order) + 7) // 8) for _ in STATUSES]
+        for i, node in enumerate(order):
+            if status[node] != NO_STATUS:
+                masks[status[node]][i >> 3] |= 1 << (i & 7)
+        masks = [int.from_bytes(mask, "little") for mask in masks]
+
+        k = len(STATUSES)
+        counts = array("I", bytes(4 * k * len(self.nodes)))
+        below = {}
+        for node in order:
+            reach = 0
+            for child in self.children(node):
+                reach |= below.get(child, 0) | (1 << position[child])
+                parents_left[child] -= 1
+                if parents_left[child] == 0:
+                    below.pop(child, None)
+            # Don't count a node below itself when it's part of a cycle
+            if reach >> position[node] & 1:
+                reach ^= 1 << position[node]
+            for code, mask in enumerate(masks):
+                counts[node * k + code] = (reach & mask).bit_count()
+            if parents_left[node] > 0:
+                below[node] = reach
+
+        self._rollups = (key, counts)
+        return counts
+
+    def dependents(self) -> array:
+        """Number of distinct nodes that every node reachable from the
+        report's root is below, zero for the others"""
+        if self._dependents is not None:
+            return self._dependents
+        # Parents before children, handing each child the set of nodes
+        # above it as a bitset over the positions in that order
+        order = self.post_order(self.root)
+        order.reverse()
+        position = {node: i for i, node in enumerate(order)}
+        counts = array("I", bytes(4 * len(self.nodes)))
+        above = {}
+        for i, node in enumerate(order):
+            reach = above.pop(node, 0)
+            counts[node] = reach.bit_count()
+            reach |= 1 << i
+            for child in self.children(node):
+                # Edges closing a cycle lead back to a node already done
+                if position[child] > i:
+                    above[child] = above.get(child, 0) | reach
+        self._dependents = counts
+        return counts
+
+    def cached_statuses(self, version: int) -> tuple[bytearray, array] | None:
+        """The statuses and rollups stored with cache_statuses, if computed
+        at the given status version of the report"""
+        cached = self._statuses
+        if cached is not None and cached[0] == version:
+            return cached[1], cached[2]
+        return None
+
+    def cache_statuses(self, version: int, status: bytearray, counts: array):
+        self._statuses = (version, status, counts)
+
+    def below(self, counts: array, node: int) -> dict[str, int]:
+        """The non-zero counts of node in rollups, by status"""
+        k = len(STATUSES)
+        return {STATUSES[code]: n for code, n in enumerate(counts[node * k:(node + 1) * k]) if n}
+
+
+CACHE_SIZE = int(os.environ.get("LILA_REPORT_GRAPH_CACHE", "16"))
+
+_cache: collections.OrderedDict[str, tuple[int, ReportGraph]] = collections.OrderedDict()
+_lock = threading.Lock()
+
+
+def report_graph(db, name: str, paths_of) -> ReportGraph | None:
+    """The graph of the current revision of a report, or None if there is
+    no such report. paths_of gives the output paths of a report definition.
+
+    The most recently used graphs are kept, so the definition is only
+    parsed again once the report is redefined.
+    """
+    revision = crud.report_revision(db, name)
+    if revision is None:
+        return None
+    with _lock:
+        cached = _cache.get(name)
+        if cached is not None and cached[0] == revision:
+            _cache.move_to_end(name)
+            return cached[1]
+    # If the report changes meanwhile, the graph is newer than the
+    # revision it's stored under and just gets rebuilt next time
+    report = crud.report(db, name)
+    if report is None:
+        return None
+    graph = ReportGraph.from_report(report, paths_of(report))
+    with _lock:
+        _cache[name] = (revision, graph)
+        _cache.move_to_end(name)
+        while len(_cache) > CACHE_SIZE:
+            _cache.popitem(last=False)
+    return graph
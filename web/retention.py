@@ -0,0 +1,187 @@
+"""
+Attestation retention
+Moves the attestations matching a retention policy out of the database
+into a compressed archive file, keeping the indexes maintained on ingest
+consistent, then reclaims the space they took and reports how much.
+
+Usage: python -m web.retention --archive-dir DIR [--older-than DAYS] [--unreferenced] [--revoked] [--dry-run] [--vacuum]
+"""
+import argparse
+import datetime
+import gzip
+import os
+import pathlib
+
+from sqlalchemy import select, text
+from sqlalchemy.orm import Session
+
+from . import crud, events, models, nix
+from .api.export import ndjson
+from .db import SessionLocal
+
+# Attestations archived and deleted per transaction
+BATCH_SIZE = 1000
+# Free pages released per step of an incremental SQLite vacuum
+VACUUM_STEP = 2000
+
+
+def revoked_user_ids(db: Session) -> set[int]:
+    """Users all of whose tokens were revoked. Users without any tokens,
+    such as those replicated from other instances, aren't."""
+    valid = {}
+    for user_id, token_valid in db.execute(select(models.Token.user_id, models.Token.valid)):
+        valid[user_id] = valid.get(user_id, False) or token_valid
+    return {user_id for user_id, any_valid in valid.items() if not any_valid}
+
+
+def candidates(db: Session, older_than: datetime.timedelta = None, unreferenced: bool = False,
+               revoked: bool = False, batch_size: int = BATCH_SIZE):
+    """Yield batches of the attestations matching all of the given
+    criteria, as dicts of their ids to their path ids"""
+    stmt = select(models.Attestation.id, models.Attestation.path_id).order_by(models.Attestation.id)
+    if older_than is not None:
+        # Attestations recorded before creation times were tracked have
+        # none, and are never old enough
+        cutoff = crud.utcnow() - older_than
+        stmt = stmt.where(models.Attestation.created_at < cutoff)
+    if revoked:
+        stmt = stmt.where(models.Attestation.user_id.in_(revoked_user_ids(db)))
+    if unreferenced:
+        stmt = stmt.where(~select(models.ReportPath.path_id).where(models.ReportPath.path_id == models.Attestation.path_id).exists())
+
+    last_id = 0
+    while True:
+        rows = db.execute(stmt.where(models.Attestation.id > last_id).limit(batch_size)).all()
+        if not rows:
+            return
+        last_id = rows[-1].id
+        yield {row.id: row.path_id for row in rows}
+
+
+def database_size(db: Session) -> tuple[int, int | None]:
+    """Bytes the database takes on disk, and how many of them are free
+    for reuse if known"""
+    if db.get_bind().dialect.name == "sqlite":
+        page_size = db.execute(text("PRAGMA page_size")).scalar()
+        page_count = db.execute(text("PRAGMA page_count")).scalar()
+        free = db.execute(text("PRAGMA freelist_count")).scalar()
+        return page_count * page_size, free * page_size
+    return db.execute(text("SELECT pg_database_size(current_database())")).scalar(), None
+
+
+def reclaim(engine, full: bool = False):
+    """Hand the space of deleted rows back and refresh the statistics of
+    the query planner, without holding long locks
+
+    On SQLite the free pages are released a few at a time if the
+    database was set up for incremental vacuuming. Otherwise it takes a
+    full VACUUM, which locks the database while it runs and is only done
+    if asked for; it also sets up incremental vacuuming for next time.
+    PostgreSQL's plain VACUUM makes the space reusable without blocking
+    reads or writes.
+    """
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as connection:
+        if connection.dialect.name == "sqlite":
+            if connection.execute(text("PRAGMA auto_vacuum")).scalar() == 2:
+                # Stepped through by the sqlite3 module, this statement
+                # would release a single page
+                sqlite_connection = connection.connection.driver_connection
+                while connection.execute(text("PRAGMA freelist_count")).scalar() > 0:
+                    sqlite_connection.executescript(f"PRAGMA incremental_vacuum({VACUUM_STEP})")
+            elif full:
+                connection.execute(text("PRAGMA auto_vacuum = INCREMENTAL"))
+                connection.execute(text("VACUUM"))
+            # Sample the indexes rather than reading them whole
+            connection.execute(text("PRAGMA analysis_limit = 1000"))
+            connection.execute(text("ANALYZE"))
+        else:
+            connection.execute(text(
+                "VACUUM (ANALYZE) attestations, store_paths, derivations, "
+                "nondeterministic_paths, nondeterministic_path_users, user_agreement"))
+
+
+def archive_attestations(db: Session, batches, archive) -> tuple[int, int]:
+    """Write the attestations of each batch to archive, in the format of
+    the export, and delete them. Returns the number of attestations and
+    paths archived.
+
+    Each batch is on disk before it is deleted, so an interruption can
+    leave an attestation both archived and in the database, but never in
+    neither.
+    """
+    n_attestations = 0
+    paths = set()
+    for batch in batches:
+        rows = crud.attestations_with_ids(db, batch)
+        archive.write("".join(ndjson([rows])))
+        archive.flush()
+        os.fsync(archive.fileno())
+        crud.remove_attestations(db, batch)
+        db.commit()
+        events.publish({nix.store_path(row.output_digest, row.output_name) for row in rows})
+        n_attestations += len(batch)
+        paths.update(batch.values())
+    return n_attestations, len(paths)
+
+
+def megabytes(n: int) -> str:
+    return f"{n / 1e6:.1f} MB"
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--archive-dir", help="where to write the archive, required unless --dry-run")
+    parser.add_argument("--older-than", type=float, metavar="DAYS", help="only attestations recorded more than DAYS days ago")
+    parser.add_argument("--unreferenced", action="store_true", help="only attestations of paths no report references")
+    parser.add_argument("--revoked", action="store_true", help="only attestations of users whose tokens were all revoked")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE, help="attestations per transaction")
+    parser.add_argument("--dry-run", action="store_true", help="only count the attestations that would be archived")
+    parser.add_argument("--vacuum", action="store_true", help="run a full VACUUM on SQLite if it can't vacuum incrementally")
+    args = parser.parse_args(argv)
+    if args.older_than is None and not args.unreferenced and not args.revoked:
+        parser.error("give at least one of --older-than, --unreferenced and --revoked")
+    if args.archive_dir is None and not args.dry_run:
+        parser.error("--archive-dir is required")
+
+    db = SessionLocal()
+    try:
+        batches = candidates(
+            db,
+            older_than=datetime.timedelta(days=args.older_than) if args.older_than is not None else None,
+            unreferenced=args.unreferenced,
+            revoked=args.revoked,
+            batch_size=args.batch_size,
+        )
+        if args.dry_run:
+            n = sum(len(batch) for batch in batches)
+            print(f"Would archive {n} attestations")
+            return
+
+        size_before, free_before = database_size(db)
+        directory = pathlib.Path(args.archive_dir)
+        directory.mkdir(parents=True, exist_ok=True)
+        path = directory / f"attestations-{datetime.datetime.now(datetime.timezone.utc):%Y%m%dT%H%M%SZ}.ndjson.gz"
+        with gzip.open(path, "xt") as archive:
+            n_attestations, n_paths = archive_attestations(db, batches, archive)
+        if n_attestations == 0:
+            path.unlink()
+            print("Nothing to archive")
+            return
+        print(f"Archived {n_attestations} attestations of {n_paths} paths into {path} ({megabytes(path.stat().st_size)})")
+
+        _, free_after = database_size(db)
+        db.commit()
+        reclaim(db.get_bind(), full=args.vacuum)
+        size_after, free = database_size(db)
+        print(f"Database: {megabytes(size_before)} before, {megabytes(size_after)} after", end="")
+        if free_before is not None:
+            released = free_after - free_before
+            print(f", {megabytes(released)} freed by the deleted rows, {megabytes(free)} still free for reuse")
+        else:
+            print()
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,8 @@
-from pydantic import BaseModel, RootModel
-from typing import Dict, List
+from pydantic import BaseModel, NonNegativeFloat, NonNegativeInt, RootModel
+import datetime
+from typing import Any, Dict, List, Optional
+
+from . import nix
 
 class ReportLink(BaseModel):
     drv_regex: str
@@ -10,6 +13,93 @@ class OutputHashPair(BaseModel):
     output_name: str
     output_hash: str
     output_sig: str
+    # Signed along with the hash, needed to verify output_sig
+    nar_size: Optional[NonNegativeInt] = None
+    references: Optional[List[str]] = None
+    # Seconds the build took
+    build_duration: Optional[NonNegativeFloat] = None
+
+class Attestation(BaseModel):
+    model_config = {"from_attributes": True}
+    id: int
+    output_path: str
+    output_digest: str
+    output_name: str
+    user_id: int
+    drv_id: int
+    output_hash: str
+    output_sig: str
+    sig_verified: Optional[bool] = None
+    nar_size: Optional[int] = None
+    build_duration: Optional[float] = None
+
+    @classmethod
+    def from_row(cls, row) -> "Attestation":
+        """From a row of crud._attestation_listing"""
+        return cls(
+            id=row.id,
+            output_path=nix.store_path(row.output_digest, row.output_name),
+            output_digest=row.output_digest,
+            output_name=row.output_name,
+            user_id=row.user_id,
+            drv_id=row.drv_id,
+            output_hash=row.output_hash,
+            output_sig=nix.join_signature(row.sig_key, row.sig),
+            sig_verified=row.sig_verified,
+            nar_size=row.nar_size,
+            build_duration=row.build_duration,
+        )
+
+class LinkPattern(BaseModel):
+    pattern: str
+    link: str
+
+class FeedAttestation(BaseModel):
+    id: int
+    output_path: str
+    user_id: int
+    user_name: str
+    # The instance the attestation was replicated from, if any
+    user_peer: Optional[str] = None
+    drv_id: int
+    drv_hash: Optional[str] = None
+    output_hash: str
+    output_sig: str
+    sig_verified: Optional[bool] = None
+    nar_size: Optional[int] = None
+    build_duration: Optional[float] = None
+
+class Feed(BaseModel):
+    attestations: List[FeedAttestation]
+    # Id to pass as after for the next page
+    last_id: int
+
+class NondeterministicPath(BaseModel):
+    output_path: str
+    first_seen: datetime.datetime
+    distinct_hashes: int
+    # Names of the users who attested the path
+    users: List[str]
+
+class ClosureSummary(BaseModel):
+    output_path: str
+    # Status of the output path itself
+    status: str
+    # Paths in the closure, the output path included
+    paths: int
+    # Number of paths in the closure with each status
+    statuses: Dict[str, int]
+
+class ReportPath(BaseModel):
+    report: str
+    # bom-ref of the component listing the path
+    component: str
+
+class UserAgreement(BaseModel):
+    user_a: str
+    user_b: str
+    agree_count: int
+    disagree_count: int
 
 class Derivation(BaseModel): 
     id: int
@@ -65,3 +155,12 @@ class DerivationAttestation(RootModel):
 class ReportDefinition(RootModel):
     root: dict
 
+
+class Job(BaseModel):
+    id: int
+    kind: str
+    status: str
+    created_at: datetime.datetime
+    finished_at: Optional[datetime.datetime] = None
+    result: Optional[Any] = None
+    error: Optional[str] = None
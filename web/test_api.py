@@ -1,13 +1,25 @@
+import asyncio
+import base64
+import collections
+import gzip
+import hashlib
+import json
+import time
+from concurrent.futures import Executor, Future
+
 import pytest
+from fastapi import FastAPI
 from fastapi.testclient import TestClient
-from sqlalchemy import create_engine, text, inspect
+from sqlalchemy import create_engine, select, text, inspect
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy.pool import StaticPool
 from alembic import command
 from alembic.config import Config
 from pathlib import Path
 
-from web import app, models, get_db
+from web import app, common, crud, events, importer, ingest, models, nix, profiling, publisher, replicator, report_graph, retention, schemas, verification, worker, get_db
+from web.common import get_session_factory
+from web.views import reports
 from web.db import Base
 
 
@@ -22,6 +34,22 @@ engine = create_engine(
 TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
 
+class InlineExecutor(Executor):
+    """Run background jobs synchronously
+
+    The in-memory test database lives on a single shared connection, so a
+    job running concurrently with a request would share its transaction.
+    """
+
+    def submit(self, fn, *args, **kwargs):
+        future = Future()
+        try:
+            future.set_result(fn(*args, **kwargs))
+        except Exception as e:
+            future.set_exception(e)
+        return future
+
+
 def override_get_db():
     """Override the database dependency for testing"""
     try:
@@ -68,9 +96,15 @@ def test_db():
 
 
 @pytest.fixture(scope="function")
-def client(test_db):
+def client(test_db, monkeypatch):
     """Create a test client with overridden database"""
+    monkeypatch.setattr(worker, "executor", InlineExecutor())
+    monkeypatch.setattr(verification, "executor", InlineExecutor())
+    # Every test starts from an empty database, where report revisions
+    # start over
+    monkeypatch.setattr(report_graph, "_cache", collections.OrderedDict())
     app.dependency_overrides[get_db] = override_get_db
+    app.dependency_overrides[get_session_factory] = lambda: TestingSessionLocal
     with TestClient(app) as c:
         yield c
     app.dependency_overrides.clear()
@@ -98,6 +132,24 @@ def test_user(test_db):
         db.close()
 
 
+@pytest.fixture
+def second_user(test_db):
+    """Create another user, to attest the same outputs as test_user"""
+    db = TestingSessionLocal()
+    try:
+        user = models.User(name="second_user")
+        db.add(user)
+        db.commit()
+        db.refresh(user)
+
+        token = models.Token(user=user, value="second_token_456")
+        db.add(token)
+        db.commit()
+        return {"user_id": user.id, "user_name": "second_user", "token": "second_token_456"}
+    finally:
+        db.close()
+
+
 @pytest.fixture
 def test_derivation(client, test_user):
     """
@@ -173,6 +225,24 @@ def test_report(client, test_user):
     return type('obj', (object,), {'name': 'test_report'})()
 
 
+class TestHealthEndpoints:
+    """Tests for the readiness endpoint"""
+
+    def test_ready(self, client):
+        """Test readiness with a migrated database"""
+        response = client.get("/ready")
+        assert response.status_code == 200
+        assert response.json() == {"status": "ready"}
+
+    def test_not_ready_without_migrations(self, client):
+        """Test that a database behind on migrations isn't ready"""
+        with engine.begin() as conn:
+            conn.execute(text("DELETE FROM alembic_version"))
+        response = client.get("/ready")
+        assert response.status_code == 503
+        assert response.json() == {"status": "schema not migrated"}
+
+
 class TestDerivationEndpoints:
     """Tests for /derivations endpoints"""
 
@@ -205,7 +275,7 @@ class TestDerivationEndpoints:
         assert "/nix/store/test123-hello" in data
         assert data["/nix/store/test123-hello"]["sha256:abc123"] == 1
 
-    def test_get_derivation_with_attestations(self, client, test_derivation, test_user):
+    def test_get_derivation_with_attestations(self, client, test_derivation, second_user):
         """Test getting derivation with multiple attestations (added via API)"""
         # test_derivation already has one attestation, add another via API
         payload = [
@@ -219,7 +289,7 @@ class TestDerivationEndpoints:
         response = client.post(
             f"/attestation/{test_derivation.drv_hash}",
             json=payload,
-            headers={"Authorization": f"Bearer {test_user['token']}"}
+            headers={"Authorization": f"Bearer {second_user['token']}"}
         )
         assert response.status_code == 200
 
@@ -230,6 +300,27 @@ class TestDerivationEndpoints:
         assert "/nix/store/test123-hello" in data
         assert data["/nix/store/test123-hello"]["sha256:abc123"] == 2
 
+    def test_resubmitted_attestation_is_ignored(self, client, test_derivation, test_user):
+        """Test that a user submitting the same result again adds nothing"""
+        payload = [
+            {
+                "output_digest": "test123",
+                "output_name": "hello",
+                "output_hash": "sha256:abc123",
+                "output_sig": "sig2"
+            }
+        ]
+        for _ in range(3):
+            response = client.post(
+                f"/attestation/{test_derivation.drv_hash}",
+                json=payload,
+                headers={"Authorization": f"Bearer {test_user['token']}"}
+            )
+            assert response.status_code == 200
+
+        response = client.get(f"/derivations/{test_derivation.drv_hash}")
+        assert response.json()["/nix/store/test123-hello"]["sha256:abc123"] == 1
+
     def test_get_derivation_full_mode(self, client, test_derivation, test_user):
         """Test getting derivation with full=true (returns full attestation list)"""
         # test_derivation already has one attestation from fixture
@@ -238,6 +329,169 @@ class TestDerivationEndpoints:
         data = response.json()
         assert isinstance(data, list)
         assert len(data) == 1
+        assert data == client.get("/attestations/by-output/test123-hello").json()
+        assert set(data[0]) == set(schemas.Attestation.model_fields)
+
+
+class TestDerivationSearch:
+    """Tests for /derivations/search"""
+
+    @pytest.fixture
+    def derivations(self, client, test_user):
+        """Submit attestations for a few packages"""
+        for drv_hash, output in [
+            ("aaa-libopenssl-1.0", "aaa-libopenssl-1.0"),
+            ("bbb-openssl-3.0.13", "bbb-openssl-3.0.13-dev"),
+            ("ccc-curl-8.6.0", "ccc-curl-8.6.0-bin"),
+            ("ddd-hello_world-1.0", "ddd-hello_world-1.0"),
+        ]:
+            digest, _, name = output.partition("-")
+            client.post(
+                f"/attestation/{drv_hash}",
+                json=[{"output_digest": digest, "output_name": name, "output_hash": "sha256:abc", "output_sig": "sig"}],
+                headers={"Authorization": f"Bearer {test_user['token']}"}
+            )
+
+    def search(self, client, q, **params):
+        response = client.get("/derivations/search", params={"q": q, **params})
+        assert response.status_code == 200
+        return [d["drv_hash"] for d in response.json()]
+
+    def test_search_ranks_prefix_matches_first(self, client, derivations):
+        """Test that names starting with the query come first"""
+        assert self.search(client, "openssl") == ["bbb-openssl-3.0.13", "aaa-libopenssl-1.0"]
+
+    def test_search_output_names(self, client, derivations):
+        """Test finding derivations by the names of their outputs"""
+        assert self.search(client, "8.6.0-bin") == ["ccc-curl-8.6.0"]
+
+    def test_search_paginates(self, client, derivations):
+        """Test paging through results"""
+        assert self.search(client, "openssl", limit=1, offset=1) == ["aaa-libopenssl-1.0"]
+
+    def test_search_is_literal(self, client, derivations):
+        """Test that query syntax and wildcards are matched literally"""
+        assert self.search(client, "o_w") == ["ddd-hello_world-1.0"]
+        assert self.search(client, 'ssl" OR "curl') == []
+
+    def test_search_query_too_short(self, client):
+        """Test that queries need at least three characters"""
+        response = client.get("/derivations/search", params={"q": "ab"})
+        assert response.status_code == 422
+
+
+class TestNondeterministicPaths:
+    """Tests for the index of nondeterministic paths and /nondeterministic"""
+
+    def attest(self, client, user, digest, name, output_hash):
+        response = client.post(
+            f"/attestation/{digest}-{name}",
+            json=[{"output_digest": digest, "output_name": name, "output_hash": output_hash, "output_sig": "sig"}],
+            headers={"Authorization": f"Bearer {user['token']}"}
+        )
+        assert response.status_code == 200
+
+    @pytest.fixture
+    def paths(self, client, test_user, second_user):
+        """hello and curl-bin are nondeterministic, openssl is reproducible"""
+        for digest, name, hashes in [
+            ("aaa", "hello-1.0", ["sha256:abc", "sha256:def"]),
+            ("bbb", "openssl-3.0", ["sha256:abc", "sha256:abc"]),
+            ("ccc", "curl-8.6.0-bin", ["sha256:abc", "sha256:def"]),
+        ]:
+            for user, output_hash in zip([test_user, second_user], hashes):
+                self.attest(client, user, digest, name, output_hash)
+
+    def get(self, client, **params):
+        response = client.get("/nondeterministic", params=params)
+        assert response.status_code == 200
+        return response.json()
+
+    def test_index(self, client, paths):
+        """Test that only paths with differing hashes are listed, with who attested them"""
+        entries = self.get(client)
+        assert [e["output_path"] for e in entries] == ["/nix/store/ccc-curl-8.6.0-bin", "/nix/store/aaa-hello-1.0"]
+        assert all(e["distinct_hashes"] == 2 for e in entries)
+        assert all(e["users"] == ["second_user", "test_user"] for e in entries)
+
+    def test_index_is_updated(self, client, paths, test_user):
+        """Test that further hashes and users of an indexed path are recorded"""
+        self.attest(client, test_user, "aaa", "hello-1.0", "sha256:123")
+        [entry] = self.get(client, name="hello")
+        assert entry["distinct_hashes"] == 3
+
+    def test_filter_by_name(self, client, paths):
+        """Test filtering on a part of the name"""
+        assert [e["output_path"] for e in self.get(client, name="CURL")] == ["/nix/store/ccc-curl-8.6.0-bin"]
+        assert self.get(client, name="openssl") == []
+
+    def test_filter_by_link_pattern(self, client, paths, test_user):
+        """Test filtering on the paths a link pattern applies to"""
+        client.post(
+            "/link_patterns",
+            params={"pattern": "hel+o", "link": "https://example.org"},
+            headers={"Authorization": f"Bearer {test_user['token']}"}
+        )
+        assert [e["output_path"] for e in self.get(client, link_pattern="hel+o")] == ["/nix/store/aaa-hello-1.0"]
+        response = client.get("/nondeterministic", params={"link_pattern": "curl"})
+        assert response.status_code == 404
+
+    def test_paginates(self, client, paths):
+        """Test paging through the index"""
+        assert [e["output_path"] for e in self.get(client, limit=1, offset=1)] == ["/nix/store/aaa-hello-1.0"]
+
+
+class TestUserAgreement:
+    """Tests for the agreement between users and /users/agreement"""
+
+    def attest(self, client, user, digest, output_hash):
+        response = client.post(
+            f"/attestation/{digest}-pkg",
+            json=[{"output_digest": digest, "output_name": "pkg", "output_hash": output_hash, "output_sig": "sig"}],
+            headers={"Authorization": f"Bearer {user['token']}"}
+        )
+        assert response.status_code == 200
+
+    @pytest.fixture
+    def attestations(self, client, test_user, second_user):
+        for digest, first, second in [
+            ("aaa", "sha256:abc", "sha256:abc"),
+            ("bbb", "sha256:abc", "sha256:abc"),
+            ("ccc", "sha256:abc", "sha256:def"),
+        ]:
+            self.attest(client, test_user, digest, first)
+            self.attest(client, second_user, digest, second)
+        # Only attested by one user
+        self.attest(client, test_user, "ddd", "sha256:abc")
+
+    def test_agreement(self, client, attestations):
+        """Test counting the paths two users agree and disagree on"""
+        response = client.get("/users/agreement")
+        assert response.status_code == 200
+        assert response.json() == [
+            {"user_a": "test_user", "user_b": "second_user", "agree_count": 2, "disagree_count": 1},
+        ]
+
+    def test_resubmission_is_not_counted(self, client, attestations, second_user):
+        """Test that submitting the same attestation again changes nothing"""
+        self.attest(client, second_user, "aaa", "sha256:abc")
+        [pair] = client.get("/users/agreement").json()
+        assert pair["agree_count"] == 2
+
+    def test_matches_full_recount(self, client, attestations, test_user, second_user):
+        """Test that the incremental counts match counting from scratch"""
+        self.attest(client, test_user, "ccc", "sha256:def")
+        self.attest(client, second_user, "ddd", "sha256:123")
+        with engine.connect() as conn:
+            recount = conn.execute(text("""
+                SELECT a.user_id, b.user_id,
+                       sum(CASE WHEN a.output_hash = b.output_hash THEN 1 ELSE 0 END),
+                       sum(CASE WHEN a.output_hash = b.output_hash THEN 0 ELSE 1 END)
+                FROM attestations a JOIN attestations b ON b.path_id = a.path_id AND b.user_id > a.user_id
+                GROUP BY a.user_id, b.user_id
+            """)).all()
+            maintained = conn.execute(text("SELECT user_a, user_b, agree_count, disagree_count FROM user_agreement")).all()
+        assert maintained == recount
 
 
 class TestAttestationEndpoints:
@@ -288,6 +542,534 @@ class TestAttestationEndpoints:
         assert data[0]["output_path"] == "/nix/store/test123-hello"
 
 
+class TestCompactStorage:
+    """Tests for the binary storage of digests, hashes and signatures"""
+
+    DIGEST = "0mdqa9w1p6cmli6976v4wi0sw9r4p5pr"
+    HASH = "sha256:0mdqa9w1p6cmli6976v4wi0sw9r4p5prkj7lzfd1877wk11c9c73"
+    SIG = "cache.nixos.org-1:" + base64.b64encode(bytes(range(64))).decode()
+
+    def test_base32_matches_nix(self):
+        """Test nix-base32 against the hash Nix prints for an empty file"""
+        digest = hashlib.sha256(b"").digest()
+        assert "sha256:" + nix.base32_encode(digest) == self.HASH
+        assert nix.base32_decode(self.HASH[len("sha256:"):], 32) == digest
+
+    def test_base32_round_trip(self):
+        """Test encoding and decoding sizes with an odd and even number of digits"""
+        for size in range(1, 40):
+            data = hashlib.sha256(bytes([size])).digest()[:size] if size <= 32 else bytes(range(size))
+            encoded = nix.base32_encode(data)
+            assert len(encoded) == nix.base32_len(size)
+            assert nix.base32_decode(encoded, size) == data
+        assert nix.base32_encode(b"\x01") == "01"
+
+    def test_round_trip(self, client, test_user):
+        """Test that stored values come back exactly as submitted"""
+        payload = [
+            {
+                "output_digest": self.DIGEST,
+                "output_name": "hello-2.12",
+                "output_hash": self.HASH,
+                "output_sig": self.SIG
+            }
+        ]
+        response = client.post(
+            "/attestation/abc-hello-2.12",
+            json=payload,
+            headers={"Authorization": f"Bearer {test_user['token']}"}
+        )
+        assert response.status_code == 200
+
+        data = client.get(f"/attestations/by-output/{self.DIGEST}-hello-2.12").json()
+        assert len(data) == 1
+        assert data[0]["output_path"] == f"/nix/store/{self.DIGEST}-hello-2.12"
+        assert data[0]["output_hash"] == self.HASH
+        assert data[0]["output_sig"] == self.SIG
+
+        content = client.get(f"/signatures/{test_user['user_name']}/{self.DIGEST}.narinfo").text
+        assert f"NarHash: {self.HASH}" in content
+        assert f"Sig: {self.SIG}" in content
+
+    def test_compact_columns(self, client, test_user):
+        """Test that canonical values are stored in binary"""
+        payload = [
+            {
+                "output_digest": self.DIGEST,
+                "output_name": "hello-2.12",
+                "output_hash": self.HASH,
+                "output_sig": self.SIG
+            }
+        ]
+        client.post(
+            "/attestation/abc-hello-2.12",
+            json=payload,
+            headers={"Authorization": f"Bearer {test_user['token']}"}
+        )
+        with engine.connect() as conn:
+            row = conn.execute(text(
+                "SELECT length(digest), length(output_hash), length(sig), signing_keys.name "
+                "FROM attestations JOIN signing_keys ON signing_keys.id = sig_key_id "
+                "JOIN store_paths ON store_paths.id = path_id"
+            )).one()
+        assert tuple(row) == (20, 33, 64, "cache.nixos.org-1")
+
+
+class TestStorePaths:
+    """Tests for the store path dimension table"""
+
+    def test_store_path_shared_between_attestations(self, client, test_derivation, second_user):
+        """Test that attestations of the same output share its store path row"""
+        payload = [
+            {
+                "output_digest": "test123",
+                "output_name": "hello",
+                "output_hash": "sha256:other",
+                "output_sig": "sig2"
+            }
+        ]
+        client.post(
+            f"/attestation/{test_derivation.drv_hash}",
+            json=payload,
+            headers={"Authorization": f"Bearer {second_user['token']}"}
+        )
+        db = TestingSessionLocal()
+        try:
+            assert db.query(models.StorePath).count() == 1
+            assert crud.store_path_ids(db, ["/nix/store/test123-hello", "/nix/store/unknown-pkg"]) == {
+                "/nix/store/test123-hello": db.query(models.StorePath).one().id
+            }
+            summaries = crud.path_summaries(db, ["/nix/store/test123-hello"])
+            assert summaries["/nix/store/test123-hello"] == "Consistently nondeterministic"
+        finally:
+            db.close()
+
+
+class TestSignatureVerification:
+    """Tests for verifying signatures against registered keys"""
+
+    DIGEST = "0mdqa9w1p6cmli6976v4wi0sw9r4p5pr"
+    HASH = "sha256:0mdqa9w1p6cmli6976v4wi0sw9r4p5prkj7lzfd1877wk11c9c73"
+    PATH = f"/nix/store/{DIGEST}-hello-2.12"
+    REFERENCES = ["/nix/store/9krlzvny65gdc8s7kpb6lkx8cd02c25b-glibc-2.40"]
+
+    @pytest.fixture
+    def private_key(self, client, test_user):
+        """Register a public key for the test user"""
+        ed25519 = pytest.importorskip("cryptography.hazmat.primitives.asymmetric.ed25519")
+        key = ed25519.Ed25519PrivateKey.generate()
+        self.register(client, test_user, key)
+        return key
+
+    def register(self, client, test_user, key):
+        from cryptography.hazmat.primitives import serialization
+        public = key.public_key().public_bytes(serialization.Encoding.Raw, serialization.PublicFormat.Raw)
+        response = client.post(
+            "/users/keys",
+            params={"key": "builder-1:" + base64.b64encode(public).decode()},
+            headers={"Authorization": f"Bearer {test_user['token']}"}
+        )
+        assert response.status_code == 200
+
+    def attest(self, client, test_user, sig, nar_size=1234):
+        payload = [
+            {
+                "output_digest": self.DIGEST,
+                "output_name": "hello-2.12",
+                "output_hash": self.HASH,
+                "output_sig": sig,
+                "nar_size": nar_size,
+                "references": self.REFERENCES,
+            }
+        ]
+        response = client.post(
+            "/attestation/abc-hello-2.12",
+            json=payload,
+            headers={"Authorization": f"Bearer {test_user['token']}"}
+        )
+        assert response.status_code == 200
+        data = client.get(f"/attestations/by-output/{self.DIGEST}-hello-2.12").json()
+        return data[0]["sig_verified"]
+
+    def sign(self, key, nar_size=1234):
+        fingerprint = nix.fingerprint(self.PATH, self.HASH, nar_size, self.REFERENCES)
+        return "builder-1:" + base64.b64encode(key.sign(fingerprint.encode())).decode()
+
+    def test_register_invalid_key(self, client, test_user):
+        """Test that malformed public keys are rejected"""
+        response = client.post(
+            "/users/keys",
+            params={"key": "builder-1:notakey"},
+            headers={"Authorization": f"Bearer {test_user['token']}"}
+        )
+        assert response.status_code == 400
+        assert response.json()["detail"] == "Invalid public key"
+
+    def test_list_keys(self, client, test_user, private_key):
+        """Test listing the keys of a user"""
+        keys = client.get(f"/users/{test_user['user_name']}/keys").json()
+        assert len(keys) == 1
+        assert keys[0].startswith("builder-1:")
+
+    def test_valid_signature(self, client, test_user, private_key):
+        """Test that a signature over the fingerprint verifies"""
+        assert self.attest(client, test_user, self.sign(private_key)) is True
+
+    def test_invalid_signature(self, client, test_user, private_key):
+        """Test that a signature over other data doesn't verify"""
+        assert self.attest(client, test_user, self.sign(private_key, nar_size=1)) is False
+
+    def test_unknown_key(self, client, test_user, private_key):
+        """Test that signatures by unregistered keys stay unverified"""
+        sig = "other-1:" + self.sign(private_key).partition(":")[2]
+        assert self.attest(client, test_user, sig) is None
+
+    def test_key_registered_later(self, client, test_user):
+        """Test that registering a key verifies the signatures stored before"""
+        ed25519 = pytest.importorskip("cryptography.hazmat.primitives.asymmetric.ed25519")
+        key = ed25519.Ed25519PrivateKey.generate()
+        assert self.attest(client, test_user, self.sign(key)) is None
+        self.register(client, test_user, key)
+        data = client.get(f"/attestations/by-output/{self.DIGEST}-hello-2.12").json()
+        assert data[0]["sig_verified"] is True
+
+    def test_key_registered_later_mismatch(self, client, test_user):
+        """Test that stored signatures that don't match stay unverified, as
+        the stored references may not be what was signed"""
+        ed25519 = pytest.importorskip("cryptography.hazmat.primitives.asymmetric.ed25519")
+        key = ed25519.Ed25519PrivateKey.generate()
+        assert self.attest(client, test_user, self.sign(key, nar_size=1)) is None
+        self.register(client, test_user, key)
+        data = client.get(f"/attestations/by-output/{self.DIGEST}-hello-2.12").json()
+        assert data[0]["sig_verified"] is None
+
+
+class TestExportEndpoints:
+    """Tests for /export endpoints"""
+
+    @pytest.fixture
+    def attestations(self, client, test_user):
+        """Submit attestations for three outputs"""
+        payload = [
+            {
+                "output_digest": f"export{i}",
+                "output_name": "out",
+                "output_hash": f"sha256:hash{i}",
+                "output_sig": f"sig{i}"
+            }
+            for i in range(3)
+        ]
+        client.post(
+            "/attestation/abc-export",
+            json=payload,
+            headers={"Authorization": f"Bearer {test_user['token']}"}
+        )
+
+    def test_export_ndjson(self, client, attestations, test_user):
+        """Test exporting attestations as NDJSON"""
+        response = client.get("/export/attestations")
+        assert response.status_code == 200
+        assert "application/x-ndjson" in response.headers["content-type"]
+        rows = [json.loads(line) for line in response.text.splitlines()]
+        assert [row["output_path"] for row in rows] == [f"/nix/store/export{i}-out" for i in range(3)]
+        assert rows[0]["drv_hash"] == "abc-export"
+        assert rows[0]["output_hash"] == "sha256:hash0"
+        assert rows[0]["output_sig"] == "sig0"
+        assert rows[0]["user_id"] == test_user["user_id"]
+
+    def test_export_since(self, client, attestations):
+        """Test resuming an export from an id"""
+        first = json.loads(client.get("/export/attestations").text.splitlines()[0])
+        rows = client.get("/export/attestations", params={"since": first["id"]}).text.splitlines()
+        assert [json.loads(row)["output_path"] for row in rows] == ["/nix/store/export1-out", "/nix/store/export2-out"]
+
+    def test_export_arrow(self, client, attestations):
+        """Test exporting attestations as an Arrow stream"""
+        pyarrow = pytest.importorskip("pyarrow")
+        import pyarrow.ipc
+        response = client.get("/export/attestations", params={"format": "arrow"})
+        assert response.status_code == 200
+        table = pyarrow.ipc.open_stream(response.content).read_all()
+        assert table.column("output_path").to_pylist() == [f"/nix/store/export{i}-out" for i in range(3)]
+
+    def test_export_unknown_format(self, client):
+        """Test requesting an unsupported format"""
+        response = client.get("/export/attestations", params={"format": "xml"})
+        assert response.status_code == 400
+        assert response.json()["detail"] == "Unknown format"
+
+
+class TestNarinfoImport:
+    """Tests for the bulk narinfo importer"""
+
+    DIGEST = "0mdqa9w1p6cmli6976v4wi0sw9r4p5pr"
+    HASH = "sha256:0mdqa9w1p6cmli6976v4wi0sw9r4p5prkj7lzfd1877wk11c9c73"
+
+    def narinfo(self, digest, deriver, sig):
+        return (
+            f"StorePath: /nix/store/{digest}-hello-2.12\n"
+            f"URL: nar/{digest}.nar.xz\n"
+            f"NarHash: {self.HASH}\n"
+            "NarSize: 1234\n"
+            "References: 9krlzvny65gdc8s7kpb6lkx8cd02c25b-glibc-2.40\n"
+            f"Deriver: {deriver}\n"
+            f"Sig: {sig}\n"
+        )
+
+    def test_import(self, client, test_user, tmp_path):
+        """Test importing a directory of narinfo files"""
+        (tmp_path / "sub").mkdir()
+        (tmp_path / f"{self.DIGEST}.narinfo").write_text(self.narinfo(self.DIGEST, "abc-hello-2.12.drv", "sig1"))
+        (tmp_path / "sub" / "other.narinfo").write_text(self.narinfo("other", "unknown-deriver", "sig2"))
+        (tmp_path / "nix-cache-info").write_text("StoreDir: /nix/store\n")
+        db = TestingSessionLocal()
+        try:
+            imported, skipped = importer.import_narinfos(db, test_user["user_id"], str(tmp_path), InlineExecutor())
+        finally:
+            db.close()
+        assert (imported, skipped) == (1, 1)
+
+        data = client.get(f"/attestations/by-output/{self.DIGEST}-hello-2.12").json()
+        assert len(data) == 1
+        assert data[0]["output_hash"] == self.HASH
+        assert data[0]["output_sig"] == "sig1"
+        assert data[0]["nar_size"] == 1234
+        assert client.get("/derivations/abc-hello-2.12").status_code == 200
+
+    def test_import_verifies_signatures(self, client, test_user, tmp_path):
+        """Test that signatures by a registered key are verified on import"""
+        ed25519 = pytest.importorskip("cryptography.hazmat.primitives.asymmetric.ed25519")
+        key = ed25519.Ed25519PrivateKey.generate()
+        db = TestingSessionLocal()
+        try:
+            crud.add_user_key(db, test_user["user_id"], "cache-1", key.public_key().public_bytes_raw())
+            fingerprint = nix.fingerprint(
+                f"/nix/store/{self.DIGEST}-hello-2.12", self.HASH, 1234,
+                ["/nix/store/9krlzvny65gdc8s7kpb6lkx8cd02c25b-glibc-2.40"])
+            sig = "cache-1:" + base64.b64encode(key.sign(fingerprint.encode())).decode()
+            (tmp_path / f"{self.DIGEST}.narinfo").write_text(self.narinfo(self.DIGEST, "abc-hello-2.12.drv", sig))
+            importer.import_narinfos(db, test_user["user_id"], str(tmp_path), InlineExecutor())
+        finally:
+            db.close()
+
+        data = client.get(f"/attestations/by-output/{self.DIGEST}-hello-2.12").json()
+        assert data[0]["sig_verified"] is True
+
+
+class TestReplication:
+    """Tests for the change feed and the replicator"""
+
+    @pytest.fixture
+    def attestations(self, client, test_user):
+        """Submit attestations for three outputs"""
+        payload = [
+            {
+                "output_digest": f"feed{i}",
+                "output_name": "out",
+                "output_hash": f"sha256:hash{i}",
+                "output_sig": f"sig{i}"
+            }
+            for i in range(3)
+        ]
+        client.post(
+            "/attestation/abc-feed",
+            json=payload,
+            headers={"Authorization": f"Bearer {test_user['token']}"}
+        )
+
+    def test_feed_pages(self, client, attestations):
+        """Test paging through the feed"""
+        page = client.get("/feed", params={"limit": 2}).json()
+        assert [a["output_path"] for a in page["attestations"]] == ["/nix/store/feed0-out", "/nix/store/feed1-out"]
+        assert page["attestations"][0]["user_name"] == "test_user"
+        assert page["attestations"][0]["drv_hash"] == "abc-feed"
+
+        page = client.get("/feed", params={"after": page["last_id"], "limit": 2}).json()
+        assert [a["output_path"] for a in page["attestations"]] == ["/nix/store/feed2-out"]
+
+        last_id = page["last_id"]
+        page = client.get("/feed", params={"after": last_id}).json()
+        assert page == {"attestations": [], "last_id": last_id}
+
+    def test_replicate(self, client, attestations):
+        """Test replicating a feed under remote users"""
+        def fetch(after):
+            return client.get("/feed", params={"after": after, "limit": 2}).json()
+
+        db = TestingSessionLocal()
+        try:
+            assert replicator.replicate(db, "peer", fetch) == 3
+            # The feed is shared with the peer here, so the copies show up
+            # in it too, but aren't relayed
+            assert crud.replication_checkpoint(db, "peer") == client.get("/feed").json()["last_id"]
+            assert replicator.replicate(db, "peer", fetch) == 0
+        finally:
+            db.close()
+
+        data = client.get("/attestations/by-output/feed0-out").json()
+        users = {a["user_id"] for a in data}
+        assert len(data) == 2
+        names = {u.name for u in TestingSessionLocal().query(models.User).filter(models.User.id.in_(users))}
+        assert names == {"test_user", "test_user@peer"}
+        assert {a["user_name"]: a["user_peer"] for a in client.get("/feed").json()["attestations"]} == {
+            "test_user": None,
+            "test_user@peer": "peer",
+        }
+
+    def test_replicate_local_user_named_like_remote(self, client, attestations):
+        """Test that a local user whose name looks like a remote one is
+        replicated, and kept apart from the remote user of that name"""
+        db = TestingSessionLocal()
+        try:
+            user = models.User.create(db, name="test_user@peer")
+            models.Token.create(db, user=user, value="lookalike_token")
+            local_id = user.id
+        finally:
+            db.close()
+        client.post(
+            "/attestation/abc-feed",
+            json=[{"output_digest": "feed9", "output_name": "out", "output_hash": "sha256:hash9", "output_sig": "sig9"}],
+            headers={"Authorization": "Bearer lookalike_token"}
+        )
+
+        def fetch(after):
+            return client.get("/feed", params={"after": after}).json()
+
+        db = TestingSessionLocal()
+        try:
+            assert replicator.replicate(db, "peer", fetch) == 4
+            assert crud.remote_user_id(db, "peer", "test_user") != local_id
+        finally:
+            db.close()
+        data = client.get("/attestations/by-output/feed9-out").json()
+        assert len(data) == 2
+        # Lookups by name find the local user
+        response = client.get("/signatures/test_user@peer/feed9.narinfo")
+        assert response.status_code == 200
+        assert "Sig: sig9" in response.text
+        assert client.get("/users/test_user@peer/keys").json() == []
+
+
+class TestGroupCommit:
+    """Tests for the write-behind group commit of attestations"""
+
+    PAYLOAD = [
+        {
+            "output_digest": "group123",
+            "output_name": "out",
+            "output_hash": "sha256:abc",
+            "output_sig": "sig"
+        }
+    ]
+
+    @pytest.fixture
+    def committer(self, client, monkeypatch):
+        committer = ingest.GroupCommitter(TestingSessionLocal, max_delay=0.2)
+        monkeypatch.setattr(ingest, "ENABLED", True)
+        monkeypatch.setattr(ingest, "_committer", committer)
+        yield committer
+        committer.stop()
+
+    def test_post_attestation(self, client, test_user, committer):
+        """Test that attestations are committed before being acknowledged"""
+        response = client.post(
+            "/attestation/abc-group",
+            json=self.PAYLOAD,
+            headers={"Authorization": f"Bearer {test_user['token']}"}
+        )
+        assert response.status_code == 200
+        data = client.get("/attestations/by-output/group123-out").json()
+        assert len(data) == 1
+
+    def test_queue_full(self, client, test_user, monkeypatch):
+        """Test that submissions are turned away while the queue is full"""
+        committer = ingest.GroupCommitter(TestingSessionLocal, queue_size=1)
+        committer.stop()
+        committer.submit([], test_user["user_id"])
+        monkeypatch.setattr(ingest, "ENABLED", True)
+        monkeypatch.setattr(ingest, "_committer", committer)
+        response = client.post(
+            "/attestation/abc-group",
+            json=self.PAYLOAD,
+            headers={"Authorization": f"Bearer {test_user['token']}"}
+        )
+        assert response.status_code == 503
+        assert response.json()["detail"] == "Ingest queue full"
+        assert response.headers["Retry-After"] == "1"
+
+    def test_failed_submission_is_isolated(self, test_user, committer):
+        """Test that a failing submission doesn't fail the rest of its group"""
+        good = committer.submit([("abc-group", "/nix/store/group123-out", "sha256:abc", "sig", None, None, None)], test_user["user_id"])
+        bad = committer.submit([(None, "/nix/store/group456-out", "sha256:abc", "sig", None, None, None)], test_user["user_id"])
+        assert len(good.result(timeout=5)) == 1
+        with pytest.raises(Exception):
+            bad.result(timeout=5)
+
+
+class TestProfiling:
+    """Tests for request profiling and /admin/profiles"""
+
+    ADMIN = {"Authorization": "Bearer admin_token"}
+
+    @pytest.fixture(autouse=True)
+    def admin(self, monkeypatch):
+        monkeypatch.setattr(common, "ADMIN_TOKEN", "admin_token")
+        monkeypatch.setattr(profiling, "profiles", collections.deque(maxlen=10))
+
+    def test_sampler(self):
+        """Test that samples show what a busy thread is doing"""
+        def busy_for_a_while():
+            end = time.monotonic() + 0.1
+            while time.monotonic() < end:
+                pass
+
+        profile = profiling.Profile("GET", "/")
+        profiling.sampler.start(profile)
+        busy_for_a_while()
+        profiling.sampler.stop(profile)
+        lines = profile.collapsed().splitlines()
+        assert any("test_sampler.<locals>.busy_for_a_while" in line for line in lines)
+        assert all(line.rsplit(" ", 1)[1].isdigit() for line in lines)
+
+    def test_profile_request(self, client, test_report):
+        """Test getting the profile of a request instead of its response"""
+        response = client.get("/reports/test_report", params={"profile": "1"}, headers=self.ADMIN)
+        assert response.status_code == 200
+        assert response.headers["X-Lila-Profiled-Status"] == "200"
+        profile_id = response.headers["X-Lila-Profile-Id"]
+        response = client.get(f"/admin/profiles/{profile_id}", headers=self.ADMIN)
+        assert response.status_code == 200
+
+    def test_profile_header(self, client, test_report):
+        """Test asking for a profile with a header, leaving the Authorization header to the request"""
+        response = client.get(
+            "/reports/test_report/suggest",
+            headers={"X-Lila-Profile": "admin_token", "Authorization": "Bearer test_token_123"}
+        )
+        assert response.status_code == 200
+        assert response.headers["X-Lila-Profiled-Status"] == "200"
+
+    def test_profile_needs_admin_token(self, client, test_report):
+        """Test that only the admin can profile requests or see profiles"""
+        response = client.get("/reports/test_report", params={"profile": "1"}, headers={"Authorization": "Bearer test_token_123"})
+        assert response.status_code == 403
+        response = client.get("/admin/profiles", headers={"Authorization": "Bearer test_token_123"})
+        assert response.status_code == 403
+
+    def test_continuous_sampling(self, client, test_report, monkeypatch):
+        """Test that sampled requests are answered as usual and their profiles kept"""
+        monkeypatch.setattr(profiling, "SAMPLE_RATE", 1.0)
+        response = client.get("/reports/test_report", headers={"Accept": "text/plain"})
+        assert response.status_code == 200
+        assert "root-package" in response.text
+        monkeypatch.setattr(profiling, "SAMPLE_RATE", 0)
+        [profile] = client.get("/admin/profiles", headers=self.ADMIN).json()
+        assert profile["path"] == "/reports/test_report"
+        assert profile["status"] == 200
+        response = client.get("/admin/profiles/collapsed", headers=self.ADMIN)
+        assert response.status_code == 200
+
+
 class TestReportEndpoints:
     """Tests for /reports endpoints"""
 
@@ -388,6 +1170,755 @@ class TestReportEndpoints:
         assert len(data) <= 50
 
 
+class TestLargeReports:
+    """Tests for reports with more paths than fit in a single IN list"""
+
+    def test_path_summaries_many_paths(self, test_derivation):
+        """Test summarizing more paths than SQLite allows bound parameters"""
+        paths = [f"/nix/store/missing{i}-pkg" for i in range(40000)]
+        paths.append("/nix/store/test123-hello")
+        db = TestingSessionLocal()
+        try:
+            results = crud.path_summaries(db, paths)
+        finally:
+            db.close()
+        assert len(results) == len(paths)
+        assert results["/nix/store/test123-hello"] == "One build"
+        assert results["/nix/store/missing0-pkg"] == "No builds"
+
+    def test_suggest_many_paths(self, test_derivation, test_user):
+        """Test suggesting rebuilds among more paths than fit in one IN list"""
+        elements = {f"/nix/store/missing{i}-pkg": {} for i in range(40000)}
+        elements["/nix/store/test123-hello"] = {}
+        db = TestingSessionLocal()
+        try:
+            suggestions = crud.suggest(db, elements, test_user["user_id"])
+        finally:
+            db.close()
+        # The user already built test123-hello, so it is not suggested
+        assert len(suggestions) == 40000
+        assert "/nix/store/test123-hello" not in suggestions
+
+    def test_in_clauses_chunks_are_padded(self, test_db):
+        """Test that chunks only come in a few fixed sizes"""
+        db = TestingSessionLocal()
+        try:
+            clauses = list(crud.in_clauses(db, models.StorePath.digest, [str(i) for i in range(1000)]))
+        finally:
+            db.close()
+        sizes = [len(c.right.value) for c in clauses]
+        assert sizes == [crud.IN_CHUNK_SIZE, crud.IN_CHUNK_SIZE]
+
+
+class TestJobEndpoints:
+    """Tests for background jobs and the /jobs endpoint"""
+
+    def test_get_job_not_found(self, client):
+        """Test getting a job that doesn't exist"""
+        response = client.get("/jobs/12345")
+        assert response.status_code == 404
+        assert response.json()["detail"] == "Job not found"
+
+    def test_put_report_in_background(self, client, test_user):
+        """Test defining a report through a background job"""
+        report_data = {
+            "bomFormat": "CycloneDX",
+            "specVersion": "1.4",
+            "metadata": {
+                "component": {
+                    "bom-ref": "/nix/store/new-package",
+                    "type": "application"
+                }
+            }
+        }
+        response = client.put(
+            "/reports/background_report?background=true",
+            json=report_data,
+            headers={"Authorization": f"Bearer {test_user['token']}"}
+        )
+        assert response.status_code == 202
+        job_id = response.json()["job"]
+        assert response.headers["location"] == f"/jobs/{job_id}"
+
+        worker.wait(job_id, timeout=10)
+        response = client.get(f"/jobs/{job_id}")
+        assert response.status_code == 200
+        assert response.json()["kind"] == "define_report"
+        assert response.json()["status"] == "done"
+        assert client.get("/reports").json() == ["background_report"]
+
+    def test_rebuild_summaries(self, client, test_report, test_user):
+        """Test recomputing report summaries through a background job"""
+        response = client.post(
+            "/reports/test_report/summaries",
+            headers={"Authorization": f"Bearer {test_user['token']}"}
+        )
+        assert response.status_code == 202
+        job_id = response.json()["job"]
+
+        worker.wait(job_id, timeout=10)
+        data = client.get(f"/jobs/{job_id}").json()
+        assert data["status"] == "done"
+        assert data["result"] == {"No builds": 1}
+        db = TestingSessionLocal()
+        try:
+            assert [stale for name, _, stale in crud.report_states(db) if name == "test_report"] == [True]
+        finally:
+            db.close()
+
+    def test_fail_interrupted_jobs(self, client, monkeypatch, capsys):
+        """Test marking the jobs left unfinished by a stopped server as
+        failed, which starting the app doesn't do"""
+        db = TestingSessionLocal()
+        try:
+            job_id = crud.create_job(db, "summaries")
+        finally:
+            db.close()
+        with TestClient(app):
+            pass
+        assert client.get(f"/jobs/{job_id}").json()["status"] == "pending"
+
+        monkeypatch.setattr(worker, "SessionLocal", TestingSessionLocal)
+        worker.main(["--fail-interrupted"])
+        assert "Marked 1 interrupted jobs as failed" in capsys.readouterr().out
+        data = client.get(f"/jobs/{job_id}").json()
+        assert data["status"] == "failed"
+        assert data["finished_at"] is not None
+
+    def test_rebuild_summaries_without_auth(self, client, test_report):
+        """Test that starting a job requires authentication"""
+        response = client.post("/reports/test_report/summaries")
+        assert response.status_code == 401
+
+
+class TestReportEvents:
+    """Tests for live report updates"""
+
+    def test_report_events_not_found(self, client):
+        """Test subscribing to events of a report that doesn't exist"""
+        response = client.get("/reports/nonexistent/events")
+        assert response.status_code == 404
+        assert response.json()["detail"] == "Report not found"
+
+    def test_attestation_notifies_subscribers(self, client, test_user):
+        """Test that an attestation only notifies subscribers of its path"""
+        payload = [
+            {
+                "output_digest": "test456",
+                "output_name": "dep1",
+                "output_hash": "sha256:def456",
+                "output_sig": "sig1"
+            }
+        ]
+
+        async def scenario():
+            interested = events.subscribe(["/nix/store/test456-dep1"])
+            other = events.subscribe(["/nix/store/other-pkg"])
+            try:
+                response = await asyncio.to_thread(
+                    client.post,
+                    "/attestation/test456-dep1",
+                    json=payload,
+                    headers={"Authorization": f"Bearer {test_user['token']}"}
+                )
+                assert response.status_code == 200
+                changed = await asyncio.wait_for(interested.queue.get(), 5)
+                assert changed == {"/nix/store/test456-dep1"}
+                assert other.queue.empty()
+            finally:
+                events.unsubscribe(interested)
+                events.unsubscribe(other)
+
+        asyncio.run(scenario())
+
+    def test_report_events_hold_no_session(self, client, test_report):
+        """Test that an open event stream doesn't keep a database session"""
+        open_sessions = set()
+
+        def session_factory():
+            session = TestingSessionLocal()
+            open_sessions.add(session)
+            session.close = lambda close=session.close: (open_sessions.discard(session), close())
+            return session
+
+        class Disconnected:
+            async def is_disconnected(self):
+                return True
+
+        async def scenario():
+            response = await reports.report_events(Disconnected(), "test_report", session_factory)
+            assert not open_sessions
+            assert [chunk async for chunk in response.body_iterator] == []
+
+        asyncio.run(scenario())
+        assert "/nix/store/test456-dep1" not in events._subscribers
+
+    def test_report_html_has_update_hook(self, client, test_report):
+        """Test that the HTML report marks status icons with their path"""
+        response = client.get(
+            "/reports/test_report",
+            headers={"Accept": "text/html"}
+        )
+        assert 'data-path="/nix/store/test456-dep1"' in response.text
+        assert "/events" in response.text
+
+
+class TestReportPaths:
+    """Tests for the index of the reports each output path is part of"""
+
+    def define(self, client, user, name, paths):
+        response = client.put(f"/reports/{name}", json={
+            "metadata": {"component": {"bom-ref": "/nix/store/root-package"}},
+            "components": [
+                {"bom-ref": path, "properties": [{"name": "nix:out_path", "value": path}]}
+                for path in paths
+            ],
+            "dependencies": [],
+        }, headers={"Authorization": f"Bearer {user['token']}"})
+        assert response.status_code == 200
+
+    def stale(self):
+        db = TestingSessionLocal()
+        try:
+            return {name for name, _, stale in crud.report_states(db) if stale}
+        finally:
+            db.close()
+
+    def test_lookup(self, client, test_report, test_user):
+        """Test finding the reports with a path"""
+        self.define(client, test_user, "other", ["/nix/store/test456-dep1", "/nix/store/other-pkg"])
+        response = client.get("/paths/test456-dep1/reports")
+        assert response.status_code == 200
+        assert response.json() == [
+            {"report": "other", "component": "/nix/store/test456-dep1"},
+            {"report": "test_report", "component": "/nix/store/test456-dep1"},
+        ]
+        assert client.get("/paths/missing-pkg/reports").status_code == 404
+
+    def test_redefined(self, client, test_report, test_user):
+        """Test that redefining a report updates the index"""
+        self.define(client, test_user, "test_report", ["/nix/store/other-pkg"])
+        assert client.get("/paths/test456-dep1/reports").json() == []
+        assert client.get("/paths/other-pkg/reports").json() == [{"report": "test_report", "component": "/nix/store/other-pkg"}]
+
+    def test_marked_stale(self, client, test_report, test_user):
+        """Test that ingest marks only the reports with the attested paths stale"""
+        self.define(client, test_user, "other", ["/nix/store/other-pkg"])
+        for digest, name in [("unrelated", "pkg"), ("test456", "dep1")]:
+            client.post(
+                f"/attestation/{digest}-{name}.drv",
+                json=[{"output_digest": digest, "output_name": name, "output_hash": "sha256:abc", "output_sig": "sig"}],
+                headers={"Authorization": f"Bearer {test_user['token']}"}
+            )
+            if digest == "unrelated":
+                assert self.stale() == set()
+        assert self.stale() == {"test_report"}
+
+
+class TestReportTree:
+    """Tests for the lazily loaded HTML dependency tree"""
+
+    @pytest.fixture
+    def deep_report(self, client, test_user):
+        """A report whose dependencies form a chain a -> b -> c -> d"""
+        chain = [f"/nix/store/{c * 32}-pkg-{c}" for c in "abcd"]
+        report_data = {
+            "metadata": {"component": {"bom-ref": chain[0]}},
+            "components": [
+                {"bom-ref": path, "properties": [{"name": "nix:out_path", "value": path}]}
+                for path in chain[1:]
+            ],
+            "dependencies": [
+                {"ref": ref, "dependsOn": [dep]}
+                for ref, dep in zip(chain, chain[1:])
+            ],
+        }
+        response = client.put(
+            "/reports/deep_report",
+            json=report_data,
+            headers={"Authorization": f"Bearer {test_user['token']}"}
+        )
+        assert response.status_code == 200
+        return chain
+
+    def test_html_renders_top_levels_only(self, client, deep_report):
+        """Test that nodes below the first levels are left for later"""
+        response = client.get("/reports/deep_report", headers={"Accept": "text/html"})
+        assert response.status_code == 200
+        assert f'<summary title="{deep_report[1]}">' in response.text
+        assert f'data-node="{deep_report[2]}"' in response.text
+        assert f'<summary title="{deep_report[3]}">' not in response.text
+
+    def test_tree_fragment(self, client, deep_report):
+        """Test fetching the subtree below a collapsed node"""
+        response = client.get("/reports/deep_report/tree", params={"node": deep_report[2]})
+        assert response.status_code == 200
+        assert "text/html" in response.headers["content-type"]
+        assert response.text.startswith("<ul>")
+        assert f'data-path="{deep_report[3]}"' in response.text
+        assert "No builds" in response.text
+
+    def test_tree_fragment_queries(self, client, deep_report, test_user, monkeypatch):
+        """Test that a fragment only looks up the nodes it renders, and that
+        rollups are computed again only once statuses change"""
+        queried = []
+        path_summaries = crud.path_summaries
+        monkeypatch.setattr(crud, "path_summaries", lambda db, paths: queried.append(sorted(paths)) or path_summaries(db, paths))
+        fragment = lambda: client.get("/reports/deep_report/tree", params={"node": deep_report[0]}).text
+
+        fragment()
+        assert queried == [deep_report[1:], deep_report[1:3]]
+        queried.clear()
+        fragment()
+        assert queried == [deep_report[1:3]]
+
+        digest, name = deep_report[3][11:].split("-", 1)
+        client.post(
+            f"/attestation/{digest}-{name}",
+            json=[{"output_digest": digest, "output_name": name, "output_hash": "sha256:abc", "output_sig": "sig"}],
+            headers={"Authorization": f"Bearer {test_user['token']}"}
+        )
+        queried.clear()
+        assert "❎ 1" in fragment()
+        assert queried == [deep_report[1:], deep_report[1:3]]
+
+    def test_tree_fragment_unknown_node(self, client, deep_report):
+        """Test fetching the subtree of a node that isn't in the report"""
+        response = client.get("/reports/deep_report/tree", params={"node": "/nix/store/nope"})
+        assert response.status_code == 404
+        assert response.json()["detail"] == "Node not found"
+
+    def test_text_tree_shows_rollups(self, client, deep_report):
+        """Test that the text tree counts the statuses below each node"""
+        response = client.get("/reports/deep_report", headers={"Accept": "text/plain"})
+        lines = response.text.splitlines()
+        assert lines[0].endswith("pkg-a (below: ❔ 3)")
+        assert lines[3].endswith("pkg-d No builds")
+
+    def test_rollup(self, client, deep_report, test_user):
+        """Test getting the statuses below a node and its children"""
+        digest, name = deep_report[3][11:].split("-", 1)
+        client.post(
+            f"/attestation/{digest}-{name}",
+            json=[{"output_digest": digest, "output_name": name, "output_hash": "sha256:abc", "output_sig": "sig"}],
+            headers={"Authorization": f"Bearer {test_user['token']}"}
+        )
+        response = client.get("/reports/deep_report/rollup", params={"node": deep_report[1]})
+        assert response.status_code == 200
+        assert response.json() == {
+            "node": deep_report[1],
+            "status": "No builds",
+            "below": {"No builds": 1, "One build": 1},
+            "children": [{"node": deep_report[2], "status": "No builds", "below": {"One build": 1}}],
+        }
+
+    def test_redefine_report(self, client, deep_report, test_user):
+        """Test that redefining a report replaces it"""
+        response = client.put(
+            "/reports/deep_report",
+            json={"metadata": {"component": {"bom-ref": deep_report[0]}}, "components": [], "dependencies": []},
+            headers={"Authorization": f"Bearer {test_user['token']}"}
+        )
+        assert response.status_code == 200
+        assert client.get("/reports").json() == ["deep_report"]
+        response = client.get("/reports/deep_report", headers={"Accept": "text/plain"})
+        assert response.text.splitlines() == [deep_report[0][11:]]
+
+
+class TestClosure:
+    """Tests for references between store paths and /closure"""
+
+    def attest(self, client, user, digest, references, output_hash="sha256:abc"):
+        response = client.post(
+            f"/attestation/{digest}-pkg.drv",
+            json=[{"output_digest": digest, "output_name": "pkg", "output_hash": output_hash, "output_sig": "sig",
+                   "references": [f"/nix/store/{ref}-pkg" for ref in references]}],
+            headers={"Authorization": f"Bearer {user['token']}"}
+        )
+        assert response.status_code == 200
+
+    @pytest.fixture
+    def closure(self, client, test_user, second_user):
+        """app refers to itself, lib and data, lib and libc refer to each
+        other, and nobody attested data"""
+        self.attest(client, test_user, "app", ["app", "lib", "data"])
+        self.attest(client, test_user, "lib", ["libc"])
+        self.attest(client, second_user, "lib", ["libc"])
+        self.attest(client, test_user, "libc", ["lib"])
+        self.attest(client, second_user, "libc", ["lib"], output_hash="sha256:def")
+
+    def test_summary(self, client, closure):
+        """Test summarizing every path in the closure once"""
+        response = client.get("/closure/app-pkg/summary")
+        assert response.status_code == 200
+        assert response.json() == {
+            "output_path": "/nix/store/app-pkg",
+            "status": "One build",
+            "paths": 4,
+            "statuses": {"One build": 1, "No builds": 1, "Successfully reproduced": 1, "Consistently nondeterministic": 1},
+        }
+        summary = client.get("/closure/lib-pkg/summary").json()
+        assert summary["paths"] == 2
+        assert client.get("/closure/data-pkg/summary").json()["statuses"] == {"No builds": 1}
+
+    def test_unknown_path(self, client, closure):
+        response = client.get("/closure/missing-pkg/summary")
+        assert response.status_code == 404
+
+    def test_removed_with_attestations(self, client, closure):
+        """Test that paths no longer attested lose their references, and go
+        unless still referred to"""
+        db = TestingSessionLocal()
+        try:
+            path_ids = crud.store_path_ids(db, ["/nix/store/app-pkg", "/nix/store/lib-pkg"]).values()
+            removed = dict(db.execute(
+                select(models.Attestation.id, models.Attestation.path_id).where(models.Attestation.path_id.in_(path_ids))).all())
+            assert len(removed) == 3
+            crud.remove_attestations(db, removed)
+            db.commit()
+        finally:
+            db.close()
+        assert client.get("/closure/app-pkg/summary").status_code == 404
+        assert client.get("/closure/data-pkg/summary").status_code == 404
+        # libc still refers to lib
+        assert client.get("/closure/libc-pkg/summary").json()["statuses"] == {
+            "Consistently nondeterministic": 1, "No builds": 1}
+
+
+class TestRebuildCost:
+    """Tests for the NAR sizes and build durations of attestations"""
+
+    def attest(self, client, user, digest, **cost):
+        response = client.post(
+            f"/attestation/{digest}-pkg.drv",
+            json=[{"output_digest": digest, "output_name": "pkg", "output_hash": "sha256:abc", "output_sig": "sig", **cost}],
+            headers={"Authorization": f"Bearer {user['token']}"}
+        )
+        assert response.status_code == 200
+
+    @pytest.fixture
+    def report(self, client, test_user, second_user):
+        """Everything depends on ccc, which is cheap to build, bbb is
+        cheaper than aaa, and ddd was never built"""
+        paths = {name: f"/nix/store/{name}-pkg" for name in ["root", "aaa", "bbb", "ccc", "ddd"]}
+        response = client.put("/reports/costs", json={
+            "metadata": {"component": {"bom-ref": paths["root"]}},
+            "components": [
+                {"bom-ref": path, "properties": [{"name": "nix:out_path", "value": path}]}
+                for name, path in paths.items() if name != "root"
+            ],
+            "dependencies": [
+                {"ref": paths["root"], "dependsOn": [paths["aaa"], paths["bbb"], paths["ddd"]]},
+                {"ref": paths["aaa"], "dependsOn": [paths["ccc"]]},
+                {"ref": paths["bbb"], "dependsOn": [paths["ccc"]]},
+            ],
+        }, headers={"Authorization": f"Bearer {test_user['token']}"})
+        assert response.status_code == 200
+        self.attest(client, second_user, "aaa", nar_size=3000, build_duration=600)
+        self.attest(client, second_user, "bbb", nar_size=5000, build_duration=60.5)
+        self.attest(client, second_user, "ccc", nar_size=100)
+
+    def suggest(self, client, user, **params):
+        response = client.get("/reports/costs/suggest", params=params, headers={"Authorization": f"Bearer {user['token']}"})
+        assert response.status_code == 200
+        return response.json()
+
+    def test_narinfo_size(self, client, test_user):
+        """Test that narinfo serves the reported NAR size"""
+        self.attest(client, test_user, "aaa", nar_size=3000)
+        self.attest(client, test_user, "bbb")
+        assert "NarSize: 3000\n" in client.get(f"/signatures/{test_user['user_name']}/aaa.narinfo").text
+        assert "NarSize: 1\n" in client.get(f"/signatures/{test_user['user_name']}/bbb.narinfo").text
+
+    def test_negative_cost(self, client, test_user):
+        """Test that negative sizes and durations are rejected"""
+        for cost in [{"nar_size": -1}, {"build_duration": -1}]:
+            response = client.post(
+                "/attestation/aaa-pkg.drv",
+                json=[{"output_digest": "aaa", "output_name": "pkg", "output_hash": "sha256:abc", "output_sig": "sig", **cost}],
+                headers={"Authorization": f"Bearer {test_user['token']}"}
+            )
+            assert response.status_code == 422
+
+    def test_cheapest(self, client, report, test_user):
+        """Test suggesting the shortest builds first, then the smallest outputs"""
+        suggestions = self.suggest(client, test_user, strategy="cheapest")
+        assert [s["out_path"] for s in suggestions] == [
+            "/nix/store/bbb-pkg", "/nix/store/aaa-pkg", "/nix/store/ccc-pkg", "/nix/store/ddd-pkg"]
+        assert suggestions[0]["nar_size"] == 5000
+        assert suggestions[0]["build_duration"] == 60.5
+        assert suggestions[3]["nar_size"] is None
+
+    def test_impact(self, client, report, test_user):
+        """Test suggesting what most of the report depends on first"""
+        suggestions = self.suggest(client, test_user, strategy="impact")
+        assert [s["out_path"] for s in suggestions] == [
+            "/nix/store/ccc-pkg", "/nix/store/bbb-pkg", "/nix/store/aaa-pkg", "/nix/store/ddd-pkg"]
+
+    def test_random(self, client, report, test_user):
+        """Test that the default order comes with the costs too"""
+        suggestions = self.suggest(client, test_user)
+        assert {s["out_path"]: s["build_duration"] for s in suggestions} == {
+            "/nix/store/aaa-pkg": 600, "/nix/store/bbb-pkg": 60.5, "/nix/store/ccc-pkg": None, "/nix/store/ddd-pkg": None}
+        response = client.get("/reports/costs/suggest", params={"strategy": "largest"}, headers={"Authorization": f"Bearer {test_user['token']}"})
+        assert response.status_code == 422
+
+    def test_exported(self, client, report):
+        """Test that the costs are exported and replicated"""
+        lines = [json.loads(line) for line in client.get("/export/attestations").text.splitlines()]
+        assert [(a["nar_size"], a["build_duration"]) for a in lines] == [(3000, 600), (5000, 60.5), (100, None)]
+        assert client.get("/feed").json()["attestations"][0]["nar_size"] == 3000
+
+
+class TestReportGraph:
+    """Tests for the compact report graph"""
+
+    def test_shared_nodes_count_once(self):
+        """Test that a node reachable along several paths counts once"""
+        graph = report_graph.ReportGraph("a", ["b", "c", "d"], [
+            {"ref": "a", "dependsOn": ["b", "c"]},
+            {"ref": "b", "dependsOn": ["d"]},
+            {"ref": "c", "dependsOn": ["d"]},
+        ])
+        status = graph.statuses({"b": "One build", "c": "One build", "d": "Consistently nondeterministic"})
+        counts = graph.rollups(status)
+        assert graph.below(counts, graph.ids["a"]) == {"One build": 2, "Consistently nondeterministic": 1}
+        assert graph.below(counts, graph.ids["c"]) == {"Consistently nondeterministic": 1}
+        assert graph.below(counts, graph.ids["d"]) == {}
+
+    def test_cycles(self):
+        """Test that cycles don't loop or count a node below itself"""
+        graph = report_graph.ReportGraph("a", ["a", "b"], [
+            {"ref": "a", "dependsOn": ["b"]},
+            {"ref": "b", "dependsOn": ["a"]},
+        ])
+        status = graph.statuses({"a": "One build", "b": "No builds"})
+        assert graph.post_order(graph.ids["a"]) == [graph.ids["b"], graph.ids["a"]]
+        assert graph.below(graph.rollups(status), graph.ids["a"]) == {"No builds": 1}
+        assert list(graph.dependents()) == [0, 1]
+
+    def test_dependents(self):
+        """Test counting the distinct nodes above each node"""
+        graph = report_graph.ReportGraph("a", ["b", "c", "d"], [
+            {"ref": "a", "dependsOn": ["b", "c"]},
+            {"ref": "b", "dependsOn": ["d"]},
+            {"ref": "c", "dependsOn": ["d"]},
+        ])
+        dependents = graph.dependents()
+        assert {node: dependents[i] for node, i in graph.ids.items()} == {"a": 0, "b": 1, "c": 1, "d": 3}
+
+
+class TestPublisher:
+    """Tests for static report publishing"""
+
+    def attest(self, client, user, digest, name):
+        client.post(
+            f"/attestation/{digest}-{name}.drv",
+            json=[{"output_digest": digest, "output_name": name, "output_hash": "sha256:abc", "output_sig": "sig"}],
+            headers={"Authorization": f"Bearer {user['token']}"}
+        )
+
+    def test_publish(self, client, test_report, tmp_path):
+        """Test that the published files are those the views serve"""
+        db = TestingSessionLocal()
+        try:
+            assert publisher.publish(db, "test_report", tmp_path) is not None
+            assert publisher.publish(db, "nonexistent", tmp_path) is None
+        finally:
+            db.close()
+        html, text, cdx = publisher.report_files(tmp_path, "test_report")
+        assert text.read_text() == client.get("/reports/test_report", headers={"Accept": "text/plain"}).text
+        assert json.loads(cdx.read_text()) == client.get(
+            "/reports/test_report", headers={"Accept": "application/vnd.cyclonedx+json"}).json()
+        assert "root-package" in html.read_text()
+        assert 'const reportUrl = "/reports/test_report";' in html.read_text()
+        for path in (html, text, cdx):
+            assert gzip.decompress(path.with_name(path.name + ".gz").read_bytes()) == path.read_bytes()
+        # No partially written files left behind
+        assert not any(p.name.startswith(".") for p in tmp_path.joinpath("reports").iterdir())
+
+    def test_publish_stale(self, client, test_report, test_user, tmp_path):
+        """Test that reports are published again when redefined or attested"""
+        report_publisher = publisher.Publisher(TestingSessionLocal, tmp_path)
+        db = TestingSessionLocal()
+        try:
+            assert report_publisher.publish_stale(db) == ["test_report"]
+            assert report_publisher.publish_stale(db) == []
+
+            self.attest(client, test_user, "unrelated", "other")
+            assert report_publisher.publish_stale(db) == []
+            self.attest(client, test_user, "test456", "dep1")
+            assert report_publisher.publish_stale(db) == ["test_report"]
+            _, text, _ = publisher.report_files(tmp_path, "test_report")
+            assert "test456-dep1 One build" in text.read_text()
+
+            definition = client.get("/reports/test_report", headers={"Accept": "application/vnd.cyclonedx+json"}).json()
+            client.put("/reports/test_report", json=definition, headers={"Authorization": f"Bearer {test_user['token']}"})
+            assert report_publisher.publish_stale(db) == ["test_report"]
+            assert report_publisher.publish_stale(db) == []
+        finally:
+            db.close()
+
+    def test_failing_report_doesnt_block_others(self, client, test_report, test_user, tmp_path, capsys):
+        """Test that a report that fails to render doesn't keep the reports
+        after it from being published"""
+        headers = {"Authorization": f"Bearer {test_user['token']}"}
+        definition = client.get("/reports/test_report", headers={"Accept": "application/vnd.cyclonedx+json"}).json()
+        assert client.put("/reports/bad", json={"components": []}, headers=headers).status_code == 200
+        assert client.put("/reports/good", json=definition, headers=headers).status_code == 200
+        report_publisher = publisher.Publisher(TestingSessionLocal, tmp_path)
+        db = TestingSessionLocal()
+        try:
+            assert report_publisher.publish_stale(db) == ["test_report", "good"]
+            assert "KeyError" in capsys.readouterr().err
+            # Tried again, without holding back the others
+            self.attest(client, test_user, "test456", "dep1")
+            assert report_publisher.publish_stale(db) == ["test_report", "good"]
+        finally:
+            db.close()
+        assert all(path.exists() for path in publisher.report_files(tmp_path, "good"))
+        assert not any(path.exists() for path in publisher.report_files(tmp_path, "bad"))
+
+    def test_one_publisher_per_directory(self, tmp_path):
+        """Test that only one of the publishers of a directory publishes,
+        until it lets go"""
+        first = publisher.Publisher(TestingSessionLocal, tmp_path)
+        second = publisher.Publisher(TestingSessionLocal, tmp_path)
+        try:
+            assert first.lock()
+            assert first.lock()
+            assert not second.lock()
+            first.unlock()
+            assert second.lock()
+            assert not first.lock()
+        finally:
+            first.unlock()
+            second.unlock()
+
+    def test_serves_precompressed(self, tmp_path):
+        """Test that clients accepting gzip get the compressed variant"""
+        tmp_path.joinpath("report.txt").write_text("plain")
+        tmp_path.joinpath("report.txt.gz").write_bytes(gzip.compress(b"compressed"))
+        static = FastAPI()
+        static.mount("/published", publisher.PrecompressedStaticFiles(directory=tmp_path))
+        with TestClient(static) as c:
+            response = c.get("/published/report.txt", headers={"Accept-Encoding": "gzip"})
+            assert response.headers["content-encoding"] == "gzip"
+            assert response.headers["content-type"].startswith("text/plain")
+            assert response.text == "compressed"
+            response = c.get("/published/report.txt", headers={"Accept-Encoding": "identity"})
+            assert "content-encoding" not in response.headers
+            assert response.text == "plain"
+
+
+class TestRetention:
+    """Tests for archiving attestations out of the database"""
+
+    def attest(self, client, user, digest, name, output_hash):
+        response = client.post(
+            f"/attestation/{digest}-{name}.drv",
+            json=[{"output_digest": digest, "output_name": name, "output_hash": output_hash, "output_sig": "sig"}],
+            headers={"Authorization": f"Bearer {user['token']}"}
+        )
+        assert response.status_code == 200
+
+    @pytest.fixture
+    def attestations(self, client, test_report, test_user, second_user):
+        """dep1 is in the report, hello and curl aren't, and hello is
+        nondeterministic"""
+        for digest, name, hashes in [
+            ("test456", "dep1", ["sha256:abc", "sha256:def"]),
+            ("aaa", "hello", ["sha256:abc", "sha256:def"]),
+            ("bbb", "curl", ["sha256:abc", "sha256:abc"]),
+        ]:
+            for user, output_hash in zip([test_user, second_user], hashes):
+                self.attest(client, user, digest, name, output_hash)
+
+    def run(self, monkeypatch, *args):
+        monkeypatch.setattr(retention, "SessionLocal", TestingSessionLocal)
+        retention.main(list(args))
+
+    def test_created_at(self, client, test_derivation):
+        """Test that attestations record when they were submitted"""
+        with engine.connect() as conn:
+            [created_at] = conn.execute(text("SELECT created_at FROM attestations")).scalars()
+        assert created_at is not None
+
+    def test_unreferenced(self, client, attestations, monkeypatch, tmp_path, capsys):
+        """Test archiving the attestations of paths outside of reports, as
+        if they had never been submitted"""
+        exported = client.get("/export/attestations").text.splitlines()
+        self.run(monkeypatch, "--unreferenced", "--archive-dir", str(tmp_path))
+        assert "Archived 4 attestations of 2 paths" in capsys.readouterr().out
+
+        [archive] = tmp_path.iterdir()
+        archived = gzip.decompress(archive.read_bytes()).decode().splitlines()
+        assert sorted(json.loads(line)["output_path"] for line in archived) == [
+            "/nix/store/aaa-hello", "/nix/store/aaa-hello", "/nix/store/bbb-curl", "/nix/store/bbb-curl"]
+        # Together with what is left, the archive is the whole export
+        remaining = client.get("/export/attestations").text.splitlines()
+        assert sorted(archived + remaining) == sorted(exported)
+
+        assert [e["output_path"] for e in client.get("/nondeterministic").json()] == ["/nix/store/test456-dep1"]
+        assert client.get("/users/agreement").json() == [
+            {"user_a": "test_user", "user_b": "second_user", "agree_count": 0, "disagree_count": 1},
+        ]
+        assert client.get("/derivations/aaa-hello.drv").status_code == 404
+        with engine.connect() as conn:
+            assert conn.execute(text("SELECT count(*) FROM store_paths WHERE name IN ('hello', 'curl')")).scalar() == 0
+
+    def test_older_than(self, client, attestations, monkeypatch, tmp_path):
+        """Test archiving attestations by age"""
+        with engine.begin() as conn:
+            conn.execute(text(
+                "UPDATE attestations SET created_at = '2020-01-01 00:00:00' WHERE path_id = "
+                "(SELECT id FROM store_paths WHERE name = 'curl')"))
+        self.run(monkeypatch, "--older-than", "30", "--archive-dir", str(tmp_path))
+        paths = {json.loads(line)["output_path"] for line in client.get("/export/attestations").text.splitlines()}
+        assert paths == {"/nix/store/test456-dep1", "/nix/store/aaa-hello"}
+
+    def test_revoked(self, client, attestations, second_user, monkeypatch, tmp_path):
+        """Test archiving the attestations of users whose tokens were revoked"""
+        with engine.begin() as conn:
+            conn.execute(text("UPDATE tokens SET valid = 0 WHERE user_id = :user_id"), {"user_id": second_user["user_id"]})
+        response = client.post(
+            "/attestation/ccc-wget.drv",
+            json=[{"output_digest": "ccc", "output_name": "wget", "output_hash": "sha256:abc", "output_sig": "sig"}],
+            headers={"Authorization": f"Bearer {second_user['token']}"}
+        )
+        assert response.status_code == 401
+
+        self.run(monkeypatch, "--revoked", "--archive-dir", str(tmp_path))
+        users = {json.loads(line)["user_name"] for line in client.get("/export/attestations").text.splitlines()}
+        assert users == {"test_user"}
+        assert client.get("/nondeterministic").json() == []
+        assert client.get("/users/agreement").json() == []
+
+    def test_published_report_is_stale(self, client, attestations, monkeypatch, tmp_path):
+        """Test that archiving attestations of a report's paths has the
+        report published again"""
+        report_publisher = publisher.Publisher(TestingSessionLocal, tmp_path / "published")
+        db = TestingSessionLocal()
+        try:
+            assert report_publisher.publish_stale(db) == ["test_report"]
+            self.run(monkeypatch, "--unreferenced", "--archive-dir", str(tmp_path / "unreferenced"))
+            assert report_publisher.publish_stale(db) == []
+            with engine.begin() as conn:
+                conn.execute(text("UPDATE attestations SET created_at = '2020-01-01 00:00:00'"))
+            self.run(monkeypatch, "--older-than", "30", "--archive-dir", str(tmp_path / "old"))
+            assert report_publisher.publish_stale(db) == ["test_report"]
+        finally:
+            db.close()
+        _, text_file, _ = publisher.report_files(tmp_path / "published", "test_report")
+        assert "test456-dep1 No builds" in text_file.read_text()
+
+    def test_dry_run(self, client, attestations, monkeypatch, tmp_path, capsys):
+        """Test that a dry run only counts"""
+        self.run(monkeypatch, "--unreferenced", "--dry-run")
+        assert "Would archive 4 attestations" in capsys.readouterr().out
+        assert len(client.get("/export/attestations").text.splitlines()) == 6
+
+
 class TestLinkPatternEndpoints:
     """Tests for /link_patterns endpoints"""
 
@@ -427,10 +1958,7 @@ class TestLinkPatternEndpoints:
 
         response = client.get("/link_patterns")
         assert response.status_code == 200
-        data = response.json()
-        assert len(data) == 1
-        assert data[0]["pattern"] == ".*chromium.*"
-        assert data[0]["link"] == "https://bugs.chromium.org"
+        assert response.json() == [{"pattern": ".*chromium.*", "link": "https://bugs.chromium.org"}]
 
 
 class TestSignatureEndpoints:
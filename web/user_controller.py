@@ -1,5 +1,5 @@
 from . import models
-from .db import SessionLocal, engine
+from .db import SessionLocal
 from sqlalchemy.orm import Session
 
 def get_db():
@@ -10,11 +10,11 @@ def get_db():
         db.close()
 
 
-db = SessionLocal()
-
 def create_user(name: str, token: str = ""):
-    user = models.User.create(db, name=name)
-    token = models.Token.create(db, user=user, value=token)
-    print(f"Created user {name} with token {token.value}")
-
-
+    db = SessionLocal()
+    try:
+        user = models.User.create(db, name=name)
+        token = models.Token.create(db, user=user, value=token)
+        print(f"Created user {name} with token {token.value}")
+    finally:
+        db.close()
@@ -0,0 +1,214 @@
+"""
+Signature verification
+Checks attestation signatures against the public keys users registered,
+in batches on a worker pool so ingest doesn't wait for it
+"""
+import os
+import threading
+import traceback
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+from sqlalchemy import bindparam, select, update
+from sqlalchemy.orm import Session
+
+from . import crud, models, nix
+
+try:
+    from cryptography.exceptions import InvalidSignature
+    from cryptography.hazmat.primitives.asymmetric.ed25519 import Ed25519PublicKey
+except ImportError:
+    # Without cryptography signatures are stored unverified
+    Ed25519PublicKey = None
+
+BATCH_SIZE = 256
+MAX_WORKERS = int(os.environ.get("LILA_VERIFY_WORKERS", "1"))
+
+# Columns identifying the verified attestation. The signature is part of
+# it so a resubmission with another signature can't verify the stored one.
+IDENTITY = ["path_id", "user_id", "drv_id", "output_hash", "sig_key_id", "sig"]
+
+executor = ThreadPoolExecutor(max_workers=MAX_WORKERS, thread_name_prefix="lila-verify")
+
+# Attestations waiting for verification. Each running flush drains it a
+# batch at a time, so signatures arriving while it works are picked up
+# by the next batch rather than scheduling work of their own.
+_pending: list[dict] = []
+_lock = threading.Lock()
+_flushes = 0
+
+
+def signed(rows: list[dict], fingerprints: list) -> list[dict]:
+    """Items for verify_batch from the rows crud.create_attestations
+    returned and their fingerprints, skipping unsigned rows and rows
+    without a fingerprint"""
+    return [
+        dict(row, fingerprint=fingerprint)
+        for row, fingerprint in zip(rows, fingerprints)
+        if row["sig_key_id"] is not None and fingerprint is not None
+    ]
+
+
+def submit(session_factory, rows: list[dict], output_hash_map: list):
+    """Queue the signed attestations among rows, as returned by
+    crud.create_attestation, for verification
+
+    Only outputs that came with their NAR size and references can be
+    checked, as the signature covers those too.
+    """
+    global _flushes
+    if Ed25519PublicKey is None:
+        return
+    items = signed(rows, [
+        nix.fingerprint(
+            nix.store_path(item.output_digest, item.output_name),
+            item.output_hash, item.nar_size, item.references)
+        if item.nar_size is not None and item.references is not None else None
+        for item in output_hash_map
+    ])
+    if not items:
+        return
+    with _lock:
+        _pending.extend(items)
+        if _flushes >= MAX_WORKERS:
+            return
+        _flushes += 1
+    executor.submit(_flush, session_factory)
+
+
+def recheck(session_factory, user_id: int):
+    """Queue the signed attestations of a user that were never checked for
+    verification, such as those stored before the user registered a key"""
+    if Ed25519PublicKey is None:
+        return
+    executor.submit(_recheck, session_factory, user_id)
+
+
+def _recheck(session_factory, user_id: int):
+    db = session_factory()
+    try:
+        after = 0
+        while True:
+            items = unchecked(db, user_id, after, BATCH_SIZE)
+            if not items:
+                return
+            verify_batch(db, items)
+            after = items[-1]["id"]
+    except Exception:
+        db.rollback()
+        traceback.print_exc()
+    finally:
+        db.close()
+
+
+def unchecked(db: Session, user_id: int, after: int, limit: int) -> list[dict]:
+    """Items for verify_batch for the first unchecked signed attestations
+    of a user with an id above after, among those stored with their NAR
+    size
+
+    Their fingerprints are rebuilt from the stored references of their
+    path. Those skip self-references and hold what every submitter sent,
+    so a few candidates are tried rather than one.
+    """
+    rows = db.execute(
+        select(
+            models.Attestation.id, *(models.Attestation.__table__.c[k] for k in IDENTITY),
+            models.Attestation.nar_size, models.StorePath.digest, models.StorePath.name)
+        .join(models.StorePath, models.StorePath.id == models.Attestation.path_id)
+        .where(
+            models.Attestation.user_id == user_id,
+            models.Attestation.id > after,
+            models.Attestation.sig_verified.is_(None),
+            models.Attestation.sig_key_id.is_not(None),
+            models.Attestation.nar_size.is_not(None))
+        .order_by(models.Attestation.id)
+        .limit(limit)
+    ).all()
+    references = defaultdict(list)
+    for clause in crud.in_clauses(db, models.StorePathReference.path_id, [row.path_id for row in rows]):
+        for ref in db.execute(
+                select(models.StorePathReference.path_id, models.StorePath.digest, models.StorePath.name)
+                .join(models.StorePath, models.StorePath.id == models.StorePathReference.reference_id)
+                .where(clause)):
+            references[ref.path_id].append(nix.store_path(ref.digest, ref.name))
+    items = []
+    for row in rows:
+        path = nix.store_path(row.digest, row.name)
+        refs = references[row.path_id]
+        items.append({
+            "id": row.id,
+            **{k: getattr(row, k) for k in IDENTITY},
+            "fingerprints": [
+                nix.fingerprint(path, row.output_hash, row.nar_size, refs),
+                nix.fingerprint(path, row.output_hash, row.nar_size, refs + [path]),
+            ],
+        })
+    return items
+
+
+def _flush(session_factory):
+    global _flushes
+    while True:
+        with _lock:
+            batch = _pending[:BATCH_SIZE]
+            del _pending[:BATCH_SIZE]
+            if not batch:
+                _flushes -= 1
+                return
+        db = session_factory()
+        try:
+            verify_batch(db, batch)
+        except Exception:
+            db.rollback()
+            traceback.print_exc()
+        finally:
+            db.close()
+
+
+def valid(key, sig: bytes, fingerprint: str) -> bool:
+    try:
+        key.verify(sig, fingerprint.encode())
+        return True
+    except InvalidSignature:
+        return False
+
+
+def verify_batch(db: Session, items: list[dict]):
+    """Check the signatures of items and store the outcome
+
+    Signatures by keys the user hasn't registered are left unverified.
+    Items may carry candidate "fingerprints" instead of the one that was
+    signed. Those verify if any candidate matches, and are left unverified
+    if none does, as what was signed may not be among them.
+    """
+    user_ids = {item["user_id"] for item in items}
+    key_ids = {item["sig_key_id"] for item in items}
+    keys = {
+        (row.user_id, row.sig_key_id): Ed25519PublicKey.from_public_bytes(row.public_key)
+        for row in db.execute(
+            select(models.UserKey.user_id, models.SigningKey.id.label("sig_key_id"), models.UserKey.public_key)
+            .join(models.SigningKey, models.SigningKey.name == models.UserKey.name)
+            .where(models.UserKey.user_id.in_(user_ids), models.SigningKey.id.in_(key_ids)))
+    }
+    if not keys:
+        return
+    results = []
+    for item in items:
+        key = keys.get((item["user_id"], item["sig_key_id"]))
+        if key is None:
+            continue
+        candidates = item["fingerprints"] if "fingerprints" in item else [item["fingerprint"]]
+        verified = any(valid(key, item["sig"], fingerprint) for fingerprint in candidates)
+        if not verified and "fingerprints" in item:
+            continue
+        results.append({**{f"b_{k}": item[k] for k in IDENTITY}, "b_verified": verified})
+    if not results:
+        return
+    table = models.Attestation.__table__
+    db.execute(
+        update(table)
+        .where(*(table.c[k] == bindparam(f"b_{k}") for k in IDENTITY))
+        .values(sig_verified=bindparam("b_verified")),
+        results)
+    db.commit()
+
@@ -1,28 +1,43 @@
 """
 Report view routes
 """
-from collections import defaultdict
+import asyncio
+from collections import Counter, defaultdict
 import json
 import random
 import re
 import typing as t
+from urllib.parse import quote
 from fastapi import APIRouter, Depends, Header, HTTPException, Response, Request
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import JSONResponse, StreamingResponse
 from sqlalchemy.orm import Session
 
-from .. import crud, models
-from ..common import get_db, get_token, templates
+from .. import crud, events, models, worker
+from ..report_graph import NO_STATUS, STATUSES, report_graph
+from ..common import get_db, get_session_factory, get_token, templates
 
 router = APIRouter()
 
+STATUS_ICONS = {
+    "No builds": "❔ ",
+    "One build": "❎ ",
+    "Partially reproduced": "❕ ",
+    "Successfully reproduced": "✅ ",
+    "Consistently nondeterministic": "❌ ",
+}
+
+# Seconds between SSE comments keeping idle event streams open
+EVENTS_KEEPALIVE = 15
+
+# Levels of the dependency tree rendered in the report page, and in each
+# fragment loaded when expanding a deeper node
+TREE_DEPTH = 2
+
 
 def report_out_paths(report):
     """Extract output paths from report"""
-    paths = []
-    for component in report['components']:
-        for prop in component['properties']:
-            if prop['name'] == "nix:out_path":
-                paths.append(prop['value'])
-    return paths
+    return [path for _, path in crud.report_components(report)]
 
 
 def report_elements(report):
@@ -44,63 +59,146 @@ def report_elements(report):
     return paths
 
 
-def printtree(root, deps, results, cur_indent=0, seen=None):
-    """Generate text tree view of dependencies"""
-    if seen is None:
-        seen = {}
-    if root in seen:
-        return "  " * cur_indent + "...\n"
-    seen[root] = True
+def report_summaries(db: Session, name: str):
+    """Recompute the reproducibility status of every output path in a
+    report, returning the number of paths of each status
 
-    result = "  " * cur_indent + root[11:]
-    if root in results:
-        result = result + " " + results[root] + "\n"
+    The report is marked stale, so the publisher renders its static pages
+    again rather than waiting for the next attestation.
+    """
+    report = crud.report(db, name)
+    if report == None:
+        raise ValueError(f"Report {name} not found")
+    counts = Counter(crud.path_summaries(db, report_out_paths(report)).values())
+    crud.set_report_stale(db, name, True)
+    return dict(counts)
+
+
+def job_accepted(job_id: int) -> Response:
+    """202 response pointing the client to the status of a background job"""
+    return JSONResponse(
+        status_code=202,
+        content={"job": job_id},
+        headers={"Location": f"/jobs/{job_id}"},
+    )
+
+
+def printtree(graph, status, counts):
+    """Generate text tree view of dependencies, with the statuses below
+    each node"""
+    lines = []
+    seen = bytearray(len(graph))
+    stack = [(graph.root, 0)]
+    while stack:
+        node, indent = stack.pop()
+        if seen[node]:
+            lines.append("  " * indent + "...")
+            continue
+        seen[node] = 1
+        line = "  " * indent + graph.nodes[node][11:]
+        if status[node] != NO_STATUS:
+            line += " " + STATUSES[status[node]]
+        below = graph.below(counts, node)
+        if below:
+            line += f" (below: {rollup(below)})"
+        lines.append(line)
+        stack.extend((child, indent + 2) for child in reversed(graph.children(node)))
+    return "\n".join(lines) + "\n"
+
+
+def report_statuses(db: Session, name: str, graph):
+    """Statuses of all nodes of a report and their rollups below its root
+
+    They are computed once per revision of the report and change of the
+    statuses of its paths, so expanding nodes one after the other doesn't
+    query the whole report every time.
+    """
+    version = crud.report_status_version(db, name)
+    cached = graph.cached_statuses(version)
+    if cached is None:
+        status = graph.statuses(crud.path_summaries(db, graph.paths()))
+        cached = status, graph.rollups(status)
+        graph.cache_statuses(version, *cached)
+    return cached
+
+
+def node_rollups(db: Session, name: str, graph, node: int):
+    """Statuses of all nodes of a report and their rollups, which cover
+    node even if the report's root doesn't reach it"""
+    status, counts = report_statuses(db, name, graph)
+    if node != graph.root and graph.dependents()[node] == 0:
+        counts = graph.rollups(status, node)
+    return status, counts
+
+
+def tree_nodes(graph, root: int, depth: int) -> set[int]:
+    """Nodes treechildren renders below root, depth levels deep"""
+    nodes = {root}
+    level = [root]
+    for _ in range(depth):
+        level = [d for node in level for d in graph.children(node) if d not in nodes]
+        nodes.update(level)
+    return nodes - {root}
+
+
+def icon(result):
+    return STATUS_ICONS.get(result, "")
+
+
+def rollup(below: dict) -> str:
+    """Short form of the number of nodes of each status below a node"""
+    return ", ".join(f"{icon(status)}{n}" for status, n in below.items())
+
+
+def treesummary(graph, node, status, counts):
+    ref = graph.nodes[node]
+    result = f'<summary title="{ref}">'
+    if status[node] != NO_STATUS:
+        node_status = STATUSES[status[node]]
+        result = result + f'<span title="{node_status}" data-path="{ref}">' + icon(node_status) + "</span>" + ref[44:] + " "
     else:
-        result = result + "\n"
-    for dep in deps:
-        if dep['ref'] == root and 'dependsOn' in dep:
-            for d in dep['dependsOn']:
-                result += printtree(d, deps, results, cur_indent+2, seen)
-    return result
+        result = result + ref[44:]
+    below = graph.below(counts, node)
+    if below:
+        title = ", ".join(f"{n} {status}" for status, n in below.items())
+        result = result.rstrip(" ") + f' <small class="rollup" title="Below: {title}">({rollup(below)})</small>'
+    return result + "</summary>\n"
+
+
+def treechildren(graph, root, status, counts, depth, seen):
+    """HTML list of the dependencies of root, depth levels deep
+
+    Nodes below that are rendered collapsed, with a data-node attribute
+    so the page can fetch their subtree when they are expanded.
+    """
+    result = "<ul>"
+    for d in graph.children(root):
+        ref = graph.nodes[d]
+        if d in seen:
+            result += f'<li><details class="{ref}" open><summary title="{ref}">...</summary></details></li>'
+        elif depth > 1 or not graph.has_children(d):
+            seen.add(d)
+            result += f'<li><details class="{ref}" open>'
+            result += treesummary(graph, d, status, counts)
+            result += treechildren(graph, d, status, counts, depth - 1, seen)
+            result += "</details></li>"
+        else:
+            result += f'<li><details class="{ref}" data-node="{ref}">'
+            result += treesummary(graph, d, status, counts)
+            result += "</details></li>"
+    return result + "</ul>"
 
 
-def htmlview(root, deps, results, link_patterns):
-    """Generate HTML view of report with reproducibility status"""
+def generatetree(graph, status, counts, depth):
+    """HTML tree view of the top depth levels of the dependencies of the root"""
+    return treesummary(graph, graph.root, status, counts) + treechildren(graph, graph.root, status, counts, depth, {graph.root})
 
-    def icon(result):
-        if result == "No builds":
-            return "❔ "
-        elif result == "One build":
-            return "❎ "
-        elif result == "Partially reproduced":
-            return "❕ "
-        elif result == "Successfully reproduced":
-            return "✅ "
-        elif result == "Consistently nondeterministic":
-            return "❌ "
-        else:
-            return ""
-
-    def generatetree(root, seen):
-        if root in seen:
-            return f'<summary title="{root}">...</summary>'
-        seen[root] = True
 
-        result = f'<summary title="{root}">'
-        if root in results:
-            result = result + f'<span title="{results[root]}">' + icon(results[root]) + "</span>" + root[44:] + " "
-        else:
-            result = result + root[44:]
-        result = result + "</summary>\n"
-        result = result + "<ul>"
-        for dep in deps:
-            if dep['ref'] == root and 'dependsOn' in dep:
-                for d in dep['dependsOn']:
-                    result += f'<li><details class="{d}" open>'
-                    result += generatetree(d, seen)
-                    result += "</details></li>"
-        result = result + "</ul>"
-        return result
+def htmlview(graph, results, link_patterns):
+    """Generate HTML view of report with reproducibility status"""
+    root = graph.nodes[graph.root]
+    status = graph.statuses(results)
+    counts = graph.rollups(status)
 
     def number_and_percentage(n: int, total: int) -> str:
         return f"{n} ({str(100*n/total)[:4]}%)"
@@ -176,7 +274,8 @@ def htmlview(root, deps, results, link_patterns):
         "not_checked_n": not_checked_n,
         "not_checked_one_build": not_checked_one_build,
         "not_checked_no_builds": not_checked_no_builds,
-        "tree": generatetree(root, {}),
+        "tree": generatetree(graph, status, counts, TREE_DEPTH),
+        "icons": STATUS_ICONS,
     }
 
 
@@ -209,14 +308,29 @@ def derivations_suggested_for_rebuilding(
     return suggestions[:50]
 
 
+def cost_key(cost: tuple):
+    """Sort key of a (NAR size, build duration) pair from crud.path_costs:
+    by build duration where known, then by NAR size, then the unknown"""
+    nar_size, build_duration = cost
+    return (build_duration is None, build_duration or 0, nar_size is None, nar_size or 0)
+
+
 # Suggested rebuilds
 @router.get("/{name}/suggest")
 def suggest_derivations_for_rebuilding(
     name: str,
+    strategy: t.Literal["random", "cheapest", "impact"] = "random",
     token: str = Depends(get_token),
     db: Session = Depends(get_db),
 ):
-    """Get suggested derivations for rebuilding"""
+    """Get suggested derivations for rebuilding
+
+    In random order by default, so rebuilders asking at the same time
+    take different ones. cheapest puts those that took the least time to
+    build first, or failing that have the smallest output. impact puts
+    those the most of the report depends on first, cheapest first among
+    equals.
+    """
     report = crud.report(db, name)
     if report == None:
         raise HTTPException(status_code=404, detail="Report not found")
@@ -224,8 +338,138 @@ def suggest_derivations_for_rebuilding(
 
     user = crud.get_user_with_token(db, token)
     suggestions = list(crud.suggest(db, elements, user).values())
-    random.shuffle(suggestions)
-    return suggestions[:50]
+    if strategy == "random":
+        random.shuffle(suggestions)
+        suggestions = suggestions[:50]
+    costs = crud.path_costs(db, [s['out_path'] for s in suggestions])
+    cost = lambda s: costs.get(s['out_path'], (None, None))
+    if strategy == "cheapest":
+        suggestions.sort(key=lambda s: cost_key(cost(s)))
+    elif strategy == "impact":
+        graph = report_graph(db, name, report_out_paths)
+        dependents = graph.dependents()
+        impact = lambda s: dependents[graph.ids[s['out_path']]] if s['out_path'] in graph.ids else 0
+        suggestions.sort(key=lambda s: (-impact(s), cost_key(cost(s))))
+    suggestions = suggestions[:50]
+    for s in suggestions:
+        s['nar_size'], s['build_duration'] = cost(s)
+    return suggestions
+
+
+@router.post("/{name}/summaries")
+def rebuild_summaries(
+    name: str,
+    token: str = Depends(get_token),
+    db: Session = Depends(get_db),
+    session_factory = Depends(get_session_factory),
+):
+    """Recompute the path summaries of a report in the background"""
+    user = crud.get_user_with_token(db, token)
+    if user == None:
+        raise HTTPException(status_code=401, detail="User not found")
+    if crud.report(db, name) == None:
+        raise HTTPException(status_code=404, detail="Report not found")
+    job_id = worker.submit(db, session_factory, "summaries", report_summaries, name)
+    return job_accepted(job_id)
+
+
+@router.get("/{name}/events")
+async def report_events(
+    request: Request,
+    name: str,
+    session_factory = Depends(get_session_factory),
+):
+    """Stream status changes of the report's output paths as Server-Sent Events
+
+    Streams stay open for long, so each query takes a session of its own
+    instead of holding one for the life of the stream.
+    """
+    def load_graph():
+        session = session_factory()
+        try:
+            return report_graph(session, name, report_out_paths)
+        finally:
+            session.close()
+
+    def summaries(paths):
+        session = session_factory()
+        try:
+            return crud.path_summaries(session, paths)
+        finally:
+            session.close()
+
+    graph = await run_in_threadpool(load_graph)
+    if graph is None:
+        raise HTTPException(status_code=404, detail="Report not found")
+    subscription = events.subscribe(graph.paths())
+
+    async def stream():
+        try:
+            while not await request.is_disconnected():
+                try:
+                    paths = await asyncio.wait_for(subscription.queue.get(), EVENTS_KEEPALIVE)
+                except asyncio.TimeoutError:
+                    yield ": keepalive\n\n"
+                    continue
+                for path, status in (await run_in_threadpool(summaries, paths)).items():
+                    yield f"data: {json.dumps({'path': path, 'status': status})}\n\n"
+        finally:
+            events.unsubscribe(subscription)
+
+    return StreamingResponse(
+        stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache"},
+    )
+
+
+@router.get("/{name}/tree")
+def report_tree_fragment(
+    name: str,
+    node: str,
+    db: Session = Depends(get_db),
+):
+    """HTML fragment with the subtree below a node of the report tree"""
+    graph = report_graph(db, name, report_out_paths)
+    if graph is None:
+        raise HTTPException(status_code=404, detail="Report not found")
+    node_id = graph.ids.get(node)
+    if node_id is None:
+        raise HTTPException(status_code=404, detail="Node not found")
+
+    _, counts = node_rollups(db, name, graph, node_id)
+    # The rendered nodes get their current status
+    status = graph.statuses(crud.path_summaries(db, graph.paths(tree_nodes(graph, node_id, TREE_DEPTH))))
+    return Response(
+        content=treechildren(graph, node_id, status, counts, TREE_DEPTH, {node_id}),
+        media_type="text/html")
+
+
+@router.get("/{name}/rollup")
+def report_rollup(
+    name: str,
+    node: t.Optional[str] = None,
+    db: Session = Depends(get_db),
+):
+    """Get the number of paths of each status below a node of the report
+    tree (by default its root) and below each of its children"""
+    graph = report_graph(db, name, report_out_paths)
+    if graph is None:
+        raise HTTPException(status_code=404, detail="Report not found")
+    node_id = graph.root if node is None else graph.ids.get(node)
+    if node_id is None:
+        raise HTTPException(status_code=404, detail="Node not found")
+
+    status, counts = node_rollups(db, name, graph, node_id)
+
+    def entry(i):
+        return {
+            "node": graph.nodes[i],
+            "status": STATUSES[status[i]] if status[i] != NO_STATUS else None,
+            "below": graph.below(counts, i),
+        }
+
+    return {**entry(node_id), "children": [entry(i) for i in graph.children(node_id)]}
 
 
 @router.get("/{name}")
@@ -236,29 +480,31 @@ async def report(
     db: Session = Depends(get_db),
 ):
     """Get a specific report in various formats (HTML, JSON, text)"""
-    report = crud.report(db, name)
-    if report == None:
-        raise HTTPException(status_code=404, detail="Report not found")
-
     if 'application/vnd.cyclonedx+json' in accept:
+        report = crud.report(db, name)
+        if report == None:
+            raise HTTPException(status_code=404, detail="Report not found")
         return Response(
             content=json.dumps(report),
             media_type='application/vnd.cyclonedx+json')
 
-    paths = report_out_paths(report)
-    root = report['metadata']['component']['bom-ref']
-    results = crud.path_summaries(db, paths)
+    graph = report_graph(db, name, report_out_paths)
+    if graph is None:
+        raise HTTPException(status_code=404, detail="Report not found")
+    results = crud.path_summaries(db, graph.paths())
 
     if 'text/html' in accept:
-        link_patterns = db.query(models.LinkPattern).all()
+        context = htmlview(graph, results, crud.link_patterns(db))
+        context["report_url"] = f"/reports/{quote(name)}"
         return templates.TemplateResponse(
             request=request,
             name="report.html",
-            context=htmlview(root, report['dependencies'], results, link_patterns)
+            context=context
         )
     else:
+        status = graph.statuses(results)
         return Response(
-            content=printtree(root, report['dependencies'], results),
+            content=printtree(graph, status, graph.rollups(status)),
             media_type='text/plain')
 
 
@@ -266,13 +512,22 @@ async def report(
 def define_report(
     name: str,
     definition: dict,  # schemas.ReportDefinition if you have it
+    background: bool = False,
     token: str = Depends(get_token),
     db: Session = Depends(get_db),
+    session_factory = Depends(get_session_factory),
 ):
-    """Define or update a report"""
+    """Define or update a report
+
+    With background=true the report is stored by a background job and
+    the response is a 202 pointing to the job status.
+    """
     user = crud.get_user_with_token(db, token)
     if user == None:
         raise HTTPException(status_code=401, detail="User not found")
+    if background:
+        job_id = worker.submit(db, session_factory, "define_report", crud.define_report, name, definition)
+        return job_accepted(job_id)
     crud.define_report(db, name, definition)
     return {
         "Report defined"
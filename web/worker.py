@@ -0,0 +1,76 @@
+"""
+Background job runner
+Runs heavy report computations off the request path on a thread pool,
+tracking their progress in the jobs table
+
+Jobs run in the server processes, so those unfinished when the server
+stops are lost. Run `python -m web.worker --fail-interrupted` before
+starting it again, while no server process runs, to mark them failed.
+"""
+import argparse
+import os
+import traceback
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from . import crud
+from .db import SessionLocal
+
+executor = ThreadPoolExecutor(
+    max_workers=int(os.environ.get("LILA_JOB_WORKERS", "2")),
+    thread_name_prefix="lila-job",
+)
+
+# Futures of the jobs submitted by this process, so callers in the
+# same process (tests, CLI tools) can wait for completion.
+_futures: dict[int, Future] = {}
+
+
+def _run(session_factory, job_id: int, fn, args):
+    db = session_factory()
+    try:
+        crud.update_job(db, job_id, "running")
+        result = fn(db, *args)
+        crud.update_job(db, job_id, "done", result=result)
+    except Exception as e:
+        db.rollback()
+        traceback.print_exc()
+        crud.update_job(db, job_id, "failed", error=str(e))
+    finally:
+        db.close()
+
+
+def submit(db, session_factory, kind: str, fn, *args) -> int:
+    """Record a new job and schedule fn(db, *args) on the pool
+
+    The job gets its own session from session_factory, as the request
+    session is closed by the time the job runs.
+    """
+    job_id = crud.create_job(db, kind)
+    future = executor.submit(_run, session_factory, job_id, fn, args)
+    _futures[job_id] = future
+    future.add_done_callback(lambda _: _futures.pop(job_id, None))
+    return job_id
+
+
+def wait(job_id: int, timeout: float = None):
+    """Block until a job submitted by this process has finished"""
+    future = _futures.get(job_id)
+    if future is not None:
+        future.result(timeout=timeout)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--fail-interrupted", action="store_true", required=True,
+                        help="mark the jobs left unfinished by stopped servers as failed")
+    parser.parse_args(argv)
+    db = SessionLocal()
+    try:
+        n = crud.fail_interrupted_jobs(db)
+    finally:
+        db.close()
+    print(f"Marked {n} interrupted jobs as failed")
+
+
+if __name__ == "__main__":
+    main()